@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import importlib.util
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'search.metrics.timing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +90,85 @@ DATABASES = {
     }
 }
 
+# Conexiones persistentes. Con psycopg 3 se usa el pool nativo de Django: uno
+# por proceso (cada worker de uvicorn y cada worker de reindex arma el suyo).
+# Bajo ASGI el código sync de cada request (vistas de detalle, señales que
+# cierran la conexión) corre en un thread que Django crea para ese request
+# (ThreadSensitiveContext) y descarta al terminar, así que CONN_MAX_AGE casi
+# no reutiliza conexiones; el pool sí. POSTGRES_POOL=0 vuelve a conexiones
+# persistentes por thread. En ambos casos se verifica la conexión antes de usarla.
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+if os.getenv("POSTGRES_POOL", "1") == "1" and importlib.util.find_spec("psycopg_pool"):
+    DATABASES["default"]["OPTIONS"] = {"pool": {
+        "min_size": int(os.getenv("POSTGRES_POOL_MIN", "2")),
+        "max_size": int(os.getenv("POSTGRES_POOL_MAX", "10")),
+        "timeout": float(os.getenv("POSTGRES_POOL_TIMEOUT", "10")),     # espera máx. por una conexión libre
+        "max_idle": float(os.getenv("POSTGRES_POOL_MAX_IDLE", "300")),  # cierra las ociosas
+    }}
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("POSTGRES_CONN_MAX_AGE", "60"))
+
+
+# Elasticsearch (search/es.py): clientes creados en el primer uso, por proceso.
+# Cada perfil tiene su timeout y reintentos; los de la API pasan por el circuit
+# breaker (ES_BREAKER_FAILURES errores seguidos lo abren y durante
+# ES_BREAKER_RESET segundos se responde sin llamar a ES).
+ELASTICSEARCH = {
+    "URL": os.getenv("ELASTICSEARCH_URL", "http://elastic:9200"),
+    "CONNECTIONS": int(os.getenv("ES_CONNECTIONS", "100")),   # por nodo y por proceso
+    "BREAKER_FAILURES": int(os.getenv("ES_BREAKER_FAILURES", "5")),
+    "BREAKER_RESET": float(os.getenv("ES_BREAKER_RESET", "30")),
+    "PROFILES": {
+        # perfil: timeout (s), reintentos, breaker
+        "search":  {"timeout": float(os.getenv("ES_TIMEOUT_SEARCH", "5")),  "retries": 1, "breaker": True},
+        "suggest": {"timeout": float(os.getenv("ES_TIMEOUT_SUGGEST", "1")), "retries": 0, "breaker": True},
+        "export":  {"timeout": float(os.getenv("ES_TIMEOUT_EXPORT", "30")), "retries": 2, "breaker": True},
+        # reindex / ingest_stock: lotes grandes, esperan a ES en vez de cortar
+        "batch":   {"timeout": float(os.getenv("ES_TIMEOUT_BATCH", "120")), "retries": 3, "breaker": False},
+    },
+}
+
+
+# Cache de respuestas de búsqueda (search/cache.py): por proceso, LRU acotado a
+# SEARCH_CACHE_ENTRIES respuestas y con TTL de SEARCH_CACHE_TTL segundos. Con
+# ES caído (breaker abierto) se sirve la última respuesta buena hasta
+# SEARCH_STALE_TTL segundos.
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "30"))
+SEARCH_STALE_TTL = int(os.getenv("SEARCH_STALE_TTL", "600"))
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "search": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "search",
+        "TIMEOUT": max(SEARCH_CACHE_TTL, SEARCH_STALE_TTL),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("SEARCH_CACHE_ENTRIES", "2000")),
+            "CULL_FREQUENCY": 10,   # al llenarse descarta el 10% menos usado
+        },
+    },
+}
+
+
+# Autocompletado: "memory" = índice de prefijos que genera reindex en SUGGEST_DIR
+# (cae a ES mientras no haya uno cargado); "es" = completion suggester de ES.
+SUGGEST_BACKEND = os.getenv("SUGGEST_BACKEND", "memory")
+SUGGEST_DIR = os.getenv("SUGGEST_DIR", str(BASE_DIR / "var" / "suggest"))
+
+# Requests más lentos que esto (ms) se registran con sus bodies ES en
+# SLOW_LOG_PATH (JSON por línea); `manage.py slowlog` los lista y los vuelve a
+# correr con el profile API. 0 = desactivado.
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_LOG_PATH = os.getenv("SLOW_LOG_PATH", str(BASE_DIR / "var" / "slow.jsonl"))
+
+# Navegación sin texto (sólo filtros): se cuentan hasta este número de hits y
+# más allá el total se informa como "10,000+". 0 = total exacto siempre.
+SEARCH_TRACK_TOTAL_HITS = int(os.getenv("SEARCH_TRACK_TOTAL_HITS", "10000"))
+
+# Tabla de cambios de stock (id, codigo, almacen, delta) que sigue
+# `ingest_stock --table`. Con esto reindex estampa cada artículo con el último
+# id que ya refleja y, al publicar, reaplica lo que entró mientras extraía.
+STOCK_CHANGES_TABLE = os.getenv("STOCK_CHANGES_TABLE", "")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
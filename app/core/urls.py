@@ -16,15 +16,24 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from search.api import search_items, search_clients, suggest_items, suggest_clients
+from search.metrics import metrics_view
+from search.api import (search_items, search_clients, search_all, suggest_items, suggest_clients,
+                        export_items, export_clients, item_detail, client_detail,
+                        items_detail, clients_detail, status)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/search/items", search_items),
     path("api/search/clients", search_clients),
+    path("api/search", search_all),
     path("api/suggest/items", suggest_items),
     path("api/suggest/clients", suggest_clients),
-
-    # path("api/items/<str:codigo>", item_detail),
-    # path("api/clients/<str:cliente_id>", client_detail),
+    path("api/export/items", export_items),
+    path("api/export/clients", export_clients),
+    path("api/items", items_detail),
+    path("api/items/<str:codigo>", item_detail),
+    path("api/clients", clients_detail),
+    path("api/clients/<str:cliente_id>", client_detail),
+    path("api/status", status),
+    path("metrics", metrics_view),
 ]
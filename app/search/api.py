@@ -1,56 +1,256 @@
-import os, json
-from django.http import JsonResponse
+import os, re, csv, json, base64, hashlib
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_GET
 from django.db import connection
-from elasticsearch import Elasticsearch
+from elasticsearch import ApiError
+from search.cache import cached_search, single_flight
+from search.models import ItemMonthlySales, ClientMonthlySales
+from search.metrics import timed
+from search.es import get_es, get_async_es, fail_fast, BREAKER
+from search.suggest import get_suggest_index, SUGGEST_FIELDS, TOP_K
 
-ES = Elasticsearch(os.getenv("ELASTICSEARCH_URL","http://elastic:9200"))
+try:
+    import orjson   # opcional: serializa varias veces más rápido que json
+except ImportError:
+    orjson = None
+
+# búsqueda, suggest, export y status son vistas async (get_async_es); detalle
+# sigue sync (consultas a Postgres). Los clientes salen de search/es.py
+# (timeouts por perfil + breaker).
 
 # -------- helpers
+def _json_default(o):
+    # Decimal, UUID, timedelta... igual que JsonResponse
+    return DjangoJSONEncoder().default(o)
+
+def _dumps(data):
+    if orjson:
+        return orjson.dumps(data, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+@timed("serialize")
+def _json(data, status=200):
+    """JsonResponse, pero con orjson cuando está instalado."""
+    if orjson is None:
+        return JsonResponse(data, status=status, safe=False)
+    return HttpResponse(_dumps(data), status=status, content_type="application/json")
+
 def _int(v, dflt):
     try:
         return int(v)
     except Exception:
         return dflt
 
+def _param(request, name):
+    # forma única de leer un parámetro de texto: la misma para la llave del
+    # cache (_normalized) y para armar la consulta
+    return (request.GET.get(name) or "").strip()
+
 def _list_param(request, name):
     # acepta ?marca=ACME&marca=XYZ o ?marca=ACME,XYZ
     vals = request.GET.getlist(name) or []
     if len(vals) == 1 and "," in vals[0]:
-        vals = [x.strip() for x in vals[0].split(",") if x.strip()]
-    return vals
+        vals = vals[0].split(",")
+    return [x.strip() for x in vals if x.strip()]
+
+def _size(request, default=20):
+    return min(max(_int(request.GET.get("size", default), 1), 1), 100)
+
+def _normalized(request, list_params=(), size=20):
+    # llave canónica para el cache: listas ordenadas, page/size acotados, sort en
+    # minúsculas. `size` es el default del endpoint: se omite sólo si coincide.
+    out = {}
+    for k in sorted(request.GET):
+        if k == "cursor":
+            out[k] = request.GET.get(k) or ""   # ?cursor= vacío también cambia la forma de la respuesta
+            continue
+        if k in list_params:
+            v = sorted(set(_list_param(request, k)))
+        elif k == "page":
+            v = max(_int(request.GET.get(k), 1), 1)
+        elif k == "size":
+            v = _size(request, size)
+        elif k == "stock_min":
+            v = _int(request.GET.get(k), 0)
+        elif k in ("sort", "format"):
+            v = _param(request, k).lower()
+        else:
+            v = _param(request, k)
+        if v in ("", []) or (k, v) in (("page", 1), ("size", size), ("sort", "relevance"), ("stock_min", 0)):
+            continue
+        out[k] = v
+    return out
+
+# -------- proyección de _source: ?fields=codigo,descripcion,... (o fields=all)
+SOURCE_FIELDS = {
+    "items": ["codigo", "descripcion", "categoria_division", "categoria_linea", "categoria_clase",
+              "categoria_subclase", "categoria_familia", "categoria_marca", "stock_total",
+              "stock_por_almacen", "qty_6m", "venta_usd_6m", "fecha_ultima_venta"],
+    "clients": ["cliente_id", "ruc", "razon_social", "tipo_cliente", "productos_top_6m",
+                "qty_6m", "venta_usd_6m", "fecha_ultima_venta"],
+}
+# lo que muestra un listado; stock_por_almacen / productos_top_6m se piden aparte
+DEFAULT_FIELDS = {
+    "items": ["codigo", "descripcion", "categoria_division", "categoria_linea", "categoria_familia",
+              "categoria_marca", "stock_total", "venta_usd_6m", "fecha_ultima_venta"],
+    "clients": ["cliente_id", "ruc", "razon_social", "tipo_cliente", "venta_usd_6m", "fecha_ultima_venta"],
+}
+
+def _source_fields(request, alias):
+    req = _list_param(request, "fields")
+    if "all" in req:
+        return SOURCE_FIELDS[alias]
+    return [f for f in SOURCE_FIELDS[alias] if f in req] or DEFAULT_FIELDS[alias]
+
+# -------- paginación: page/size o cursor (search_after [+ point-in-time])
+PIT_KEEP_ALIVE = "2m"
+
+def _encode_cursor(c):
+    return base64.urlsafe_b64encode(json.dumps(c, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def _decode_cursor(token):
+    if not token:
+        return {}
+    try:
+        c = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception:
+        return None
+    return c if isinstance(c, dict) and isinstance(c.get("sa"), list) else None
+
+def _query_hash(body):
+    # lo que define qué hits salen y en qué orden
+    key = {k: body.get(k) for k in ("query", "post_filter", "sort")}
+    return hashlib.md5(json.dumps(key, sort_keys=True, separators=(",", ":")).encode()).hexdigest()[:16]
+
+def _uses_pit(request):
+    # las páginas con point-in-time son únicas: no tiene sentido cachearlas
+    if "cursor" not in request.GET:
+        return False
+    cur = _decode_cursor(request.GET.get("cursor"))
+    return bool(cur.get("pit") if cur else _param(request, "pit") in ("1", "true"))
+
+async def _page(request, index, body, tiebreak, cursor_extra=None):
+    """Ejecuta la búsqueda paginando por page/size (from) o, si viene
+    ?cursor=, con search_after sobre el sort + tiebreak (codigo/cliente_id).
+    Con ?cursor=&pit=1 la primera página abre un point-in-time y el cursor
+    lo arrastra: las páginas siguientes ven la misma foto del índice.
+
+    El cursor lleva un hash de la consulta y el sort: no sirve para otra
+    búsqueda (otro q, filtros u orden).
+
+    Devuelve (respuesta ES, dict de paginación para la respuesta JSON) o
+    (None, respuesta de error): 400 si el cursor no es válido o no es de esta
+    búsqueda, 410 si su point-in-time ya venció."""
+    es = get_async_es()
+    size = _size(request)
+    if "cursor" not in request.GET:
+        page = max(_int(request.GET.get("page", 1), 1), 1)
+        r = await es.search(index=index, **{"from": (page - 1) * size, "size": size}, **body)
+        return r, {"page": page, "size": size}
+
+    cur = _decode_cursor(request.GET.get("cursor"))
+    if cur is None:
+        return None, _json({"error": "cursor inválido"}, status=400)
+    body = dict(body, sort=(body.get("sort") or ["_score"]) + [{tiebreak: "asc"}])
+    h = _query_hash(body)
+    pit = cur.get("pit")
+    if cur:
+        # con PIT, ES agrega _shard_doc como desempate implícito a los sort values
+        n = len(body["sort"])
+        if cur.get("q") != h or len(cur["sa"]) not in ((n, n + 1) if pit else (n,)):
+            return None, _json({"error": "el cursor no corresponde a esta búsqueda"}, status=400)
+        body["search_after"] = cur["sa"]
+        body["track_total_hits"] = False   # el total ya se informó en la primera página
+    if not cur and _param(request, "pit") in ("1", "true"):
+        pit = (await es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE))["id"]
+    try:
+        if pit:
+            r = await es.search(pit={"id": pit, "keep_alive": PIT_KEEP_ALIVE}, size=size, **body)
+            pit = r.get("pit_id", pit)
+        else:
+            r = await es.search(index=index, size=size, **body)
+    except ApiError as e:
+        # cursor armado a mano (sort values de otro tipo, pit inexistente) o PIT vencido
+        if not cur or e.status_code not in (400, 404):
+            raise
+        if pit and e.status_code == 404:
+            return None, _json({"error": "el cursor venció; vuelve a la primera página"}, status=410)
+        return None, _json({"error": "cursor inválido"}, status=400)
+
+    hits = r.get("hits", {}).get("hits", [])
+    nxt = None
+    if len(hits) == size:
+        nxt = _encode_cursor({"sa": hits[-1]["sort"], "q": h, **(cursor_extra or {}), **({"pit": pit} if pit else {})})
+    elif pit:
+        await es.close_point_in_time(id=pit)
+    return r, {"size": size, "next": nxt}
 
 # -------- ITEMS SEARCH
-@require_GET
-def search_items(request):
-    q = (request.GET.get("q") or "").strip()
-    page = max(_int(request.GET.get("page", 1), 1), 1)
-    size = min(max(_int(request.GET.get("size", 20), 1), 1), 100)
-    from_ = (page - 1) * size
+# facetas disponibles: parámetro -> campo keyword ("almacen" va por el nested)
+FACETS = {
+    "division": "categoria_division",
+    "linea":    "categoria_linea",
+    "clase":    "categoria_clase",
+    "subclase": "categoria_subclase",
+    "familia":  "categoria_familia",
+    "marca":    "categoria_marca",
+    "almacen":  "stock_por_almacen.almacen",
+}
+FACET_SIZE = 50
+
+# lo que se tipea o escanea en mostrador: una sola "palabra" con algún dígito
+CODE_RE = re.compile(r"^(?=.*\d)[\w\-./]{2,30}$")
+
+def _items_plan(q):
+    """'code' si q tiene forma de código de producto (term/prefijo sobre
+    codigo, sin highlight), si no 'text' (multi_match completo)."""
+    return "code" if CODE_RE.match(q or "") else "text"
+
+@timed("build")
+def _items_body(request, facets=(), plan="text"):
+    """query / highlight / sort de items a partir de q, filtros y sort.
+
+    plan="code" reemplaza el multi_match por exacto + prefijo sobre codigo y
+    no pide highlight.
+
+    Con `facets` (p.ej. ["marca", "almacen"]) agrega las agregaciones en el
+    mismo request; los filtros de faceta pasan a post_filter para que cada
+    faceta cuente sin su propio filtro (multi-selección) pero sí con el resto."""
+    q = _param(request, "q")
 
     # filtros
     stock_min = _int(request.GET.get("stock_min", 0), 0)
     almacenes  = _list_param(request, "almacen")
     marcas     = _list_param(request, "marca")
-    division   = request.GET.get("division")
-    linea      = request.GET.get("linea")
-    clase      = request.GET.get("clase")
-    subclase   = request.GET.get("subclase")
-    familia    = request.GET.get("familia")
-
-    # sort
-    sort_by = (request.GET.get("sort") or "relevance").lower()
+    division   = _param(request, "division")
+    linea      = _param(request, "linea")
+    clase      = _param(request, "clase")
+    subclase   = _param(request, "subclase")
+    familia    = _param(request, "familia")
+
+    # sort (sin q no hay score: no se ordena ni desempata por _score)
+    sort_by = _param(request, "sort").lower() or "relevance"
+    score = ["_score"] if q else []
     sort = []
     if sort_by == "stock":
-        sort = [{"stock_total":"desc"}, "_score"]
+        sort = [{"stock_total":"desc"}] + score
     elif sort_by in ("ventas6m","ventas_6m"):
-        sort = [{"venta_usd_6m":"desc"}, "_score"]
+        sort = [{"venta_usd_6m":"desc"}] + score
     elif sort_by in ("ultima","fecha","ultima_venta","fecha_ultima_venta"):
-        sort = [{"fecha_ultima_venta":"desc"}, "_score"]
-    # por defecto relevance (no agregamos sort)
+        sort = [{"fecha_ultima_venta":"desc"}] + score
+    elif not q:
+        sort = [{"venta_usd_6m":"desc"}]   # navegación: los más vendidos primero
+    # con q, por defecto relevance (no agregamos sort)
 
     must = []
-    if q:
+    if q and plan == "code":
+        must.append({"bool": {"should": [
+            {"term": {"codigo": {"value": q, "boost": 10}}},   # exacto primero
+            {"match": {"codigo.prefix": q}}
+        ], "minimum_should_match": 1}})
+    elif q:
         must.append({
             "multi_match": {
                 "query": q,
@@ -66,25 +266,24 @@ def search_items(request):
                 "operator": "and"
             }
         })
-    else:
-        must.append({"match_all": {}})
 
     filters = []
     if stock_min > 0:
         filters.append({"range": {"stock_total": {"gte": stock_min}}})
 
-    # filtros exactos por término
-    if division: filters.append({"term": {"categoria_division": division}})
-    if linea:    filters.append({"term": {"categoria_linea": linea}})
-    if clase:    filters.append({"term": {"categoria_clase": clase}})
-    if subclase: filters.append({"term": {"categoria_subclase": subclase}})
-    if familia:  filters.append({"term": {"categoria_familia": familia}})
+    # filtros exactos por término (por faceta)
+    ff = {}
+    if division: ff["division"] = {"term": {"categoria_division": division}}
+    if linea:    ff["linea"]    = {"term": {"categoria_linea": linea}}
+    if clase:    ff["clase"]    = {"term": {"categoria_clase": clase}}
+    if subclase: ff["subclase"] = {"term": {"categoria_subclase": subclase}}
+    if familia:  ff["familia"]  = {"term": {"categoria_familia": familia}}
     if marcas:
-        filters.append({"terms": {"categoria_marca": marcas}})
+        ff["marca"] = {"terms": {"categoria_marca": marcas}}
 
     # filtro por almacén (nested)
     if almacenes:
-        filters.append({
+        ff["almacen"] = {
             "nested": {
                 "path": "stock_por_almacen",
                 "query": {
@@ -96,81 +295,282 @@ def search_items(request):
                     }
                 }
             }
-        })
+        }
 
-    query = {"bool": {"must": must, "filter": filters}}
+    facets = [f for f in facets if f in FACETS]
+    if not facets:
+        filters += ff.values()
+    if q:
+        query = {"bool": {"must": must, "filter": filters}}
+    else:
+        query = _browse_query(filters)
 
-    body = {
-        "from": from_,
-        "size": size,
-        "query": query,
-        "highlight": {
+    body = {"query": query}
+    if not q:
+        _browse(body)
+    elif plan != "code":
+        body["highlight"] = {
             "pre_tags":["<mark>"], "post_tags":["</mark>"],
             "fields": {"descripcion": {"fragment_size": 120, "number_of_fragments": 1}}
         }
-    }
     if sort: body["sort"] = sort
+    if facets:
+        if ff:
+            body["post_filter"] = {"bool": {"filter": list(ff.values())}}
+        body["aggs"] = {f: _facet_agg(f, [c for k, c in ff.items() if k != f]) for f in facets}
+    return body
+
+def _browse_query(filters):
+    # sólo contexto de filtro: sin scoring (y cacheable en el nodo)
+    return {"constant_score": {"filter": {"bool": {"filter": filters}}}}
+
+def _browse(body):
+    # sin texto: total contado hasta el tope configurado ("10,000+"); con 0,
+    # exacto (sin la clave ES corta igual en 10.000)
+    body["track_total_hits"] = settings.SEARCH_TRACK_TOTAL_HITS or True
+    return body
+
+def _facet_agg(name, other_filters):
+    if name == "almacen":
+        # almacenes con stock > 0, contando artículos (reverse_nested), no filas nested
+        inner = {"nested": {"path": "stock_por_almacen"}, "aggs": {"con_stock": {
+            "filter": {"range": {"stock_por_almacen.qty": {"gt": 0}}},
+            "aggs": {"v": {"terms": {"field": FACETS[name], "size": FACET_SIZE},
+                           "aggs": {"items": {"reverse_nested": {}}}}}}}}
+    else:
+        inner = {"terms": {"field": FACETS[name], "size": FACET_SIZE}}
+    return {"filter": {"bool": {"filter": other_filters}}, "aggs": {"f": inner}}
+
+@timed("hits")
+def _facets(r):
+    out = {}
+    for name, agg in (r.get("aggregations") or {}).items():
+        f = agg["f"]
+        if name == "almacen":
+            out[name] = [{"value": b["key"], "count": b["items"]["doc_count"]}
+                         for b in f["con_stock"]["v"]["buckets"]]
+        else:
+            out[name] = [{"value": b["key"], "count": b["doc_count"]} for b in f["buckets"]]
+    return out
 
-    r = ES.search(index="items", **body)
-    hits = r.get("hits",{}).get("hits",[])
+@timed("hits")
+def _items_hits(r):
     items = []
-    for h in hits:
+    for h in r.get("hits",{}).get("hits",[]):
         src = h.get("_source",{}).copy()
         hl = h.get("highlight",{})
         if "descripcion" in hl:
             src["descripcion_hl"] = hl["descripcion"][0]
         items.append(src)
+    return items
 
-    return JsonResponse({
-        "page": page, "size": size,
-        "took": r.get("took",0),
-        "total": r.get("hits",{}).get("total",{}).get("value",0),
-        "items": items
-    })
+def _total(r):
+    t = r.get("hits",{}).get("total")
+    return t.get("value",0) if t else None
+
+def _totals(r):
+    """{"total": n}; si ES cortó el conteo en track_total_hits agrega
+    total_gte y el texto para mostrar ("10,000+")."""
+    out = {"total": _total(r)}
+    t = r.get("hits",{}).get("total")
+    if t and t.get("relation") == "gte":
+        out.update(total_gte=True, total_label=f"{t['value']:,}+")
+    return out
 
-# -------- CLIENTS SEARCH
 @require_GET
-def search_clients(request):
-    q = (request.GET.get("q") or "").strip()
-    page = max(_int(request.GET.get("page", 1), 1), 1)
-    size = min(max(_int(request.GET.get("size", 20), 1), 1), 100)
-    from_ = (page - 1) * size
+@fail_fast
+@cached_search(get_async_es, "items", lambda r: None if _uses_pit(r) else _normalized(r, ("almacen", "marca", "facets", "fields")))
+async def search_items(request):
+    facets = _list_param(request, "facets")
+    plan = _items_plan(_param(request, "q"))
+    cur = _decode_cursor(request.GET.get("cursor")) if request.GET.get("cursor") else None
+    if cur and cur.get("plan") == "text":
+        plan = "text"   # páginas siguientes de un fallback a texto completo
+    source = _source_fields(request, "items")
+    body = {**_items_body(request, facets, plan), "_source": source}
+    r, pag = await _page(request, "items", body, "codigo", {"plan": plan})
+    if r is not None and plan == "code" and not cur and _total(r) == 0:
+        # ningún código coincide: se busca como texto
+        plan = "text"
+        body = {**_items_body(request, facets, plan), "_source": source}
+        r, pag = await _page(request, "items", body, "codigo", {"plan": plan})
+    if r is None:
+        return pag
+    out = {
+        **pag,
+        "plan": plan,
+        "took": r.get("took",0),
+        **_totals(r),
+        "items": _items_hits(r)
+    }
+    if "aggs" in body:
+        out["facets"] = _facets(r)
+    return _json(out)
 
-    tipo = request.GET.get("tipo")  # tipo_cliente
-    ruc  = request.GET.get("ruc")
+# -------- CLIENTS SEARCH
+@timed("build")
+def _clients_body(request):
+    """query / sort de clients a partir de q, tipo y ruc."""
+    q = _param(request, "q")
 
-    must = [{"match_all": {}}]
-    if q:
-        must = [{
-            "multi_match": {
-                "query": q,
-                "fields": ["razon_social^2", "ruc", "tipo_cliente"],
-                "type": "best_fields",
-                "operator": "and"
-            }
-        }]
+    tipo = _param(request, "tipo")  # tipo_cliente
+    ruc  = _param(request, "ruc")
 
     filters = []
     if tipo: filters.append({"term": {"tipo_cliente": tipo}})
     if ruc:  filters.append({"term": {"ruc": ruc}})
 
-    body = {
-        "from": from_,
-        "size": size,
+    if not q:
+        return _browse({"query": _browse_query(filters), "sort": [{"venta_usd_6m":"desc"}]})
+
+    must = [{
+        "multi_match": {
+            "query": q,
+            "fields": ["razon_social^2", "ruc", "tipo_cliente"],
+            "type": "best_fields",
+            "operator": "and"
+        }
+    }]
+    return {
         "query": {"bool": {"must": must, "filter": filters}},
         "sort": [{"venta_usd_6m":"desc"}, "_score"]
     }
 
-    r = ES.search(index="clients", **body)
-    hits = r.get("hits",{}).get("hits",[])
-    return JsonResponse({
-        "page": page, "size": size,
+@require_GET
+@fail_fast
+@cached_search(get_async_es, "clients", lambda r: None if _uses_pit(r) else _normalized(r, ("fields",)))
+async def search_clients(request):
+    body = {**_clients_body(request), "_source": _source_fields(request, "clients")}
+    r, pag = await _page(request, "clients", body, "cliente_id")
+    if r is None:
+        return pag
+    return _json({
+        **pag,
         "took": r.get("took",0),
-        "total": r.get("hits",{}).get("total",{}).get("value",0),
-        "clients": [h.get("_source",{}) for h in hits]
+        **_totals(r),
+        "clients": [h.get("_source",{}) for h in r.get("hits",{}).get("hits",[])]
     })
 
+# -------- MULTI SEARCH: items + clients en un solo round trip (buscador global)
+@require_GET
+@fail_fast
+@cached_search(get_async_es, "items,clients", lambda r: _normalized(r, ("almacen", "marca", "fields"), size=5))
+async def search_all(request):
+    size = _size(request, 5)
+    searches = []
+    for index, body in (("items", _items_body(request)), ("clients", _clients_body(request))):
+        searches += [{"index": index}, {**body, "size": size, "_source": _source_fields(request, index)}]
+    items_r, clients_r = (await get_async_es().msearch(searches=searches))["responses"]
+
+    def section(r, key, hits):
+        if "error" in r:
+            return {"error": r["error"].get("type", "error") if isinstance(r["error"], dict) else str(r["error"])}
+        return {"took": r.get("took", 0), **_totals(r), key: hits(r)}
+
+    out = {
+        "size": size,
+        "items": section(items_r, "items", _items_hits),
+        "clients": section(clients_r, "clients",
+                           lambda r: [h.get("_source",{}) for h in r.get("hits",{}).get("hits",[])]),
+    }
+    resp = _json(out)
+    if "error" in out["items"] or "error" in out["clients"]:
+        resp["Cache-Control"] = "no-store"   # respuesta parcial: no se cachea
+    return resp
+
+# -------- EXPORT: todo el resultado filtrado, en streaming (CSV o NDJSON)
+EXPORT_BATCH = 2000
+EXPORT_FIELDS = SOURCE_FIELDS
+
+async def _scan_pit(index, query, sort, fields):
+    """Recorre todos los hits con point-in-time + search_after, de a
+    EXPORT_BATCH: memoria constante y sin tope de páginas. Es async para que
+    bajo ASGI el StreamingHttpResponse mande cada lote apenas llega (con un
+    iterador sync Django lo lee entero antes del primer byte)."""
+    query = {"query": query, "sort": sort, "_source": fields, "track_total_hits": False}
+    es = get_async_es("export")
+    pit = (await es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE))["id"]
+    try:
+        sa = None
+        while True:
+            r = await es.search(pit={"id": pit, "keep_alive": PIT_KEEP_ALIVE}, size=EXPORT_BATCH,
+                                **query, **({"search_after": sa} if sa else {}))
+            pit = r.get("pit_id", pit)
+            hits = r.get("hits", {}).get("hits", [])
+            if hits:
+                yield hits
+            if len(hits) < EXPORT_BATCH:
+                break
+            sa = hits[-1]["sort"]
+    finally:
+        await es.close_point_in_time(id=pit)
+
+def _csv_value(v):
+    # listas a una sola celda: stock_por_almacen -> "A1:3|B2:5", productos_top_6m -> "X|Y"
+    if isinstance(v, list):
+        return "|".join(f"{x.get('almacen')}:{x.get('qty')}" if isinstance(x, dict) else str(x) for x in v)
+    return "" if v is None else v
+
+class _Echo:
+    def write(self, value):
+        return value
+
+async def _export(request, alias, body, tiebreak):
+    fmt = _param(request, "format").lower() or "csv"
+    if fmt not in ("csv", "ndjson"):
+        return _json({"error": "format debe ser csv o ndjson"}, status=400)
+    fields = EXPORT_FIELDS[alias]
+    BREAKER.check()   # el scan corre recién al hacer streaming: cortar antes del 200
+    # relevancia sólo si hay texto; si no, el orden del tiebreak alcanza
+    sort = body.get("sort") or (["_score"] if _param(request, "q") else [])
+    pages = _scan_pit(alias, body["query"], sort + [{tiebreak: "asc"}], fields)
+
+    if fmt == "ndjson":
+        async def rows():
+            async for hits in pages:
+                yield b"".join(_dumps(h["_source"]) + b"\n" for h in hits)
+        ctype = "application/x-ndjson"
+    else:
+        w = csv.writer(_Echo())
+        async def rows():
+            yield w.writerow(fields)
+            async for hits in pages:
+                yield "".join(w.writerow([_csv_value(h["_source"].get(f)) for f in fields]) for h in hits)
+        ctype = "text/csv; charset=utf-8"
+
+    resp = StreamingHttpResponse(rows(), content_type=ctype)
+    resp["Content-Disposition"] = f'attachment; filename="{alias}.{fmt}"'
+    return resp
+
+@require_GET
+@fail_fast
+async def export_items(request):
+    return await _export(request, "items", _items_body(request), "codigo")
+
+@require_GET
+@fail_fast
+async def export_clients(request):
+    return await _export(request, "clients", _clients_body(request), "cliente_id")
+
 # -------- DETALLE: Artículo y Cliente con histórico 6M (desde Postgres)
+# El histórico sale de los rollups mensuales (rollup_sales): meses completos
+# desde el de hace 6 meses hasta el actual, un lookup por índice.
+def _histories(model, col, values):
+    """{id: [{"mes","qty","venta"}, ...]} para muchos ids en una sola consulta."""
+    out = {v: [] for v in values}
+    with connection.cursor() as cur:
+        cur.execute(f"""
+            SELECT {col}, to_char(mes, 'YYYY-MM'), qty, venta FROM {model._meta.db_table}
+            WHERE {col} = ANY(%s) AND mes >= date_trunc('month', CURRENT_DATE - INTERVAL '6 months')
+            ORDER BY {col}, mes
+        """, [list(values)])
+        for (k,m,q,v) in cur.fetchall():
+            out.setdefault(k, []).append({"mes": m, "qty": int(q or 0), "venta": float(v or 0)})
+    return out
+
+def _history(model, col, value):
+    return _histories(model, col, [value])[value]
+
 @require_GET
 def item_detail(request, codigo):
     with connection.cursor() as cur:
@@ -183,19 +583,10 @@ def item_detail(request, codigo):
         """, [codigo])
         row = cur.fetchone()
         if not row:
-            return JsonResponse({"error":"not_found"}, status=404)
+            return _json({"error":"not_found"}, status=404)
         cols = [c[0] for c in cur.description]
         item = dict(zip(cols, row))
-        # Histórico mensual 6m
-        cur.execute("""
-            SELECT to_char(date_trunc('month', fecha), 'YYYY-MM') AS mes,
-                   SUM(qty) AS qty, SUM(total_usd) AS venta
-            FROM ventas
-            WHERE codigo = %s AND fecha >= (CURRENT_DATE - INTERVAL '6 months')
-            GROUP BY 1 ORDER BY 1
-        """, [codigo])
-        hist = [{"mes": m, "qty": int(q or 0), "venta": float(v or 0)} for (m,q,v) in cur.fetchall()]
-    return JsonResponse({"item": item, "historico_6m": hist})
+    return _json({"item": item, "historico_6m": _history(ItemMonthlySales, "codigo", codigo)})
 
 @require_GET
 def client_detail(request, cliente_id):
@@ -208,29 +599,78 @@ def client_detail(request, cliente_id):
         """, [cliente_id])
         row = cur.fetchone()
         if not row:
-            return JsonResponse({"error":"not_found"}, status=404)
+            return _json({"error":"not_found"}, status=404)
         cols = [c[0] for c in cur.description]
         cli = dict(zip(cols, row))
-        # Histórico mensual 6m
-        cur.execute("""
-            SELECT to_char(date_trunc('month', fecha), 'YYYY-MM') AS mes,
-                   SUM(qty) AS qty, SUM(total_usd) AS venta
-            FROM ventas
-            WHERE cliente_id = %s AND fecha >= (CURRENT_DATE - INTERVAL '6 months')
-            GROUP BY 1 ORDER BY 1
-        """, [cliente_id])
-        hist = [{"mes": m, "qty": int(q or 0), "venta": float(v or 0)} for (m,q,v) in cur.fetchall()]
-    return JsonResponse({"cliente": cli, "historico_6m": hist})
+    return _json({"cliente": cli, "historico_6m": _history(ClientMonthlySales, "cliente_id", cliente_id)})
+
+# -------- DETALLE EN LOTE: ?ids=A,B,C (hasta BATCH_MAX_IDS)
+# Cabeceras desde el índice (un mget sobre los documentos ya desnormalizados)
+# e históricos en una sola consulta a los rollups: 2 idas y vueltas para toda
+# la página en vez de 2 consultas a las vistas por id. Refleja el último
+# reindex/ingest_stock; para el dato exacto del momento están las vistas por id.
+BATCH_MAX_IDS = 200
+
+def _batch_detail(request, alias, model, col, key):
+    ids = list(dict.fromkeys(_list_param(request, "ids")))
+    if not ids:
+        return _json({"error": "ids requerido"}, status=400)
+    if len(ids) > BATCH_MAX_IDS:
+        return _json({"error": f"máximo {BATCH_MAX_IDS} ids"}, status=400)
+    fields = _source_fields(request, alias) if request.GET.get("fields") else SOURCE_FIELDS[alias]
+    docs = get_es("search").mget(index=alias, ids=ids, _source=fields)["docs"]
+    found = {d["_id"]: d["_source"] for d in docs if d.get("found")}
+    hist = _histories(model, col, list(found))
+    return _json({
+        alias: [{key: found[i], "historico_6m": hist.get(i, [])} for i in ids if i in found],
+        "not_found": [i for i in ids if i not in found],
+    })
+
+@require_GET
+@fail_fast
+def items_detail(request):
+    return _batch_detail(request, "items", ItemMonthlySales, "codigo", "item")
+
+@require_GET
+@fail_fast
+def clients_detail(request):
+    return _batch_detail(request, "clients", ClientMonthlySales, "cliente_id", "cliente")
+
+# -------- ESTADO del proceso: saturación del pool de Postgres y breaker de ES
+@require_GET
+async def status(request):
+    pool = getattr(connection, "pool", None)   # None sin pool (POSTGRES_POOL=0 / psycopg2)
+    return _json({
+        "pid": os.getpid(),
+        "db_pool": pool.get_stats() if pool else None,
+        "es_breaker": "open" if BREAKER.is_open else "closed",
+    })
+
+# -------- SUGGEST
+# Por defecto responde desde el índice de prefijos en memoria que deja reindex
+# (search/suggest.py); SUGGEST_BACKEND=es usa el completion suggester de ES,
+# que es también el respaldo mientras no haya uno cargado.
+async def _suggest(request, alias):
+    q = _param(request, "q")
+    size = min(max(_int(request.GET.get("size", 5), 5), 1), TOP_K)
+    if not q:
+        return _json({"text": "", "offset": 0, "length": 0, "options": []})
+    if settings.SUGGEST_BACKEND == "memory":
+        idx = get_suggest_index(alias)
+        if idx is not None:
+            return _json({"text": q, "offset": 0, "length": len(q), "options": idx.suggest(q, size)})
+    # prefijos populares: requests simultáneos iguales comparten la llamada a ES
+    r, _ = await single_flight(("suggest", alias, q, size), lambda: get_async_es("suggest").search(
+        index=alias, suggest={"s1":{"prefix":q, "completion":{"field":"suggest", "size":size}}},
+        size=0, _source=list(SUGGEST_FIELDS[alias]["source"])))
+    return _json(r.get("suggest",{}).get("s1",[{}])[0])
 
-# -------- SUGGEST (se mantiene simple)
 @require_GET
-def suggest_items(request):
-    q = (request.GET.get("q") or "").strip()
-    r = ES.search(index="items", suggest={"s1":{"prefix":q, "completion":{"field":"suggest"}}}, size=0)
-    return JsonResponse(r.get("suggest",{}).get("s1",[{}])[0])
+@fail_fast
+async def suggest_items(request):
+    return await _suggest(request, "items")
 
 @require_GET
-def suggest_clients(request):
-    q = (request.GET.get("q") or "").strip()
-    r = ES.search(index="clients", suggest={"s1":{"prefix":q, "completion":{"field":"suggest"}}}, size=0)
-    return JsonResponse(r.get("suggest",{}).get("s1",[{}])[0])
+@fail_fast
+async def suggest_clients(request):
+    return await _suggest(request, "clients")
@@ -0,0 +1,215 @@
+import os, json, time, threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from elasticsearch import ApiError, ConnectionError, ConnectionTimeout
+
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "4"))          # requests bulk en vuelo
+BULK_MAX_BYTES = int(float(os.getenv("BULK_MAX_MB", "5")) * 1024 * 1024)
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "5"))
+BULK_BACKOFF = float(os.getenv("BULK_BACKOFF", "0.5"))      # segundos, se duplica por intento
+
+# estados que vale la pena reintentar (cola de bulk llena / nodo saturado)
+RETRY_STATUS = (429, 503)
+
+
+class BulkIndexer:
+    """Pipeline bulk compartido: lotes cortados por bytes, N requests en vuelo
+    y reintentos con backoff exponencial para los items rechazados (429).
+
+    Las operaciones se agregan ya serializadas (líneas NDJSON en bytes), así el
+    llamador decide si manda index, update o delete:
+
+        with BulkIndexer(ES, "items_v2025...") as bi:
+            bi.index("A-100", b'{"codigo":"A-100",...}')
+        print(bi.summary())
+
+    add() bloquea cuando ya hay `workers` lotes en vuelo (backpressure): la
+    extracción nunca se adelanta más de un lote a lo que ES puede absorber.
+
+    `committed` es la última clave (pasada en add/index) tal que su lote y todos
+    los anteriores ya terminaron: sirve como checkpoint aunque los lotes
+    terminen en desorden.
+    """
+
+    def __init__(self, es, index, workers=BULK_WORKERS, max_bytes=BULK_MAX_BYTES,
+                 max_retries=BULK_MAX_RETRIES, backoff=BULK_BACKOFF, label="bulk"):
+        self.es, self.index_name, self.label = es, index, label
+        self.max_bytes, self.max_retries, self.backoff = max_bytes, max_retries, backoff
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"bulk-{label}")
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._ops, self._size, self._key = [], 0, None
+        self._seq, self._next, self._finished = 0, 0, {}
+        self.committed = None
+        self.docs = self.failed = self.retried = 0
+        self.errors = []                # primeros errores, para diagnóstico
+        self.failed_ids = []            # _id de todo lo que no entró
+        self.failed_types = {}          # _id -> tipo de error ("rejected" si agotó reintentos)
+        self.error_types = Counter()    # p.ej. {"mapper_parsing_exception": 3}
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    # -------- API
+    def add(self, action, source=None, key=None):
+        op = action if source is None else action + source
+        self._ops.append(op)
+        self._size += len(op)
+        if key is not None:
+            self._key = key
+        if self._size >= self.max_bytes:
+            self.flush()
+
+    def index(self, _id, source):
+        self.add(b'{"index":{"_id":' + json.dumps(str(_id)).encode() + b'}}\n', source + b"\n", key=_id)
+
+    def delete(self, _id):
+        self.add(b'{"delete":{"_id":' + json.dumps(str(_id)).encode() + b'}}\n', key=_id)
+
+    def flush(self):
+        if not self._ops:
+            return
+        ops, self._ops, self._size = self._ops, [], 0
+        seq, self._seq = self._seq, self._seq + 1
+        self._slots.acquire()
+        fut = self._pool.submit(self._run, seq, self._key, ops)
+        with self._lock:
+            self._futures.add(fut)
+        fut.add_done_callback(self._done)
+
+    def close(self):
+        self.flush()
+        self._pool.shutdown(wait=True)
+        self.elapsed = time.monotonic() - self.started
+        for f in list(self._futures):
+            f.result()   # propaga errores no recuperables del request
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        return False
+
+    def stats(self):
+        # dict simple (picklable) para devolverlo desde procesos worker
+        return {"label": self.label, "docs": self.docs, "failed": self.failed,
+                "retried": self.retried, "elapsed": self.elapsed or (time.monotonic() - self.started),
+                "errors": self.errors[:20]}
+
+    def summary(self):
+        return summarize(self.stats())
+
+    # -------- internos
+    def _done(self, fut):
+        self._slots.release()
+        if fut.exception() is None:
+            with self._lock:
+                self._futures.discard(fut)
+
+    def _run(self, seq, key, ops):
+        self._send(ops)
+        with self._lock:
+            self._finished[seq] = key
+            while self._next in self._finished:
+                k = self._finished.pop(self._next)
+                if k is not None:
+                    self.committed = k
+                self._next += 1
+
+    def _send(self, ops):
+        attempt = 0
+        while ops:
+            try:
+                resp = self.es.bulk(index=self.index_name, operations=b"".join(ops), refresh=False)
+            except (ConnectionError, ConnectionTimeout, ApiError) as e:
+                status = getattr(e, "status_code", None)
+                if isinstance(e, ApiError) and status not in RETRY_STATUS:
+                    raise
+                retry = ops
+            else:
+                retry = []
+                ok = failed = 0
+                for op, it in zip(ops, resp.get("items", [])):
+                    r = next(iter(it.values()))
+                    if r.get("status") in RETRY_STATUS:
+                        retry.append(op)
+                    elif "error" in r:
+                        failed += 1
+                        self._record_error(r.get("_id"), r["error"])
+                        etype = r["error"].get("type", "?") if isinstance(r["error"], dict) else "?"
+                        with self._lock:
+                            self.failed_ids.append(r.get("_id"))
+                            self.failed_types[r.get("_id")] = etype
+                            self.error_types[etype] += 1
+                    else:
+                        ok += 1
+                with self._lock:
+                    self.docs += ok
+                    self.failed += failed
+            ops = retry
+            if not ops:
+                return
+            attempt += 1
+            if attempt > self.max_retries:
+                with self._lock:
+                    self.failed += len(ops)
+                    ids = [_op_id(op) for op in ops]
+                    self.failed_ids.extend(ids)
+                    self.failed_types.update(dict.fromkeys(ids, "rejected"))
+                    self.error_types["rejected"] += len(ops)
+                self._record_error(None, f"{len(ops)} ops rechazadas tras {self.max_retries} reintentos")
+                return
+            with self._lock:
+                self.retried += len(ops)
+            time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def _record_error(self, _id, err):
+        with self._lock:
+            if len(self.errors) < 20:
+                self.errors.append((_id, err))
+
+
+def _op_id(op):
+    action = json.loads(op.split(b"\n", 1)[0])
+    return next(iter(action.values())).get("_id")
+
+def merge_stats(parts, label, elapsed):
+    """Junta las estadísticas de varios BulkIndexer (p.ej. uno por rango) usando
+    el tiempo de pared total, que es el que cuenta para docs/s. Los contadores
+    enteros (docs, failed, retried y los que agregue el llamador) se suman."""
+    out = {"label": label, "elapsed": elapsed, "docs": 0, "failed": 0, "retried": 0,
+           "errors": [e for p in parts for e in p["errors"]][:20]}
+    for p in parts:
+        for k, v in p.items():
+            if k not in ("label", "elapsed", "errors") and isinstance(v, int):
+                out[k] = out.get(k, 0) + v
+    return out
+
+def summarize(st):
+    dps = st["docs"] / st["elapsed"] if st["elapsed"] else 0.0
+    extra = "".join(f", {k}: {st[k]}" for k in ("skipped", "deleted") if k in st)
+    return (f"[{st['label']}] {st['docs']} docs en {st['elapsed']:.1f}s "
+            f"({dps:,.0f} docs/s), fallidos: {st['failed']}, reintentos: {st['retried']}{extra}")
+
+
+@contextmanager
+def bulk_load_profile(es, index, restore=None):
+    """Durante la carga: sin refresh y sin réplicas. Al salir restaura lo que
+    tuviera el índice (None vuelve al valor por defecto de ES), o `restore` si
+    se pasa: al reanudar una carga cortada el índice ya quedó en modo bulk."""
+    keys = ("index.refresh_interval", "index.number_of_replicas")
+    if restore is None:
+        cur = es.indices.get_settings(index=index, name=list(keys), flat_settings=True)
+        restore = next(iter(cur.values()), {}).get("settings", {})
+    prev = restore
+    es.indices.put_settings(index=index, settings={"index.refresh_interval": "-1", "index.number_of_replicas": 0})
+    try:
+        yield
+    finally:
+        es.indices.put_settings(index=index, settings={k: prev.get(k) for k in keys})
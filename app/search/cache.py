@@ -0,0 +1,174 @@
+import asyncio, hashlib, json, threading, time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from elasticsearch import NotFoundError
+from search.es import ES_DOWN, es_down
+
+# cada cuánto se vuelve a preguntar a ES a qué generación apunta el alias
+GENERATION_CHECK_SECONDS = 5
+
+_generations = {}
+_gen_lock = threading.Lock()
+
+def _known_generation(alias):
+    gen, checked = _generations.get(alias, (None, 0))
+    return gen if time.monotonic() - checked < GENERATION_CHECK_SECONDS else None
+
+def _last_generation(alias, exc):
+    # ES no responde: seguir con la última generación conocida (así se puede
+    # servir lo que haya en cache); sin ninguna, el error sigue de largo
+    gen = _generations.get(alias, (None, 0))[0]
+    if gen is None:
+        raise exc
+    return gen
+
+def _set_generation(alias, gen):
+    with _gen_lock:
+        _generations[alias] = (gen, time.monotonic())
+    return gen
+
+def current_generation(es, alias):
+    """Índice concreto detrás del alias (items -> items_v2025...), cacheado unos
+    segundos por proceso. Forma parte de la llave del cache: cuando reindex
+    publica una generación nueva, las respuestas anteriores dejan de usarse."""
+    gen = _known_generation(alias)
+    if gen:
+        return gen
+    try:
+        gen = ",".join(sorted(es.indices.get_alias(name=alias)))
+    except NotFoundError:
+        gen = alias   # índice concreto sin alias (esquema anterior)
+    except ES_DOWN as e:
+        if not es_down(e):
+            raise
+        return _last_generation(alias, e)
+    return _set_generation(alias, gen)
+
+async def acurrent_generation(es, alias):
+    """current_generation() con el cliente async."""
+    gen = _known_generation(alias)
+    if gen:
+        return gen
+    try:
+        gen = ",".join(sorted(await es.indices.get_alias(name=alias)))
+    except NotFoundError:
+        gen = alias
+    except ES_DOWN as e:
+        if not es_down(e):
+            raise
+        return _last_generation(alias, e)
+    return _set_generation(alias, gen)
+
+def cached_search(es, alias, params):
+    """Cache de respuestas (cache "search": TTL + LRU acotado) para vistas de
+    búsqueda, con ETag / 304 para que navegadores y proxies revaliden gratis.
+
+    `params(request)` devuelve los parámetros normalizados que arman la llave
+    (None = no cachear este request); la generación detrás de `alias` también
+    entra en la llave. Sirve para vistas sync y async; `es` puede ser el
+    cliente o una función que lo devuelve (get_async_es).
+
+    Las entradas viven SEARCH_STALE_TTL pero se usan sólo SEARCH_CACHE_TTL; si
+    la vista falla porque ES no responde o está saturado (ver es_down) se
+    devuelve la última respuesta buena con X-Cache: STALE.
+
+    En vistas async, requests idénticos que llegan mientras el primero está
+    en vuelo esperan ese mismo resultado (single_flight, X-Cache: SHARED)."""
+    client = lambda: es() if callable(es) else es
+
+    def deco(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def awrapper(request, *args, **kwargs):
+                key_params = params(request)
+                if key_params is None:
+                    return await view(request, *args, **kwargs)
+                key = _key(view, alias, await acurrent_generation(client(), alias), key_params)
+                # LocMem vive en memoria: get/set directos, sin pasar por un thread
+                stale = caches["search"].get(key)
+                if _fresh(stale):
+                    return _respond(request, stale, "HIT")
+
+                async def load():
+                    resp = await view(request, *args, **kwargs)
+                    return resp, _store(key, resp)
+                try:
+                    (resp, hit), leader = await single_flight(key, load)
+                except ES_DOWN as e:
+                    if stale is None or not es_down(e):
+                        raise
+                    return _respond(request, stale, "STALE")
+                if hit:
+                    return _respond(request, hit, "MISS" if leader else "SHARED")
+                # no cacheable (400, parcial...): el objeto respuesta no se comparte
+                return resp if leader else await view(request, *args, **kwargs)
+            return awrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key_params = params(request)
+            if key_params is None:
+                return view(request, *args, **kwargs)
+            key = _key(view, alias, current_generation(client(), alias), key_params)
+            hit = caches["search"].get(key)
+            if _fresh(hit):
+                return _respond(request, hit, "HIT")
+            try:
+                resp = view(request, *args, **kwargs)
+            except ES_DOWN as e:
+                if hit is None or not es_down(e):
+                    raise
+                return _respond(request, hit, "STALE")
+            hit = _store(key, resp)
+            return _respond(request, hit, "MISS") if hit else resp
+        return wrapper
+    return deco
+
+_inflight = {}   # (loop, llave) -> Task
+
+async def single_flight(key, fn):
+    """Corre `fn()` una sola vez por llave entre los llamados concurrentes del
+    mismo event loop: los que llegan mientras está en vuelo esperan el mismo
+    resultado (o la misma excepción). Nada se guarda una vez terminado.
+
+    Devuelve (resultado, leader); leader=True para quien disparó la llamada.
+    La llamada corre como task aparte: si el cliente que la disparó se
+    desconecta, los demás igual reciben el resultado."""
+    loop = asyncio.get_running_loop()
+    k = (loop, key)
+    task = _inflight.get(k)
+    leader = task is None
+    if leader:
+        task = _inflight[k] = loop.create_task(fn())
+        task.add_done_callback(lambda t: _inflight.pop(k, None))
+    return await asyncio.shield(task), leader
+
+def _key(view, alias, gen, key_params):
+    raw = json.dumps([view.__name__, key_params], sort_keys=True, separators=(",", ":"))
+    return f"{alias}:{gen}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+def _store(key, resp):
+    # sólo respuestas 200 completas; None = devolver la respuesta tal cual
+    if resp.status_code != 200 or "no-store" in resp.get("Cache-Control", ""):
+        return None
+    etag = '"' + hashlib.md5(resp.content).hexdigest() + '"'
+    hit = (resp.content, resp["Content-Type"], etag, time.time())
+    caches["search"].set(key, hit)
+    return hit
+
+def _fresh(hit):
+    return hit is not None and time.time() - hit[3] < settings.SEARCH_CACHE_TTL
+
+def _respond(request, hit, status):
+    content, ctype, etag, _ = hit
+    if etag in request.headers.get("If-None-Match", ""):
+        resp = HttpResponseNotModified()
+    else:
+        resp = HttpResponse(content, content_type=ctype)
+    resp["ETag"] = etag
+    resp["X-Cache"] = status
+    patch_cache_control(resp, public=True, max_age=0, must_revalidate=True)
+    return resp
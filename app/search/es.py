@@ -0,0 +1,243 @@
+import os, asyncio, threading, time
+from functools import wraps
+from django.conf import settings
+from django.http import JsonResponse
+from elasticsearch import Elasticsearch, AsyncElasticsearch, ApiError, ConnectionError, ConnectionTimeout
+from elastic_transport import Transport, AsyncTransport, TransportError
+from search.metrics import record_es
+
+# estados que cuentan como falla para el breaker (ES saturado o caído)
+BREAKER_STATUS = (429, 502, 503, 504)
+
+
+class CircuitOpen(ConnectionError):
+    """El breaker está abierto: no se llamó a ES. Es un ConnectionError, así
+    que quien ya maneja ES caído (BulkIndexer, cached_search) lo trata igual."""
+
+
+class CircuitBreaker:
+    """closed -> (N fallas seguidas) -> open -> (reset s) -> half-open: pasa un
+    solo request de prueba; si sale bien se cierra, si no vuelve a abrirse.
+
+    Compartido por todos los clientes con breaker del proceso (sync y async)."""
+
+    def __init__(self, failures, reset):
+        self.failures, self.reset = failures, reset
+        self._lock = threading.Lock()
+        self._count, self._opened, self._probing = 0, None, False
+
+    def before(self):
+        """Levanta CircuitOpen si no se puede llamar a ES. Devuelve True si a
+        este request le tocó ser la prueba de half-open."""
+        with self._lock:
+            if self._opened is None:
+                return False
+            if self._probing or time.monotonic() - self._opened < self.reset:
+                raise CircuitOpen("elasticsearch no disponible (circuit breaker abierto)")
+            self._probing = True
+            return True
+
+    def check(self):
+        # como before() pero sin gastar el request de prueba
+        with self._lock:
+            if self._opened is not None and (self._probing or time.monotonic() - self._opened < self.reset):
+                raise CircuitOpen("elasticsearch no disponible (circuit breaker abierto)")
+
+    def success(self):
+        with self._lock:
+            self._count, self._opened, self._probing = 0, None, False
+
+    def release(self):
+        # la prueba terminó sin veredicto (cancelada, otro error): que pase otra
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            self._probing = False
+            if self._count >= self.failures:
+                self._opened = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self._opened is not None
+
+    def retry_after(self):
+        if self._opened is None:
+            return 0
+        return max(1, int(self.reset - (time.monotonic() - self._opened) + 0.999))
+
+
+BREAKER = CircuitBreaker(settings.ELASTICSEARCH["BREAKER_FAILURES"], settings.ELASTICSEARCH["BREAKER_RESET"])
+
+
+class BreakerTransport(Transport):
+    def perform_request(self, method, target, **kwargs):
+        probe = BREAKER.before()
+        start = time.perf_counter()
+        try:
+            resp = Transport.perform_request(self, method, target, **kwargs)
+        except TransportError:
+            BREAKER.failure()
+            raise
+        except BaseException:
+            # error que no dice nada de ES: libera la prueba (ver la versión async)
+            if probe:
+                BREAKER.release()
+            raise
+        _done(resp, target, kwargs.get("body"), time.perf_counter() - start)
+        return resp
+
+
+class AsyncBreakerTransport(AsyncTransport):
+    async def perform_request(self, method, target, **kwargs):
+        probe = BREAKER.before()
+        start = time.perf_counter()
+        try:
+            resp = await AsyncTransport.perform_request(self, method, target, **kwargs)
+        except TransportError:
+            BREAKER.failure()
+            raise
+        except BaseException:
+            # CancelledError (el cliente cortó y Django cancela la vista) u otro
+            # error que no dice nada de ES: sin esto la prueba quedaba tomada
+            # y el breaker abierto hasta reiniciar el proceso
+            if probe:
+                BREAKER.release()
+            raise
+        _done(resp, target, kwargs.get("body"), time.perf_counter() - start)
+        return resp
+
+
+def _done(resp, target, body, seconds):
+    (BREAKER.failure if resp.meta.status in BREAKER_STATUS else BREAKER.success)()
+    took = resp.body.get("took") if isinstance(resp.body, dict) else None
+    record_es(target, body, seconds, took)
+
+
+# -------- fábrica
+# Base: un cliente (pool de conexiones) por proceso y por uso o no del breaker;
+# cada perfil es un .options() con su timeout/reintentos sobre esa base.
+_clients = {}         # (pid, perfil) -> Elasticsearch
+_async_clients = {}   # loop -> {perfil: AsyncElasticsearch}
+_lock = threading.Lock()
+
+def _base_kwargs(breaker, is_async):
+    cfg = settings.ELASTICSEARCH
+    kw = {"connections_per_node": cfg["CONNECTIONS"], "retry_on_status": (502, 503, 504)}
+    if breaker:
+        kw["transport_class"] = AsyncBreakerTransport if is_async else BreakerTransport
+    return kw
+
+def _options(base, profile):
+    p = settings.ELASTICSEARCH["PROFILES"][profile]
+    # retry_on_timeout sólo sin breaker: en la API un timeout corta, no se repite
+    return base.options(request_timeout=p["timeout"], max_retries=p["retries"],
+                        retry_on_timeout=not p["breaker"])
+
+def get_es(profile="search"):
+    """Cliente sync del perfil (search, suggest, export, batch). Se crea en el
+    primer uso y es por proceso: un fork (workers de reindex) arma el suyo."""
+    key = (os.getpid(), profile)
+    es = _clients.get(key)
+    if es is None:
+        with _lock:
+            breaker = settings.ELASTICSEARCH["PROFILES"][profile]["breaker"]
+            base_key = (os.getpid(), "base", breaker)
+            base = _clients.get(base_key)
+            if base is None:
+                base = _clients[base_key] = Elasticsearch(settings.ELASTICSEARCH["URL"], **_base_kwargs(breaker, False))
+            es = _clients[key] = _options(base, profile)
+    return es
+
+def get_async_es(profile="search"):
+    """AsyncElasticsearch del perfil para las vistas async. Uno por event loop:
+    la sesión aiohttp queda atada al loop que la creó (uvicorn tiene uno por
+    worker; runserver/tests crean uno por request). Se cierran al terminar el
+    loop, ver _close_with_loop."""
+    loop = asyncio.get_running_loop()
+    per_loop = _async_clients.get(loop)
+    if per_loop is None:
+        # loops que terminaron sin pasar por shutdown_asyncgens (loop.close()
+        # a mano): ya no se pueden cerrar, sólo soltar
+        for old in [l for l in _async_clients if l.is_closed()]:
+            del _async_clients[old]
+        per_loop = _async_clients[loop] = {}
+        # el loop guarda sólo una referencia débil al generador
+        per_loop["closer"] = closer = _close_with_loop()
+        loop.create_task(closer.__anext__())
+    es = per_loop.get(profile)
+    if es is None:
+        breaker = settings.ELASTICSEARCH["PROFILES"][profile]["breaker"]
+        base = per_loop.get(("base", breaker))
+        if base is None:
+            base = per_loop[("base", breaker)] = AsyncElasticsearch(settings.ELASTICSEARCH["URL"],
+                                                                    **_base_kwargs(breaker, True))
+        es = per_loop[profile] = _options(base, profile)
+    return es
+
+async def _close_with_loop():
+    # Generador async que queda suspendido en el yield: asyncio.run (uvicorn
+    # al apagarse, runserver y tests con su loop por request) llama a
+    # shutdown_asyncgens antes de cerrar el loop y eso corre el finally, con
+    # el loop todavía andando para cerrar las sesiones aiohttp.
+    try:
+        yield
+    finally:
+        await aclose_es()
+
+def close_es():
+    """Cierra y descarta los clientes sync de este proceso; el próximo get_es
+    los arma con la URL vigente (manage.py bench cambia ELASTICSEARCH_URL)."""
+    with _lock:
+        for key in [k for k in _clients if k[0] == os.getpid()]:
+            es = _clients.pop(key)
+            if key[1] == "base":
+                es.close()
+
+async def aclose_es():
+    """Cierra los clientes async del loop actual. Lo hace solo al terminar el
+    loop; manage.py bench lo llama antes para cambiar de URL."""
+    for key, es in _async_clients.pop(asyncio.get_running_loop(), {}).items():
+        if isinstance(key, tuple):   # las bases; los perfiles comparten su transporte
+            await es.close()
+
+
+# -------- ES caído
+# Lo que se captura; es_down() decide. Un 429/502/503/504 que agotó los
+# reintentos del cliente llega como ApiError y es ES saturado, no un bug.
+ES_DOWN = (ConnectionError, ConnectionTimeout, ApiError)   # incluye CircuitOpen
+
+def es_down(exc):
+    """ES caído, lento, saturado o con el breaker abierto."""
+    return not isinstance(exc, ApiError) or exc.status_code in BREAKER_STATUS
+
+def _unavailable():
+    resp = JsonResponse({"error": "search_unavailable"}, status=503)
+    resp["Retry-After"] = str(BREAKER.retry_after() or int(settings.ELASTICSEARCH["BREAKER_RESET"]))
+    return resp
+
+def fail_fast(view):
+    """ES caído, lento o con el breaker abierto -> 503 con Retry-After en el
+    momento, en vez de un 500 (o de esperar el timeout en cada request)."""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def awrapper(request, *args, **kwargs):
+            try:
+                return await view(request, *args, **kwargs)
+            except ES_DOWN as e:
+                if not es_down(e):
+                    raise
+                return _unavailable()
+        return awrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ES_DOWN as e:
+            if not es_down(e):
+                raise
+            return _unavailable()
+    return wrapper
@@ -0,0 +1,47 @@
+import zlib
+from django.db import connection
+
+
+class AdvisoryLock:
+    """Advisory lock de sesión de Postgres con nombre (reindex:items,
+    stock:<tabla>...). Usa una conexión propia, fuera del pool de Django:
+    reindex cierra las de Django antes de lanzar sus workers y eso soltaría
+    el lock. Con otra base (tests en sqlite) no bloquea nada.
+
+        with AdvisoryLock("stock:movimientos"):   # espera si otro lo tiene
+            ...
+        lock.acquire(wait=False)                  # False si otro lo tiene
+    """
+
+    def __init__(self, name):
+        self.name, self.key = name, zlib.crc32(name.encode())
+        self._conn = None
+
+    def acquire(self, wait=True):
+        if connection.vendor != "postgresql":
+            return True
+        if self._conn is None:
+            import psycopg
+            self._conn = psycopg.connect(**connection.get_connection_params(), autocommit=True)
+        if wait:
+            self._conn.execute("SELECT pg_advisory_lock(%s)", [self.key])
+            return True
+        return self._conn.execute("SELECT pg_try_advisory_lock(%s)", [self.key]).fetchone()[0]
+
+    def release(self):
+        if self._conn is not None:
+            self._conn.execute("SELECT pg_advisory_unlock(%s)", [self.key])
+
+    def close(self):
+        # cerrar la conexión suelta cualquier lock que quede
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
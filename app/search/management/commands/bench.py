@@ -0,0 +1,418 @@
+import os, sys, json, time, random, socket, shutil, asyncio, platform, resource, tempfile, subprocess
+from collections import Counter
+from io import StringIO
+from statistics import mean, quantiles
+from urllib.request import urlopen
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient
+from search.es import aclose_es, close_es
+from search.models import ReindexCheckpoint, SyncState
+from search.management.commands.reindex import (TARGETS, es, generations, live_generation, swap_alias,
+                                                 drop_generation)
+
+# Las tablas sintéticas se llaman igual que las vistas y viven en este schema;
+# con search_path=bench,public reindex las lee sin cambios (y sigue usando las
+# tablas de huellas/checkpoints de public).
+SCHEMA = "bench"
+
+# vocabulario del catálogo sintético (repuestos de moto) y de los clientes
+PRODUCTOS = ["filtro aceite", "filtro aire", "pastilla freno", "disco freno", "zapata freno", "cadena",
+             "piñon", "corona", "kit arrastre", "bujia", "llanta", "camara", "amortiguador", "faro",
+             "direccional", "espejo", "manubrio", "embrague", "carburador", "piston", "anillos",
+             "empaque culata", "rodaje", "cable acelerador", "cable embrague", "bateria", "aceite motor"]
+MODELOS = ["CG125", "XR150", "CB190", "FZ16", "YBR125", "GN125", "AX100", "PULSAR 180", "BOXER 150",
+           "NS200", "WAVE 110", "CRYPTON"]
+MARCAS = ["HONDA", "YAMAHA", "SUZUKI", "BAJAJ", "TVS", "NGK", "MOTUL", "KOYO", "DID", "RIFFEL"]
+DIVISIONES = ["REPUESTOS", "ACCESORIOS", "LUBRICANTES", "LLANTAS"]
+LINEAS = ["MOTOR", "FRENOS", "TRANSMISION", "ELECTRICO", "SUSPENSION", "CARROCERIA"]
+ALMACENES = ["LIM01", "LIM02", "ARE01", "TRU01", "CUS01"]
+RAZONES = ["inversiones", "motos", "repuestos", "comercial", "distribuidora", "servicios",
+           "importaciones", "taller", "moto partes", "grupo"]
+LUGARES = ["lima", "arequipa", "trujillo", "cusco", "piura", "chiclayo", "huancayo", "del norte",
+           "del sur", "andina"]
+TIPOS = ["MAYORISTA", "MINORISTA", "TALLER", "DISTRIBUIDOR"]
+
+ITEMS_SQL = """
+CREATE TABLE {table} AS
+WITH v AS (SELECT %(productos)s::text[] AS pr, %(modelos)s::text[] AS mo, %(marcas)s::text[] AS ma,
+                  %(divisiones)s::text[] AS di, %(lineas)s::text[] AS li, %(almacenes)s::text[] AS al),
+r AS (
+    SELECT i, al,
+           pr[1 + floor(random() * cardinality(pr))::int] AS producto,
+           mo[1 + floor(random() * cardinality(mo))::int] AS modelo,
+           ma[1 + floor(random() * cardinality(ma))::int] AS marca,
+           di[1 + floor(random() * cardinality(di))::int] AS division,
+           li[1 + floor(random() * cardinality(li))::int] AS linea,
+           random() AS u   -- pocos artículos concentran las ventas (u^4)
+    FROM generate_series(1, %(n)s) i, v
+)
+SELECT left(marca, 3) || '-' || lpad(i::text, 7, '0')  AS codigo,
+       upper(producto || ' ' || modelo || ' ' || marca) AS descripcion,
+       division                                         AS categoria_division,
+       linea                                            AS categoria_linea,
+       linea || ' ' || (1 + i %% 8)                     AS categoria_clase,
+       linea || ' ' || (1 + i %% 32)                    AS categoria_subclase,
+       upper(producto)                                  AS categoria_familia,
+       marca                                            AS categoria_marca,
+       s.total                                          AS stock_total,
+       s.por_almacen                                    AS stock_por_almacen,
+       floor(power(u, 4) * 500)::int                    AS qty_6m,
+       round((power(u, 4) * 20000)::numeric, 2)         AS venta_usd_6m,
+       CASE WHEN u > 0.1 THEN CURRENT_DATE - floor(random() * 365)::int END AS fecha_ultima_venta
+FROM r CROSS JOIN LATERAL (
+    SELECT COALESCE(sum(q), 0)::int AS total,
+           COALESCE(jsonb_agg(jsonb_build_object('almacen', a, 'qty', q)), '[]'::jsonb) AS por_almacen
+    FROM (SELECT a, floor(random() * 40)::int AS q FROM unnest(r.al) a WHERE random() < 0.6 AND r.i > 0) x
+) s
+"""
+
+CLIENTS_SQL = """
+CREATE TABLE {table} AS
+WITH v AS (SELECT %(razones)s::text[] AS ra, %(lugares)s::text[] AS lu, %(tipos)s::text[] AS ti,
+                  (SELECT array_agg(codigo) FROM {items}) AS codes),
+r AS (
+    SELECT i,
+           ra[1 + floor(random() * cardinality(ra))::int] AS a,
+           ra[1 + floor(random() * cardinality(ra))::int] AS b,
+           lu[1 + floor(random() * cardinality(lu))::int] AS lugar,
+           ti[1 + floor(random() * cardinality(ti))::int] AS tipo,
+           random() AS u
+    FROM generate_series(1, %(n)s) i, v
+)
+SELECT 'C' || lpad(i::text, 7, '0')                          AS cliente_id,
+       '20' || lpad(((i::bigint * 7919) %% 1000000000)::text, 9, '0') AS ruc,
+       upper(a || ' ' || b || ' ' || lugar || ' '
+             || (ARRAY['S.A.C.', 'E.I.R.L.', 'S.R.L.'])[1 + i %% 3]) AS razon_social,
+       tipo                                                  AS tipo_cliente,
+       ARRAY(SELECT v.codes[1 + floor(random() * cardinality(v.codes))::int]
+             FROM generate_series(1, 5) WHERE r.i > 0)       AS productos_top_6m,
+       floor(power(u, 3) * 2000)::int                        AS qty_6m,
+       round((power(u, 3) * 50000)::numeric, 2)              AS venta_usd_6m,
+       CASE WHEN u > 0.05 THEN CURRENT_DATE - floor(random() * 365)::int END AS fecha_ultima_venta
+FROM r, v
+"""
+
+
+# -------- datos
+def generate(items, clients, seed):
+    """Crea bench.vw_items_search / bench.vw_clients_search con la forma de las
+    vistas. setseed hace que la misma semilla dé el mismo catálogo."""
+    t_items, t_clients = f"{SCHEMA}.{TARGETS['items']['view']}", f"{SCHEMA}.{TARGETS['clients']['view']}"
+    vocab = dict(productos=PRODUCTOS, modelos=MODELOS, marcas=MARCAS, divisiones=DIVISIONES,
+                 lineas=LINEAS, almacenes=ALMACENES, razones=RAZONES, lugares=LUGARES, tipos=TIPOS)
+    with connection.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+        cur.execute("SELECT setseed(%s)", [(seed % 1000) / 1000])
+        cur.execute(ITEMS_SQL.format(table=t_items), {**vocab, "n": items})
+        cur.execute(f"ALTER TABLE {t_items} ADD PRIMARY KEY ({TARGETS['items']['key']})")
+        cur.execute(CLIENTS_SQL.format(table=t_clients, items=t_items), {**vocab, "n": clients})
+        cur.execute(f"ALTER TABLE {t_clients} ADD PRIMARY KEY ({TARGETS['clients']['key']})")
+        cur.execute(f"ANALYZE {t_items}")
+        cur.execute(f"ANALYZE {t_clients}")
+
+def sample(sql, n):
+    with connection.cursor() as cur:
+        cur.execute(f"{sql} LIMIT %s", [n])
+        return [r[0] for r in cur.fetchall()]
+
+
+# -------- mezclas de consultas
+def zipf(rng, pool, n, s=1.1):
+    """n elementos de pool con popularidad tipo Zipf: pocos se repiten mucho
+    (como en producción; es lo que aprovecha el cache)."""
+    weights = [1 / (r + 1) ** s for r in range(len(pool))]
+    return rng.choices(pool, weights=weights, k=n)
+
+def query_mixes(rng, codes, rucs):
+    """{endpoint: (path, [(tipo, peso, [params...])])}"""
+    palabras = sorted({w for p in PRODUCTOS for w in p.split()})
+    textos = PRODUCTOS + [f"{p.split()[0]} {m.lower()}" for p in PRODUCTOS for m in MODELOS]
+    rng.shuffle(textos)
+    razones = [f"{a} {l}" for a in RAZONES for l in LUGARES] + RAZONES
+    rng.shuffle(razones)
+    return {
+        "search_items": ("/api/search/items", [
+            ("texto",    45, [{"q": t} for t in textos]),
+            ("codigo",   15, [{"q": c} for c in codes] + [{"q": c[:-3]} for c in codes[:50]]),
+            ("navegar",  15, [{"marca": m} for m in MARCAS] + [{"division": d, "sort": "stock"} for d in DIVISIONES]
+                             + [{"linea": l, "almacen": a} for l in LINEAS for a in ALMACENES]),
+            ("facetas",  10, [{"q": t, "facets": "marca,division,almacen"} for t in textos[:60]]),
+            ("pagina",    5, [{"q": t, "page": 2} for t in textos[:60]]),
+            ("orden",     5, [{"q": t, "sort": "ventas6m"} for t in textos[:60]]),
+            ("sin_hits",  5, [{"q": f"zz{w}9"} for w in palabras]),
+        ]),
+        "search_clients": ("/api/search/clients", [
+            ("nombre",   55, [{"q": r} for r in razones]),
+            ("ruc",      25, [{"q": r} for r in rucs]),
+            ("tipo",     20, [{"tipo": t} for t in TIPOS] + [{"tipo": t, "q": r} for t in TIPOS for r in RAZONES]),
+        ]),
+        "suggest": (None, [
+            ("items",    60, [("/api/suggest/items", {"q": w[:n]}) for w in palabras for n in (2, 3, 4, 6)]
+                             + [("/api/suggest/items", {"q": c[:n]}) for c in codes[:50] for n in (3, 6)]),
+            ("clients",  40, [("/api/suggest/clients", {"q": w[:n]}) for w in RAZONES for n in (2, 3, 5)]
+                             + [("/api/suggest/clients", {"q": r[:n]}) for r in rucs[:50] for n in (4, 8)]),
+        ]),
+    }
+
+def plan_requests(rng, path, kinds, n):
+    """Lista reproducible de n requests [(tipo, path, params)] según los pesos."""
+    chosen = rng.choices(kinds, weights=[w for _, w, _ in kinds], k=n)
+    per_kind = Counter(k[0] for k in chosen)
+    picks = {name: iter(zipf(rng, pool, per_kind[name])) for name, _, pool in kinds}
+    out = []
+    for name, _, _ in chosen:
+        p = next(picks[name])
+        out.append((name, *(p if path is None else (path, p))))
+    return out
+
+
+# -------- carga
+async def drive(reqs, concurrency):
+    """Corre los requests en el proceso (ASGI completo: middleware, cache,
+    vistas) con `concurrency` en vuelo. Devuelve [(tipo, segundos, status, x-cache)]."""
+    client, it, out = AsyncClient(raise_request_exception=False), iter(reqs), []
+
+    async def worker():
+        for kind, path, params in it:   # el iterador se comparte entre los workers
+            t = time.perf_counter()
+            r = await client.get(path, params)
+            out.append((kind, time.perf_counter() - t, r.status_code, r.get("X-Cache", "-")))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return out, time.perf_counter() - started
+
+def latency(samples):
+    ms = sorted(s * 1000 for s in samples)
+    if len(ms) < 2:
+        return {"p50": ms[0] if ms else None, "p95": None, "p99": None, "mean": ms[0] if ms else None,
+                "max": ms[-1] if ms else None}
+    q = quantiles(ms, n=100, method="inclusive")
+    return {"p50": round(q[49], 2), "p95": round(q[94], 2), "p99": round(q[98], 2),
+            "mean": round(mean(ms), 2), "max": round(ms[-1], 2)}
+
+def summarize(results, wall):
+    ok = [r for r in results if r[2] < 500]
+    return {
+        "requests": len(results), "errors": len(results) - len(ok), "wall_s": round(wall, 3),
+        "throughput_rps": round(len(results) / wall, 1) if wall else None,
+        "latency_ms": latency([r[1] for r in results]),
+        "status": dict(Counter(str(r[2]) for r in results)),
+        "cache": dict(Counter(r[3] for r in results)),
+        "kinds": {k: {"requests": sum(1 for r in results if r[0] == k),
+                      "latency_ms": latency([r[1] for r in results if r[0] == k])}
+                  for k in sorted({r[0] for r in results})},
+    }
+
+
+# -------- entorno
+def rss_mb(who=resource.RUSAGE_SELF):
+    # pico de memoria residente (Linux informa KB)
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+def git_revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                             capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=settings.BASE_DIR,
+                               capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return rev + ("-dirty" if dirty else "") if rev else None
+
+def start_standin(latency_ms):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, "-m", "search.standin_es", "--port", str(port),
+                             "--latency-ms", str(latency_ms)], cwd=settings.BASE_DIR)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urlopen(url, timeout=1).read()
+            return proc, url
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise CommandError("no arrancó el ES de reemplazo (search/standin_es.py)")
+
+def compare(prev, cur):
+    """[(métrica, antes, ahora)] de lo que importa para ver regresiones."""
+    rows = []
+    for alias in sorted(set(prev.get("reindex", {}).get("targets", {})) | set(cur.get("reindex", {}).get("targets", {}))):
+        get = lambda r: r.get("reindex", {}).get("targets", {}).get(alias, {}).get("docs_per_s")
+        rows.append((f"reindex {alias} docs/s", get(prev), get(cur)))
+    rows.append(("reindex pico RSS MB", prev.get("reindex", {}).get("peak_rss_mb"),
+                 cur.get("reindex", {}).get("peak_rss_mb")))
+    for ep in sorted(set(prev.get("search", {})) | set(cur.get("search", {}))):
+        p, c = prev.get("search", {}).get(ep, {}), cur.get("search", {}).get(ep, {})
+        for q in ("p50", "p95", "p99"):
+            rows.append((f"{ep} {q} ms", p.get("latency_ms", {}).get(q), c.get("latency_ms", {}).get(q)))
+        rows.append((f"{ep} req/s", p.get("throughput_rps"), c.get("throughput_rps")))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ("Benchmark reproducible: catálogo y clientes sintéticos, reindex (docs/s y memoria) y "
+            "carga sobre search_items / search_clients / suggest (p50/p95/p99 y req/s); guarda JSON")
+
+    def add_arguments(self, p):
+        p.add_argument("--items", type=int, default=20000, help="artículos sintéticos")
+        p.add_argument("--clients", type=int, default=5000, help="clientes sintéticos")
+        p.add_argument("--seed", type=int, default=42, help="misma semilla = mismos datos y mismas consultas")
+        p.add_argument("--es", default="local",
+                       help="'local' (ES de reemplazo en memoria) o la URL de un cluster de PRUEBAS: "
+                            "reindex publica ahí los alias items/clients")
+        p.add_argument("--es-latency-ms", type=float, default=0.0,
+                       help="latencia agregada a cada búsqueda del ES de reemplazo")
+        p.add_argument("--workers", type=int, default=1, help="procesos de reindex")
+        p.add_argument("--extract", choices=["sql", "python"], default="sql", help="modo de extracción de reindex")
+        p.add_argument("--requests", type=int, default=2000, help="requests medidos por endpoint (0 = sin carga)")
+        p.add_argument("--concurrency", type=int, default=20, help="requests en vuelo")
+        p.add_argument("--warmup", type=int, default=100, help="requests previos no medidos, por endpoint")
+        p.add_argument("--no-cache", action="store_true", help="mide sin el cache de respuestas (SEARCH_CACHE_TTL=0)")
+        p.add_argument("--out", help="archivo JSON de resultados (por defecto var/bench/<fecha>-<rev>.json)")
+        p.add_argument("--compare", metavar="JSON", help="resultado anterior para comparar")
+        p.add_argument("--keep-data", action="store_true",
+                       help="no borra el schema bench ni (con --es) las generaciones creadas")
+
+    def handle(self, *a, **o):
+        if ReindexCheckpoint.objects.exists():
+            # rebuild descartaría esa generación a medias: que la termine reindex --resume
+            raise CommandError("hay un reindex a medias (ReindexCheckpoint); termínalo antes de correr el bench")
+        if o["es"] != "local" and o["es"].rstrip("/") == settings.ELASTICSEARCH["URL"].rstrip("/"):
+            raise CommandError("--es apunta a ELASTICSEARCH_URL: el bench reemplaza los alias, usa un cluster de pruebas")
+        prev = None
+        if o["compare"]:
+            with open(o["compare"], encoding="utf-8") as f:
+                prev = json.load(f)
+
+        result = {
+            "revision": git_revision(), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": {k: o[k] for k in ("items", "clients", "seed", "es_latency_ms", "workers", "extract",
+                                          "requests", "concurrency", "warmup", "no_cache")},
+            "env": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                    "es": o["es"], "suggest_backend": settings.SUGGEST_BACKEND},
+        }
+        standin, before = None, None
+        suggest_dir = tempfile.mkdtemp(prefix="bench-suggest-")
+        saved_state = {s.name: s.value for s in SyncState.objects.filter(name__startswith="reindex:")}
+        try:
+            if o["es"] == "local":
+                standin, url = start_standin(o["es_latency_ms"])
+            else:
+                url = o["es"]
+            self.configure(url, suggest_dir, o["no_cache"])
+            before = {alias: (live_generation(alias), set(generations(alias))) for alias in TARGETS}
+
+            self.stdout.write(f"→ datos sintéticos: {o['items']} artículos, {o['clients']} clientes (seed {o['seed']})")
+            t = time.perf_counter()
+            generate(o["items"], o["clients"], o["seed"])
+            result["generate_s"] = round(time.perf_counter() - t, 2)
+
+            result["reindex"] = self.reindex(o)
+            if o["requests"]:
+                # consultas armadas con datos reales del catálogo generado (muestra estable)
+                codes = sample(f"SELECT codigo FROM {SCHEMA}.vw_items_search ORDER BY md5(codigo)", 200)
+                rucs = sample(f"SELECT ruc FROM {SCHEMA}.vw_clients_search ORDER BY md5(ruc)", 200)
+                result["search"] = asyncio.run(self.load(o, codes, rucs))
+        finally:
+            if not o["keep_data"]:
+                self.cleanup(before)
+            SyncState.objects.filter(name__startswith="reindex:").exclude(name__in=saved_state).delete()
+            for name, value in saved_state.items():
+                SyncState.objects.filter(name=name).update(value=value)
+            shutil.rmtree(suggest_dir, ignore_errors=True)
+            if standin:
+                standin.terminate()
+                standin.wait()
+
+        out = o["out"] or os.path.join(settings.BASE_DIR, "var", "bench",
+                                       f"{time.strftime('%Y%m%d-%H%M%S')}-{result['revision'] or 'sin-git'}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        self.report(result, prev)
+        self.stdout.write(self.style.SUCCESS(f"resultados en {out}"))
+
+    def configure(self, url, suggest_dir, no_cache):
+        """Apunta este proceso (y los workers de reindex) al ES del bench, a las
+        tablas sintéticas y a un directorio de suggest descartable."""
+        os.environ["ELASTICSEARCH_URL"] = settings.ELASTICSEARCH["URL"] = url
+        os.environ["SUGGEST_DIR"] = settings.SUGGEST_DIR = suggest_dir
+        os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA},public"   # libpq: vale para toda conexión nueva
+        settings.SLOW_REQUEST_MS = 0
+        if no_cache:
+            settings.SEARCH_CACHE_TTL = 0
+        close_es()
+        connections.close_all()
+        if getattr(connection, "pool", None):
+            connection.close_pool()
+
+    def reindex(self, o):
+        self.stdout.write(f"→ reindex full ({o['workers']} workers, extract {o['extract']})")
+        rss_before = rss_mb()
+        t = time.perf_counter()
+        call_command("reindex", target="all", workers=o["workers"], extract=o["extract"], stdout=StringIO())
+        wall = time.perf_counter() - t
+        targets = {}
+        for alias in TARGETS:
+            last = SyncState.objects.get(name=f"reindex:{alias}").value["last"]
+            targets[alias] = {"docs": last["docs"], "failed": last["failed"], "elapsed_s": round(last["elapsed"], 3),
+                              "docs_per_s": round(last["docs_per_s"], 1)}
+        return {"wall_s": round(wall, 3), "targets": targets, "rss_before_mb": rss_before,
+                "peak_rss_mb": rss_mb(),
+                "workers_peak_rss_mb": rss_mb(resource.RUSAGE_CHILDREN) if o["workers"] > 1 else None}
+
+    async def load(self, o, codes, rucs):
+        rng = random.Random(o["seed"])
+        out = {}
+        try:
+            for endpoint, (path, kinds) in query_mixes(rng, codes, rucs).items():
+                reqs = plan_requests(rng, path, kinds, o["warmup"] + o["requests"])
+                self.stdout.write(f"→ {endpoint}: {o['requests']} requests, concurrencia {o['concurrency']}")
+                caches["search"].clear()
+                await drive(reqs[:o["warmup"]], o["concurrency"])
+                caches["search"].clear()
+                results, wall = await drive(reqs[o["warmup"]:], o["concurrency"])
+                out[endpoint] = summarize(results, wall)
+        finally:
+            await aclose_es()
+        return out
+
+    def cleanup(self, before):
+        with connection.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        for alias, (live, old) in (before or {}).items():
+            # vuelve el alias a donde estaba (o lo quita si no había) y borra
+            # sólo lo que creó el bench
+            cur = live_generation(alias)
+            if live and cur != live:
+                swap_alias(alias, live)
+            elif not live and cur:
+                es().indices.update_aliases(actions=[{"remove": {"index": cur, "alias": alias}}])
+            for gen in set(generations(alias)) - old:
+                drop_generation(gen)
+
+    def report(self, r, prev):
+        ri = r.get("reindex", {})
+        for alias, t in ri.get("targets", {}).items():
+            self.stdout.write(f"  reindex {alias}: {t['docs']} docs en {t['elapsed_s']}s ({t['docs_per_s']:,.0f} docs/s)")
+        if ri:
+            self.stdout.write(f"  reindex pico RSS: {ri['peak_rss_mb']} MB (workers: {ri['workers_peak_rss_mb'] or '-'})")
+        for ep, s in r.get("search", {}).items():
+            lat = s["latency_ms"]
+            self.stdout.write(f"  {ep}: p50 {lat['p50']}ms  p95 {lat['p95']}ms  p99 {lat['p99']}ms  "
+                              f"{s['throughput_rps']} req/s  errores {s['errors']}  cache {s['cache']}")
+        if prev:
+            self.stdout.write(f"comparado con {prev.get('revision')} ({prev.get('started_at')}):")
+            for name, a, b in compare(prev, r):
+                delta = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else ""
+                self.stdout.write(f"  {name:<32} {a if a is not None else '-':>10} → {b if b is not None else '-':>10}  {delta}")
@@ -0,0 +1,231 @@
+import sys, csv, json, time
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from elasticsearch import ApiError
+from search.bulk import BulkIndexer
+from search.es import get_es
+from search.locks import AdvisoryLock
+from search.models import SyncState
+
+# Suma los deltas por almacén sobre el nested stock_por_almacen y recalcula
+# stock_total, sin reenviar el documento completo. Los deltas no son
+# idempotentes, así que desde la tabla de cambios cada fila va con su id
+# (params.changes = [[id, almacen, delta], ...]) y sólo se aplican las de id
+# mayor que el stock_seq del documento: reintentar un lote con fallas
+# parciales, o reaplicar un tramo ya aplicado, no suma dos veces. reindex
+# estampa stock_seq con el último id que la vista ya refleja (ver replay).
+# Un archivo no trae ids (params.deltas): si algo falla se escriben sólo los
+# deltas pendientes.
+STOCK_SCRIPT = """
+Map deltas = params.deltas;
+if (params.changes != null) {
+  long seq = ctx._source.stock_seq == null ? -1L : ((Number) ctx._source.stock_seq).longValue();
+  long top = seq;
+  deltas = new HashMap();
+  for (c in params.changes) {
+    long id = ((Number) c[0]).longValue();
+    if (id > seq) { deltas.put(c[1], deltas.getOrDefault(c[1], 0) + c[2]); top = Math.max(top, id); }
+  }
+  if (top == seq) { ctx.op = 'noop'; return; }
+  ctx._source.stock_seq = top;
+}
+if (ctx._source.stock_por_almacen == null) { ctx._source.stock_por_almacen = []; }
+for (e in deltas.entrySet()) {
+  boolean found = false;
+  for (s in ctx._source.stock_por_almacen) {
+    if (s.almacen == e.getKey()) { s.qty = (s.qty == null ? 0 : s.qty) + e.getValue(); found = true; break; }
+  }
+  if (!found) { ctx._source.stock_por_almacen.add(['almacen': e.getKey(), 'qty': e.getValue()]); }
+}
+int total = 0;
+for (s in ctx._source.stock_por_almacen) { total += (s.qty == null ? 0 : s.qty); }
+ctx._source.stock_total = total;
+"""
+
+def coalesce(changes):
+    """[(codigo, almacen, delta)] -> {codigo: {almacen: delta_neto}}"""
+    out = defaultdict(lambda: defaultdict(int))
+    for codigo, almacen, delta in changes:
+        out[str(codigo)][str(almacen)] += int(delta)
+    return out
+
+def by_code(rows):
+    """[(id, codigo, almacen, delta)] -> {codigo: [[id, almacen, delta], ...]}"""
+    out = defaultdict(list)
+    for _id, codigo, almacen, delta in rows:
+        out[str(codigo)].append([_id, str(almacen), int(delta)])
+    return out
+
+def read_file(path):
+    # CSV con cabecera codigo,almacen,delta o NDJSON {"codigo","almacen","delta"}
+    f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    with f:
+        if path.endswith((".ndjson", ".jsonl")):
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    yield r["codigo"], r["almacen"], r["delta"]
+        else:
+            for r in csv.DictReader(f):
+                yield r["codigo"], r["almacen"], r["delta"]
+
+def write_file(path, deltas):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["codigo", "almacen", "delta"])
+        for codigo, by_alm in deltas.items():
+            w.writerows([codigo, a, d] for a, d in by_alm.items() if d)
+
+def read_table(table, after, limit=None, upto=None):
+    """Filas id > after en orden de id: hasta `limit` filas y/o hasta id `upto`."""
+    sql, params = f"SELECT id, codigo, almacen, delta FROM {table} WHERE id > %s", [after]
+    if upto is not None:
+        sql, params = sql + " AND id <= %s", params + [upto]
+    sql += " ORDER BY id"
+    if limit is not None:
+        sql, params = sql + " LIMIT %s", params + [limit]
+    with connection.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+def watermark(table):
+    with connection.cursor() as cur:
+        cur.execute(f"SELECT COALESCE(max(id), 0) FROM {table}")
+        return cur.fetchone()[0]
+
+def send_updates(params, index="items", **bulk_opts):
+    """{codigo: params del script} -> un update por código."""
+    with BulkIndexer(get_es("batch"), index, label="stock", **bulk_opts) as bi:
+        for codigo, p in params.items():
+            body = {"script": {"source": STOCK_SCRIPT, "lang": "painless", "params": p}}
+            bi.add(b'{"update":{"_id":' + json.dumps(codigo).encode() + b',"retry_on_conflict":3}}\n',
+                   json.dumps(body, separators=(",", ":")).encode() + b"\n")
+    return bi
+
+def apply_deltas(deltas, index="items", **bulk_opts):
+    """Deltas netos sin ids (archivo): no hay guarda contra reaplicar."""
+    params = {}
+    for codigo, by_alm in deltas.items():
+        by_alm = {a: d for a, d in by_alm.items() if d}
+        if by_alm:
+            params[codigo] = {"deltas": by_alm, "changes": None}
+    return send_updates(params, index, **bulk_opts)
+
+def apply_changes(changes, index="items", **bulk_opts):
+    """Filas de la tabla por código ({codigo: [[id, almacen, delta], ...]})."""
+    return send_updates({c: {"deltas": None, "changes": rows} for c, rows in changes.items()}, index, **bulk_opts)
+
+def replay(table, after, index, batch=50000, upto=None):
+    """Reaplica las filas id > after (hasta `upto`, o hasta el final) sobre
+    `index`. Lo usa reindex: los documentos llevan en stock_seq el último id
+    que la vista ya reflejaba al extraerlos, y lo que ingest_stock mandó a la
+    generación anterior mientras tanto se pierde al publicar la nueva. Por la
+    guarda del script reaplicar es seguro siempre que las filas lleguen en
+    orden de id a cada documento, así que ante una falla se corta ahí.
+    Devuelve (último id aplicado, códigos que fallaron por algo transitorio):
+    con fallas, volver a llamar desde ese id completa lo que faltó."""
+    while True:
+        rows = read_table(table, after, limit=batch, upto=upto)
+        if not rows:
+            return after, []
+        bi = apply_changes(by_code(rows), index)
+        failed = [_id for _id, t in bi.failed_types.items() if t != "document_missing_exception"]
+        if failed:
+            return after, failed
+        after = rows[-1][0]
+
+class Command(BaseCommand):
+    help = "Aplica movimientos de stock (codigo, almacen, delta) como updates parciales sobre el índice items"
+
+    def add_arguments(self, p):
+        src = p.add_mutually_exclusive_group()
+        src.add_argument("--file", help="CSV (codigo,almacen,delta) o .ndjson; '-' para stdin")
+        src.add_argument("--table", default=settings.STOCK_CHANGES_TABLE or None,
+                         help="tabla de cambios con columnas id, codigo, almacen, delta "
+                              "(por defecto STOCK_CHANGES_TABLE)")
+        p.add_argument("--batch", type=int, default=50000, help="filas de la tabla por pasada")
+        p.add_argument("--follow", type=float, default=0,
+                       help="con --table: sigue leyendo cada N segundos en vez de terminar")
+        p.add_argument("--replay-from", type=int, metavar="ID",
+                       help="con --table: reaplica las filas id > ID sobre items sin mover la "
+                            "posición guardada (lo que pide reindex si no pudo terminar su replay)")
+        p.add_argument("--pending-out",
+                       help="con --file: dónde escribir los deltas que no se aplicaron "
+                            "(por defecto <archivo>.pendiente.csv)")
+
+    def handle(self, *a, **o):
+        if o["file"]:
+            return self.from_file(o["file"], o["pending_out"])
+        if not o["table"]:
+            raise CommandError("indica --file o --table (o define STOCK_CHANGES_TABLE)")
+        table = o["table"]
+        # reindex lo toma mientras reaplica y publica items: sin esto un lote
+        # nuevo podría llegar a un documento antes que las filas del replay
+        lock = AdvisoryLock(f"stock:{table}")
+        try:
+            if o["replay_from"] is not None:
+                with lock:
+                    upto, failed = replay(table, o["replay_from"], "items", o["batch"])
+                if failed:
+                    raise CommandError(f"{len(failed)} artículos fallaron; repite con --replay-from {upto}")
+                return self.stdout.write(self.style.SUCCESS(f"reaplicado hasta id {upto}"))
+            self.follow(table, o, lock)
+        finally:
+            lock.close()
+
+    def follow(self, table, o, lock):
+        state, _ = SyncState.objects.get_or_create(name=f"stock:{table}", defaults={"value": 0})
+        # tope (id) del lote mandado y aún no confirmado
+        inflight, _ = SyncState.objects.get_or_create(name=f"stock:{table}:en_curso", defaults={"value": None})
+        while True:
+            with lock:
+                after = state.value or 0
+                if inflight.value:
+                    batch = read_table(table, after, upto=inflight.value)
+                else:
+                    batch = read_table(table, after, limit=o["batch"])
+                    if batch:
+                        inflight.value = batch[-1][0]
+                        inflight.save(update_fields=["value", "updated_at"])
+                pending = self.apply(apply_changes, by_code(batch)) if batch else []
+                if pending and not o["follow"]:
+                    raise CommandError(f"{len(pending)} updates no aplicados; el lote (ids {after + 1}..{inflight.value}) "
+                                       "se reintenta en la próxima corrida")
+                if inflight.value and not pending:
+                    with transaction.atomic():
+                        state.value, inflight.value = inflight.value, None
+                        state.save(update_fields=["value", "updated_at"])
+                        inflight.save(update_fields=["value", "updated_at"])
+            if not o["follow"]:
+                break
+            if pending or len(batch) < o["batch"]:
+                time.sleep(o["follow"])
+
+    def from_file(self, path, pending_out):
+        deltas = coalesce(read_file(path))
+        try:
+            pending = self.apply(apply_deltas, deltas)
+        except ApiError as e:
+            # no se sabe qué lotes entraron: reaplicar el archivo duplicaría esos deltas
+            raise CommandError(f"ES rechazó un lote ({e}); parte del archivo ya pudo haberse aplicado, "
+                               "no lo reintentes entero sin revisar el stock") from e
+        if pending:
+            out = pending_out or ("stock.pendiente.csv" if path == "-" else f"{path}.pendiente.csv")
+            write_file(out, {c: deltas[c] for c in pending if c in deltas})
+            raise CommandError(f"{len(pending)} artículos no se aplicaron; sus deltas quedaron en {out}. "
+                               "Reintenta con ese archivo, no con el original (el resto ya se sumó)")
+
+    def apply(self, send, changes):
+        """Manda `changes` con apply_deltas/apply_changes. Devuelve los códigos
+        que fallaron por algo transitorio (ES caído, rechazos); uno que no
+        existe en el índice no se reintenta."""
+        if not changes:
+            return []
+        bi = send(changes)
+        style = self.style.WARNING if bi.failed else self.style.SUCCESS
+        self.stdout.write(style(f"{len(changes)} artículos: " + bi.summary()))
+        for _id, err in bi.errors[:5]:
+            self.stderr.write(f"    {_id or '-'}: {err.get('type') if isinstance(err, dict) else err}")
+        return [_id for _id, t in bi.failed_types.items() if t != "document_missing_exception"]
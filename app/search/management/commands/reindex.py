@@ -1,15 +1,61 @@
-import os, json
+import os, json, time, hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from itertools import islice, zip_longest
+from datetime import date, datetime
 from decimal import Decimal
-from django.core.management.base import BaseCommand
-from django.db import connection
-from elasticsearch import Elasticsearch
+from uuid import uuid4
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+from elasticsearch import NotFoundError
+from search.es import get_es
+from search.metrics import record_reindex
+from search.locks import AdvisoryLock
+from search.models import DocFingerprint, ReindexCheckpoint, SyncState
+from search.suggest import build_suggest
+from search.management.commands import ingest_stock
+from search.bulk import (BulkIndexer, bulk_load_profile, merge_stats, summarize,
+                         BULK_WORKERS, BULK_MAX_BYTES)
 
-ES = Elasticsearch(os.getenv("ELASTICSEARCH_URL","http://elastic:9200"))
+def es():
+    # perfil "batch": timeouts largos y sin breaker; un cliente por proceso
+    return get_es("batch")
+
+# cuántas generaciones anteriores se conservan para rollback instantáneo
+KEEP_GENERATIONS = int(os.getenv("REINDEX_KEEP_GENERATIONS", "2"))
+# filas por ida y vuelta del cursor del lado servidor
+FETCH_SIZE = int(os.getenv("REINDEX_FETCH_SIZE", "5000"))
+# docs por consulta/escritura de huellas (delta)
+FP_BATCH = 1000
+# diferencia aceptada entre el conteo de ES y el de la vista (fracción)
+COUNT_TOLERANCE = float(os.getenv("REINDEX_COUNT_TOLERANCE", "0.001"))
+# orden físico del índice ("campo:orden,..."), igual al sort más usado por la
+# API: ES corta temprano las búsquedas con ese sort. Vacío = sin index sort.
+# Sólo aplica a generaciones nuevas (rebuild).
+ITEMS_INDEX_SORT = os.getenv("ITEMS_INDEX_SORT", "venta_usd_6m:desc,codigo:asc")
+CLIENTS_INDEX_SORT = os.getenv("CLIENTS_INDEX_SORT", "venta_usd_6m:desc,cliente_id:asc")
+
+def index_sort(spec):
+    """'venta_usd_6m:desc,codigo:asc' -> settings index.sort.*"""
+    fields = [f.strip().split(":") for f in (spec or "").split(",") if f.strip()]
+    if not fields:
+        return {}
+    return {"index.sort.field": [f[0] for f in fields],
+            "index.sort.order": [f[1] if len(f) > 1 else "asc" for f in fields]}
 
 ITEMS_MAPPING = {
-  "settings":{"analysis":{"analyzer":{"es_text":{"tokenizer":"standard","filter":["lowercase","asciifolding"]}}}},
+  "settings":{**index_sort(ITEMS_INDEX_SORT), "analysis":{
+    "analyzer":{"es_text":{"tokenizer":"standard","filter":["lowercase","asciifolding"]},
+                "codigo_prefix":{"tokenizer":"keyword","filter":["lowercase","codigo_edge"]},
+                "codigo_exact":{"tokenizer":"keyword","filter":["lowercase"]}},
+    "filter":{"codigo_edge":{"type":"edge_ngram","min_gram":2,"max_gram":30}}}},
   "mappings":{"properties":{
-    "codigo":{"type":"keyword"},
+    # codigo.prefix: prefijos precalculados (edge-ngram) para buscar códigos parciales con un match simple
+    "codigo":{"type":"keyword","fields":{"prefix":{"type":"text","analyzer":"codigo_prefix",
+              "search_analyzer":"codigo_exact","index_options":"docs","norms":False}}},
     "descripcion":{"type":"text","analyzer":"es_text"},
     "categoria_division":{"type":"keyword"},
     "categoria_linea":{"type":"keyword"},
@@ -19,110 +65,602 @@ ITEMS_MAPPING = {
     "categoria_marca":{"type":"keyword"},
     "stock_total":{"type":"integer"},
     "stock_por_almacen":{"type":"nested","properties":{"almacen":{"type":"keyword"},"qty":{"type":"integer"}}},
-    "qty_6m":{"type":"integer"},
-    "venta_usd_6m":{"type":"scaled_float","scaling_factor":100},
-    "fecha_ultima_venta":{"type":"date"},
+    # sólo se muestran u ordenan (también el index sort): doc values sin
+    # índice BKD. Un filtro por rango sobre ellos sería un scan de doc values.
+    "qty_6m":{"type":"integer","index":False},
+    "venta_usd_6m":{"type":"scaled_float","scaling_factor":100,"index":False},
+    "fecha_ultima_venta":{"type":"date","index":False},
+    # último movimiento de stock que refleja el doc (lo estampa reindex y lo
+    # avanza ingest_stock; el script lo lee del _source)
+    "stock_seq":{"type":"long","index":False,"doc_values":False},
     "suggest":{"type":"completion"}
   }}
 }
 
 CLIENTS_MAPPING = {
+  "settings":index_sort(CLIENTS_INDEX_SORT),
   "mappings":{"properties":{
     "cliente_id":{"type":"keyword"},
     "ruc":{"type":"keyword"},
     "razon_social":{"type":"text"},
     "tipo_cliente":{"type":"keyword"},
-    "productos_top_6m":{"type":"keyword"},
-    "qty_6m":{"type":"integer"},
-    "venta_usd_6m":{"type":"scaled_float","scaling_factor":100},
-    "fecha_ultima_venta":{"type":"date"},
+    # sólo se muestran
+    "productos_top_6m":{"type":"keyword","index":False,"doc_values":False},
+    "qty_6m":{"type":"integer","index":False},
+    # ordenan (y el index sort), no se filtran: ver ITEMS_MAPPING
+    "venta_usd_6m":{"type":"scaled_float","scaling_factor":100,"index":False},
+    "fecha_ultima_venta":{"type":"date","index":False},
     "suggest":{"type":"completion"}
   }}
 }
 
-def recreate_index(name, mapping):
-    if ES.indices.exists(index=name): ES.indices.delete(index=name)
-    ES.indices.create(index=name, body=mapping)
+# -------- generaciones + alias
+# Cada reindex construye un índice nuevo (items_v20250101030000) y recién al
+# final mueve el alias de lectura ("items"/"clients") de forma atómica. La API
+# siempre consulta el alias, así nunca ve un índice a medio construir.
+def create_generation(alias, mapping):
+    name = f"{alias}_v{datetime.now():%Y%m%d%H%M%S}"
+    es().indices.create(index=name, body=mapping)
+    return name
+
+def live_generation(alias):
+    try:
+        return next(iter(es().indices.get_alias(name=alias)), None)
+    except NotFoundError:
+        return None
+
+def generations(alias):
+    # nombres con timestamp => orden lexicográfico = orden cronológico
+    return sorted(es().indices.get(index=f"{alias}_v*", expand_wildcards="open").keys())
+
+def swap_alias(alias, index):
+    actions = [{"add": {"index": index, "alias": alias}}]
+    live = live_generation(alias)
+    if live:
+        if live == index:
+            return
+        actions.insert(0, {"remove": {"index": live, "alias": alias}})
+    elif es().indices.exists(index=alias):
+        # índice concreto del esquema anterior: se elimina en la misma operación
+        actions.insert(0, {"remove_index": {"index": alias}})
+    es().indices.update_aliases(actions=actions)
+
+def prune_generations(alias, keep):
+    live = live_generation(alias)
+    old = [g for g in generations(alias) if g != live and g < (live or "")]
+    for g in old[:max(len(old) - keep, 0)]:
+        drop_generation(g)
+    return old[-keep:] if keep else []
+
+def drop_generation(index):
+    if live_generation(index.rsplit("_v", 1)[0]) == index:
+        raise CommandError(f"{index} es la generación publicada; no se borra")
+    es().indices.delete(index=index, ignore_unavailable=True)
+    DocFingerprint.objects.filter(index_name=index).delete()
+    ReindexCheckpoint.objects.filter(index_name=index).delete()
+    SyncState.objects.filter(name=f"stock_seq:{index}").delete()
+
+def published_settings(alias):
+    # refresh/réplicas con que queda la generación al terminar la carga
+    st = TARGETS[alias]["mapping"].get("settings", {})
+    return {"index.refresh_interval": st.get("refresh_interval"),
+            "index.number_of_replicas": st.get("number_of_replicas")}
+
+@contextmanager
+def target_locks(aliases):
+    """Un reindex por target a la vez (p.ej. cron que se solapa)."""
+    locks = [AdvisoryLock(f"reindex:{alias}") for alias in sorted(aliases)]
+    try:
+        for lock in locks:
+            if not lock.acquire(wait=False):
+                raise CommandError(f"[{lock.name.split(':', 1)[1]}] hay otro reindex corriendo")
+        yield
+    finally:
+        for lock in locks:
+            lock.close()   # libera los locks
+
+# -------- checkpoints
+def unfinished_generation(alias):
+    """Generación en construcción que dejó una corrida cortada, si la hay."""
+    c = ReindexCheckpoint.objects.filter(target=alias).order_by("-index_name").first()
+    return c.index_name if c else None
+
+def plan_checkpoints(alias, index, ranges):
+    ReindexCheckpoint.objects.bulk_create(
+        [ReindexCheckpoint(target=alias, index_name=index, lo=lo, hi=hi) for lo, hi in ranges])
+
+def pending_ranges(index):
+    return [{"lo": c.lo if c.position is None else c.position, "hi": c.hi, "checkpoint": c.pk}
+            for c in ReindexCheckpoint.objects.filter(index_name=index, done=False).order_by("pk")]
+
+def save_checkpoint(pk, position, done=False):
+    ReindexCheckpoint.objects.filter(pk=pk).update(position=position, done=done, updated_at=timezone.now())
+
+def view_count(view):
+    with connection.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM {view}")
+        return cur.fetchone()[0]
+
+def verify_count(index, view, before):
+    """El conteo de ES tiene que caer entre el de la vista al empezar
+    (`before`) y el de ahora, más COUNT_TOLERANCE: la vista sigue recibiendo
+    altas y bajas mientras dura la extracción, así que igualdad exacta
+    descartaría generaciones sanas."""
+    es().indices.refresh(index=index)
+    n_es = es().count(index=index)["count"]
+    n_db = view_count(view)
+    lo, hi = min(before, n_db), max(before, n_db)
+    tol = int(hi * COUNT_TOLERANCE)
+    if not lo - tol <= n_es <= hi + tol:
+        raise CommandError(f"[{index}] conteo no cuadra: ES={n_es} vs {view}={before}→{n_db} (tolerancia {tol})")
+    return n_es
+
+# -------- extracción
+# Documentos armados por Postgres (json_build_object): cada fila llega como
+# texto JSON listo para el cuerpo NDJSON del bulk, sin pasar por un dict Python.
+ITEMS_DOC_SQL = """json_build_object(
+    'codigo', codigo,
+    'descripcion', descripcion,
+    'categoria_division', categoria_division,
+    'categoria_linea', categoria_linea,
+    'categoria_clase', categoria_clase,
+    'categoria_subclase', categoria_subclase,
+    'categoria_familia', categoria_familia,
+    'categoria_marca', categoria_marca,
+    'stock_total', COALESCE(stock_total, 0)::int,
+    'stock_por_almacen', COALESCE(NULLIF(NULLIF(stock_por_almacen::text, ''), 'null')::jsonb, '[]'::jsonb),
+    'qty_6m', COALESCE(qty_6m, 0)::int,
+    'venta_usd_6m', COALESCE(venta_usd_6m, 0),
+    'fecha_ultima_venta', fecha_ultima_venta,
+    'suggest', json_build_object('input', json_build_array(codigo, descripcion))
+)"""
+
+CLIENTS_DOC_SQL = """json_build_object(
+    'cliente_id', cliente_id,
+    'ruc', ruc,
+    'razon_social', razon_social,
+    'tipo_cliente', tipo_cliente,
+    'productos_top_6m', productos_top_6m,
+    'qty_6m', qty_6m,
+    'venta_usd_6m', venta_usd_6m,
+    'fecha_ultima_venta', fecha_ultima_venta,
+    'suggest', json_build_object('input', json_build_array(ruc, razon_social))
+)"""
+
+def stream(sql, params=None, fetch_size=FETCH_SIZE, as_dict=False):
+    """Itera un SELECT con cursor del lado servidor (named cursor): en memoria
+    sólo vive un lote de fetch_size filas, no la vista completa.
+
+    WITH HOLD para que el cursor sobreviva en autocommit: así las huellas y
+    checkpoints que se escriben mientras se itera quedan confirmados enseguida
+    y no dentro de una transacción que se pierde si el proceso muere."""
+    connection.ensure_connection()
+    with connection.connection.cursor(name=f"reindex_{uuid4().hex}", withhold=True) as cur:
+        cur.itersize = fetch_size
+        cur.execute(sql, params)
+        cols = None
+        for r in cur:
+            if as_dict:
+                # en un named cursor description recién existe tras el primer fetch
+                cols = cols or [c[0] for c in cur.description]
+                r = dict(zip(cols, r))
+            yield r
+
+def item_doc(r):
+    spa = r["stock_por_almacen"]
+    if spa in (None, "", "null"):
+        spa = []
+    spa = to_plain(spa)  # asegura lista de objetos [{almacen, qty}]
+    return {
+        "codigo": r["codigo"],
+        "descripcion": r["descripcion"],
+        "categoria_division": r["categoria_division"],
+        "categoria_linea": r["categoria_linea"],
+        "categoria_clase": r["categoria_clase"],
+        "categoria_subclase": r["categoria_subclase"],
+        "categoria_familia": r["categoria_familia"],
+        "categoria_marca": r["categoria_marca"],
+        "stock_total": int(r["stock_total"] or 0),
+        "stock_por_almacen": spa,
+        "qty_6m": int(r["qty_6m"] or 0),
+        "venta_usd_6m": to_plain(r["venta_usd_6m"] or 0),
+        "fecha_ultima_venta": r["fecha_ultima_venta"],  # ES acepta ISO si viene date/datetime
+        "suggest": {"input":[r["codigo"], r["descripcion"]]}
+    }
 
-def rows(sql):
+def client_doc(r):
+    return {
+        "cliente_id": r["cliente_id"], "ruc": r["ruc"],
+        "razon_social": r["razon_social"], "tipo_cliente": r["tipo_cliente"],
+        "productos_top_6m": r["productos_top_6m"],
+        "qty_6m": r["qty_6m"], "venta_usd_6m": r["venta_usd_6m"],
+        "fecha_ultima_venta": r["fecha_ultima_venta"],
+        "suggest": {"input":[r["ruc"], r["razon_social"]]}
+    }
+
+def stock_seq_sql(target):
+    """Último id de la tabla de cambios de stock, para items. Va como columna
+    del mismo SELECT que lee la vista: la subconsulta se evalúa una vez, con el
+    mismo snapshot, así que es el último cambio que esas filas ya reflejan
+    (siempre que la fila de cambios y el stock se confirmen en la misma
+    transacción)."""
+    if target != "items" or not settings.STOCK_CHANGES_TABLE:
+        return None
+    return f"(SELECT COALESCE(max(id), 0) FROM {settings.STOCK_CHANGES_TABLE})"
+
+def extract(target, mode="sql", fetch_size=FETCH_SIZE, lo=None, hi=None):
+    """Genera (id, json_bytes, stock_seq) del target, en orden de clave y
+    opcionalmente acotado al rango keyset (lo, hi]. stock_seq es None si no
+    aplica (ver stock_seq_sql); no va dentro del JSON para que no cambie la
+    huella de todos los docs cada vez que entra un movimiento.
+
+    mode="sql": Postgres arma el JSON y se reenvían los bytes tal cual.
+    mode="python": SELECT * + item_doc/client_doc (camino anterior, más lento).
+    """
+    t = TARGETS[target]
+    key = t["key"]
+    where, params = [], []
+    if lo is not None:
+        where.append(f"{key} > %s"); params.append(lo)
+    if hi is not None:
+        where.append(f"{key} <= %s"); params.append(hi)
+    tail = (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {key}"
+    seq = stock_seq_sql(target) or "NULL"
+    if mode == "sql":
+        sql = f"SELECT {key}, {t['doc_sql']}::text, {seq} FROM {t['view']}" + tail
+        for _id, src, stock_seq in stream(sql, params or None, fetch_size):
+            yield _id, src.encode(), stock_seq
+    else:
+        sql = f"SELECT *, {seq} AS _stock_seq FROM {t['view']}" + tail
+        for r in stream(sql, params or None, fetch_size, as_dict=True):
+            stock_seq = r.pop("_stock_seq")
+            yield r[key], dumps(t["doc"](r)), stock_seq
+
+def stamp(src, stock_seq):
+    return src if stock_seq is None else src[:-1] + b',"stock_seq":%d}' % stock_seq
+
+def keyset_ranges(target, n):
+    """Corta la vista en n rangos (lo, hi] de tamaño parecido sobre la clave.
+    El primero arranca en None y el último termina en None, así no se pierde
+    nada que entre a la vista entre este SELECT y la extracción."""
+    if n <= 1:
+        return [(None, None)]
+    t = TARGETS[target]
+    key = t["key"]
     with connection.cursor() as cur:
-        cur.execute(sql)
-        cols = [c[0] for c in cur.description]
-        for r in cur.fetchall():
-            yield dict(zip(cols, r))
+        cur.execute(f"""
+            SELECT max({key}) FROM (
+                SELECT {key}, ntile(%s) OVER (ORDER BY {key}) AS part FROM {t['view']}
+            ) s GROUP BY part ORDER BY 1
+        """, [n])
+        bounds = [r[0] for r in cur.fetchall()][:-1]
+    return list(zip([None] + bounds, bounds + [None]))
+
+def dumps(doc):
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode()
+
+def _json_default(x):
+    if isinstance(x, (date, datetime)):
+        return x.isoformat()
+    return to_plain(x)
+
+# -------- carga
+def load(target, index, mode="sql", fetch_size=FETCH_SIZE, lo=None, hi=None, delta=False,
+         checkpoint=None, **bulk_opts):
+    """Extrae (un rango de) la vista y lo manda al pipeline bulk compartido;
+    devuelve las estadísticas del BulkIndexer (docs, fallidos, tiempo).
+
+    Guarda la huella de cada doc para `index` recién cuando su lote bulk
+    terminó (bi.committed), sin los rechazados: si el proceso muere o ES
+    corta, lo que no llegó al índice no queda marcado como indexado y el
+    próximo delta lo manda. Con delta=True sólo se envían los docs cuya huella
+    cambió (o que no existían). Con `checkpoint` (pk de ReindexCheckpoint) va
+    registrando la última clave confirmada."""
+    skipped, position, unsaved = 0, None, []
+    with BulkIndexer(es(), index, label=target, **bulk_opts) as bi:
+        docs = extract(target, mode, fetch_size, lo, hi)
+        while chunk := list(islice(docs, FP_BATCH)):
+            fps = {str(_id): hashlib.md5(src).hexdigest() for _id, src, _ in chunk}
+            if delta:
+                known = dict(DocFingerprint.objects
+                             .filter(index_name=index, doc_id__in=list(fps))
+                             .values_list("doc_id", "fp"))
+                chunk = [c for c in chunk if known.get(str(c[0])) != fps[str(c[0])]]
+                skipped += len(fps) - len(chunk)
+            for _id, src, stock_seq in chunk:
+                bi.index(_id, stamp(src, stock_seq))
+            unsaved += [(str(_id), fps[str(_id)]) for _id, _, _ in chunk]
+            if bi.committed != position:
+                position = bi.committed
+                unsaved = save_committed(index, unsaved, position, bi.failed_ids)
+                if checkpoint:
+                    save_checkpoint(checkpoint, position)
+    # al salir del with, close() ya esperó todos los lotes
+    save_committed(index, unsaved, None, bi.failed_ids)
+    if checkpoint:
+        save_checkpoint(checkpoint, bi.committed if bi.committed is not None else lo, done=True)
+    # lo que ES rechazó se vuelve a intentar en el próximo delta
+    if bi.failed_ids:
+        DocFingerprint.objects.filter(index_name=index, doc_id__in=bi.failed_ids).delete()
+    st = bi.stats()
+    if delta:
+        st["skipped"] = skipped
+    return st
+
+def save_committed(index, unsaved, upto, failed):
+    """Guarda las huellas de `unsaved` (en orden de envío) hasta la clave
+    `upto` inclusive, o todas con None, menos las de `failed`; devuelve el resto."""
+    n = len(unsaved) if upto is None else next((i + 1 for i, (k, _) in enumerate(unsaved) if k == str(upto)), 0)
+    failed = set(failed)
+    save_fingerprints(index, {k: fp for k, fp in unsaved[:n] if k not in failed})
+    return unsaved[n:]
+
+def save_fingerprints(index, fps):
+    DocFingerprint.objects.bulk_create(
+        [DocFingerprint(index_name=index, doc_id=k, fp=v) for k, v in fps.items()],
+        update_conflicts=True, unique_fields=["index_name", "doc_id"], update_fields=["fp"],
+    )
+
+def delete_vanished(target, index, **bulk_opts):
+    """Borra del índice los docs que tienen huella pero ya no están en la vista."""
+    t = TARGETS[target]
+    with connection.cursor() as cur:
+        cur.execute(f"""
+            SELECT f.doc_id FROM {DocFingerprint._meta.db_table} f
+            WHERE f.index_name = %s
+              AND NOT EXISTS (SELECT 1 FROM {t['view']} v WHERE v.{t['key']}::text = f.doc_id)
+        """, [index])
+        gone = [r[0] for r in cur.fetchall()]
+    if not gone:
+        return 0
+    with BulkIndexer(es(), index, label=f"{target}:delete", **bulk_opts) as bi:
+        for _id in gone:
+            bi.delete(_id)
+    DocFingerprint.objects.filter(index_name=index, doc_id__in=gone).exclude(doc_id__in=bi.failed_ids).delete()
+    return len(gone) - len(bi.failed_ids)
+
+def _init_worker():
+    # Cada proceso del pool abre su propia conexión a Postgres y su propio
+    # cliente ES (get_es es por pid); nada de sockets heredados del padre.
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    django.setup()
+
+TARGETS = {
+    "items": {
+        "mapping": ITEMS_MAPPING, "view": "vw_items_search", "key": "codigo",
+        "doc_sql": ITEMS_DOC_SQL, "doc": item_doc,
+    },
+    "clients": {
+        "mapping": CLIENTS_MAPPING, "view": "vw_clients_search", "key": "cliente_id",
+        "doc_sql": CLIENTS_DOC_SQL, "doc": client_doc,
+    },
+}
 
 class Command(BaseCommand):
     help = "Reindexa items/clients desde vistas Postgres"
 
     def add_arguments(self, p):
         p.add_argument("--target", choices=["items","clients","all"], default="all")
+        p.add_argument("--keep", type=int, default=KEEP_GENERATIONS,
+                       help="generaciones anteriores a conservar para rollback")
+        p.add_argument("--rollback", action="store_true",
+                       help="apunta el alias a la generación anterior, sin reindexar")
+        p.add_argument("--extract", choices=["sql","python"], default="sql",
+                       help="sql: JSON armado en Postgres y enviado tal cual; python: camino anterior")
+        p.add_argument("--fetch-size", type=int, default=FETCH_SIZE,
+                       help="filas por lote del cursor del lado servidor")
+        p.add_argument("--bulk-workers", type=int, default=BULK_WORKERS,
+                       help="requests bulk concurrentes en vuelo")
+        p.add_argument("--bulk-mb", type=float, default=BULK_MAX_BYTES / 1024 / 1024,
+                       help="tamaño máximo de cada request bulk (MB)")
+        p.add_argument("--workers", type=int, default=int(os.getenv("REINDEX_WORKERS", "1")),
+                       help="procesos en paralelo; cada vista se parte en rangos keyset")
+        p.add_argument("--mode", choices=["full","delta"], default="full",
+                       help="full: generación nueva + swap; delta: sólo cambios sobre la generación publicada")
+        p.add_argument("--resume", action="store_true",
+                       help="continúa la generación que dejó a medias una corrida anterior, desde su checkpoint")
 
     def handle(self, *a, **o):
         tgt = o["target"]
+        aliases = list(TARGETS) if tgt == "all" else [tgt]
 
-        if tgt in ("items","all"):
-            self.stdout.write("→ (re)creando índice items…")
-            recreate_index("items", ITEMS_MAPPING)
-            ops=[]
-            for r in rows("SELECT * FROM vw_items_search"):
-                # doc = {
-                #     "codigo": r["codigo"], "descripcion": r["descripcion"],
-                #     "categoria_division": r["categoria_division"], "categoria_linea": r["categoria_linea"],
-                #     "categoria_clase": r["categoria_clase"], "categoria_subclase": r["categoria_subclase"],
-                #     "categoria_familia": r["categoria_familia"], "categoria_marca": r["categoria_marca"],
-                #     "stock_total": r["stock_total"], "stock_por_almacen": r["stock_por_almacen"],
-                #     "qty_6m": r["qty_6m"], "venta_usd_6m": r["venta_usd_6m"],
-                #     "fecha_ultima_venta": r["fecha_ultima_venta"],
-                #     "suggest": {"input":[r["codigo"], r["descripcion"]]}
-                # }
-                # ops.extend([{"index":{"_index":"items","_id":r["codigo"]}}, doc])
-                # if len(ops) >= 2000: ES.bulk(operations=ops); ops.clear()
-                spa = r["stock_por_almacen"]
-                if spa in (None, "", "null"):
-                    spa = []
-                spa = to_plain(spa)  # asegura lista de objetos [{almacen, qty}]
-                doc = {
-                    "codigo": r["codigo"],
-                    "descripcion": r["descripcion"],
-                    "categoria_division": r["categoria_division"],
-                    "categoria_linea": r["categoria_linea"],
-                    "categoria_clase": r["categoria_clase"],
-                    "categoria_subclase": r["categoria_subclase"],
-                    "categoria_familia": r["categoria_familia"],
-                    "categoria_marca": r["categoria_marca"],
-                    "stock_total": int(r["stock_total"] or 0),
-                    "stock_por_almacen": spa,
-                    "qty_6m": int(r["qty_6m"] or 0),
-                    "venta_usd_6m": to_plain(r["venta_usd_6m"] or 0),
-                    "fecha_ultima_venta": r["fecha_ultima_venta"],  # ES acepta ISO si viene date/datetime
-                    "suggest": {"input":[r["codigo"], r["descripcion"]]}
-                }
-                ops.extend([{"index":{"_index":"items","_id":r["codigo"]}}, doc])
-                if len(ops) >= 2000:
-                    bulk_send(ops, label="items")
-                    ops.clear()
-            # if ops: ES.bulk(operations=ops)
-            bulk_send(ops, label="items")
-
-        if tgt in ("clients","all"):
-            self.stdout.write("→ (re)creando índice clients…")
-            recreate_index("clients", CLIENTS_MAPPING)
-            ops=[]
-            for r in rows("SELECT * FROM vw_clients_search"):
-                doc = {
-                    "cliente_id": r["cliente_id"], "ruc": r["ruc"],
-                    "razon_social": r["razon_social"], "tipo_cliente": r["tipo_cliente"],
-                    "productos_top_6m": r["productos_top_6m"],
-                    "qty_6m": r["qty_6m"], "venta_usd_6m": r["venta_usd_6m"],
-                    "fecha_ultima_venta": r["fecha_ultima_venta"],
-                    "suggest": {"input":[r["ruc"], r["razon_social"]]}
-                }
-                ops.extend([{"index":{"_index":"clients","_id":r["cliente_id"]}}, doc])
-                if len(ops) >= 2000: ES.bulk(operations=ops); ops.clear()
-            if ops: ES.bulk(operations=ops)
+        with target_locks(aliases):
+            if o["rollback"]:
+                for alias in aliases:
+                    self.rollback(alias)
+            elif o["mode"] == "delta":
+                self.delta(aliases, o)
+            else:
+                self.rebuild(aliases, o)
 
         self.stdout.write(self.style.SUCCESS("Reindex completado."))
 
+    def rebuild(self, aliases, o):
+        gens, plan = {}, {}
+        before = {alias: view_count(TARGETS[alias]["view"]) for alias in aliases}
+        for alias in aliases:
+            gen = unfinished_generation(alias) if o["resume"] else None
+            if gen:
+                self.stdout.write(f"→ reanudando {gen}…")
+            else:
+                # lo que haya quedado de una corrida cortada ya no se va a reanudar
+                # (si llegó a publicarse antes de morir, sólo sobran sus checkpoints)
+                if stale := unfinished_generation(alias):
+                    if stale == live_generation(alias):
+                        ReindexCheckpoint.objects.filter(index_name=stale).delete()
+                    else:
+                        drop_generation(stale)
+                gen = create_generation(alias, TARGETS[alias]["mapping"])
+                if stock_seq_sql(alias):
+                    # desde dónde reaplicar stock antes de publicar (sobrevive a --resume)
+                    SyncState.objects.create(name=f"stock_seq:{gen}",
+                                             value=ingest_stock.watermark(settings.STOCK_CHANGES_TABLE))
+                plan_checkpoints(alias, gen, keyset_ranges(alias, o["workers"]))
+                self.stdout.write(f"→ construyendo {gen}…")
+            gens[alias], plan[alias] = gen, pending_ranges(gen)
+
+        # Si algo falla durante la carga, la generación y sus checkpoints quedan
+        # para --resume; el alias sigue apuntando a la generación anterior.
+        with ExitStack() as stack:
+            for alias, gen in gens.items():
+                stack.enter_context(bulk_load_profile(es(), gen, restore=published_settings(alias)))
+            stats = self.load_all(gens, plan, o)
+
+        # se verifican todos antes de publicar ninguno: con --target all no
+        # queda items publicado y clients no
+        counts, bad = {}, []
+        for alias, gen in gens.items():
+            self.report(stats[alias], "full")
+            try:
+                counts[alias] = verify_count(gen, TARGETS[alias]["view"], before[alias])
+            except CommandError as e:
+                self.stderr.write(str(e))
+                bad.append(alias)
+        if bad:
+            for alias in bad:
+                drop_generation(gens[alias])   # reanudarla no arreglaría el conteo
+            raise CommandError(f"conteo fuera de tolerancia en {', '.join(bad)}; no se publicó nada")
+
+        for alias, gen in gens.items():
+            n = counts[alias]
+            prev = live_generation(alias)
+
+            def publish():
+                # checkpoints antes del swap: una generación publicada nunca
+                # queda como "a medio construir" para la próxima corrida
+                ReindexCheckpoint.objects.filter(index_name=gen).delete()
+                swap_alias(alias, gen)
+
+            if stock_seq_sql(alias):
+                self.catch_up_stock(gen, SyncState.objects.get(name=f"stock_seq:{gen}").value, publish)
+                SyncState.objects.filter(name=f"stock_seq:{gen}").delete()
+            else:
+                publish()
+            kept = prune_generations(alias, o["keep"])
+            self.stdout.write(f"  {alias}: {prev or '-'} → {gen} ({n} docs, rollback: {', '.join(kept) or '-'})")
+            self.refresh_suggest(alias, gen)
+
+    def delta(self, aliases, o):
+        """Compara la huella de cada doc de la vista con la guardada para la
+        generación publicada: manda sólo altas/cambios y borra lo que ya no está."""
+        gens = {}
+        for alias in aliases:
+            gens[alias] = live_generation(alias)
+            if not gens[alias]:
+                raise CommandError(f"[{alias}] no hay generación publicada; corre primero un reindex full")
+            self.stdout.write(f"→ delta sobre {gens[alias]}…")
+        plan = {alias: [{"lo": lo, "hi": hi} for lo, hi in keyset_ranges(alias, o["workers"])]
+                for alias in gens}
+        before = {alias: view_count(TARGETS[alias]["view"]) for alias in gens}
+        # El delta reescribe docs de items con el stock de la vista: mientras
+        # dura, ingest_stock espera (si no, un lote suyo podría caer sobre un doc
+        # ya reescrito y adelantar su stock_seq antes que el replay).
+        stock = AdvisoryLock(f"stock:{settings.STOCK_CHANGES_TABLE}") if stock_seq_sql("items") and "items" in gens else None
+        try:
+            if stock:
+                stock.acquire()
+                start = ingest_stock.watermark(settings.STOCK_CHANGES_TABLE)
+            stats = self.load_all(gens, plan, o)
+            if stock:
+                self.catch_up_stock(gens["items"], start, lock=stock)
+        finally:
+            if stock:
+                stock.close()
+        for alias, gen in gens.items():
+            stats[alias]["deleted"] = delete_vanished(
+                alias, gen, workers=o["bulk_workers"], max_bytes=int(o["bulk_mb"] * 1024 * 1024))
+            self.report(stats[alias], "delta")
+            verify_count(gen, TARGETS[alias]["view"], before[alias])
+            self.refresh_suggest(alias, gen)
+
+    def catch_up_stock(self, gen, start, publish=None, lock=None):
+        """Reaplica sobre `gen` los movimientos de stock desde `start` (tomado
+        antes de extraer): lo que ingest_stock mandó a la generación anterior
+        mientras tanto, o lo que el delta pisó. Los docs llevan stock_seq, así
+        que el script salta lo que la vista ya reflejaba. El grueso va sin
+        frenar a ingest_stock (la generación aún no es visible); el final y el
+        swap (`publish`), con su lock tomado, para que nada nuevo llegue a un
+        doc antes que las filas del replay."""
+        table = settings.STOCK_CHANGES_TABLE
+        own = lock is None
+        upto, failed = ingest_stock.replay(table, start, gen) if own else (start, [])
+        lock = lock or AdvisoryLock(f"stock:{table}")
+        try:
+            if not failed:
+                if own:
+                    lock.acquire()
+                upto, failed = ingest_stock.replay(table, upto, gen)
+                if not failed and publish:
+                    publish()
+        finally:
+            if own:
+                lock.close()
+        if failed:
+            hint = ("se reintenta con --resume" if publish else
+                    f"completa con `manage.py ingest_stock --table {table} --replay-from {upto}`")
+            raise CommandError(f"{gen}: {len(failed)} artículos sin su stock al día (desde id {upto}); {hint}")
+        self.stdout.write(f"  [{gen}] stock reaplicado hasta id {upto}")
+
+    def refresh_suggest(self, alias, gen):
+        # índice de prefijos para suggest_* (los workers lo recargan solos)
+        try:
+            n = build_suggest(es(), alias, gen)
+        except Exception as e:
+            self.stderr.write(self.style.WARNING(f"  [{alias}] no se pudo generar el autocompletado: {e}"))
+        else:
+            self.stdout.write(f"  [{alias}] autocompletado: {n} docs")
+
+    def load_all(self, gens, plan, o):
+        """Carga cada rango del plan ({alias: [{lo, hi, checkpoint}]}). Con
+        --workers > 1 un pool de procesos extrae, transforma y manda los rangos
+        en paralelo (items y clients a la vez)."""
+        args = dict(mode=o["extract"], fetch_size=o["fetch_size"], delta=o["mode"] == "delta",
+                    workers=o["bulk_workers"], max_bytes=int(o["bulk_mb"] * 1024 * 1024))
+        parts = {alias: [] for alias in gens}
+        started = time.monotonic()
+        elapsed = {alias: 0.0 for alias in gens}
+
+        if o["workers"] <= 1:
+            for alias, gen in gens.items():
+                for r in plan[alias]:
+                    parts[alias].append(load(alias, gen, **r, **args))
+                elapsed[alias] = time.monotonic() - started
+                started = time.monotonic()
+            return {alias: merge_stats(parts[alias], alias, elapsed[alias]) for alias in gens}
+
+        # que los procesos hijos no hereden la conexión ni el pool (sus threads
+        # y sockets); cada worker arma el suyo y el padre lo recrea al usarlo
+        connections.close_all()
+        connection.close_pool()
+        with ProcessPoolExecutor(max_workers=o["workers"], initializer=_init_worker) as pool:
+            # rangos intercalados entre targets para que avancen a la vez
+            jobs = [(alias, r) for rs in zip_longest(*([(a, x) for x in plan[a]] for a in gens))
+                    for alias, r in filter(None, rs)]
+            futs = {pool.submit(load, alias, gens[alias], **r, **args): alias for alias, r in jobs}
+            pending = {alias: len(r) for alias, r in plan.items()}
+            for f in as_completed(futs):
+                alias = futs[f]
+                parts[alias].append(f.result())
+                pending[alias] -= 1
+                if not pending[alias]:
+                    elapsed[alias] = time.monotonic() - started
+        return {alias: merge_stats(parts[alias], alias, elapsed[alias]) for alias in gens}
+
+    def report(self, st, mode):
+        record_reindex(st, mode)   # para /metrics
+        style = self.style.WARNING if st["failed"] else self.style.SUCCESS
+        self.stdout.write(style("  " + summarize(st)))
+        for _id, err in st["errors"][:5]:
+            self.stderr.write(f"    {_id or '-'}: {err}")
+
+    def rollback(self, alias):
+        live = live_generation(alias)
+        older = [g for g in generations(alias) if live and g < live]
+        if not older:
+            raise CommandError(f"[{alias}] no hay generación anterior para rollback")
+        swap_alias(alias, older[-1])
+        self.stdout.write(f"  {alias}: {live} → {older[-1]} (rollback)")
+
 
 def to_plain(x):
     """Convierte Decimal/bytes/objetos a tipos JSON serializables."""
@@ -145,14 +683,3 @@ def to_plain(x):
     if isinstance(x, dict):
         return {k: to_plain(v) for k, v in x.items()}
     return x
-
-def bulk_send(ops, label="bulk"):
-    if not ops:
-        return
-    resp = ES.bulk(operations=ops, refresh=False)
-    if resp.get("errors"):
-        # imprime el primer error representativo y falla
-        for it in resp.get("items", []):
-            err = it.get("index", {}).get("error")
-            if err:
-                raise RuntimeError(f"[{label}] Bulk error: {err}")
\ No newline at end of file
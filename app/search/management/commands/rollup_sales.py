@@ -0,0 +1,98 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from search.models import ItemMonthlySales, ClientMonthlySales, SyncState
+
+# rollup -> (tabla, columna de ventas que agrupa)
+ROLLUPS = {
+    "items": (ItemMonthlySales._meta.db_table, "codigo"),
+    "clients": (ClientMonthlySales._meta.db_table, "cliente_id"),
+}
+STATE = "rollup:ventas"
+
+
+def touched_months(id_col, after, upto):
+    """Meses (primer día) con filas nuevas en ventas entre (after, upto]."""
+    with connection.cursor() as cur:
+        if after is None:
+            cur.execute(f"SELECT DISTINCT date_trunc('month', fecha)::date FROM ventas WHERE {id_col} <= %s", [upto])
+        else:
+            cur.execute(f"""
+                SELECT DISTINCT date_trunc('month', fecha)::date FROM ventas
+                WHERE {id_col} > %s AND {id_col} <= %s
+            """, [after, upto])
+        return sorted(r[0] for r in cur.fetchall() if r[0])
+
+def watermark_month(id_col, upto):
+    with connection.cursor() as cur:
+        cur.execute(f"SELECT date_trunc('month', max(fecha))::date FROM ventas WHERE {id_col} = %s", [upto])
+        return cur.fetchone()[0]
+
+def last_months(n):
+    with connection.cursor() as cur:
+        cur.execute("""
+            SELECT generate_series(date_trunc('month', CURRENT_DATE) - make_interval(months => %s - 1),
+                                   date_trunc('month', CURRENT_DATE), INTERVAL '1 month')::date
+        """, [n])
+        return [r[0] for r in cur.fetchall()]
+
+def rebuild_month(mes):
+    """Recalcula un mes completo en los dos rollups (borra e inserta: así
+    también desaparecen códigos/clientes que ya no tienen ventas ese mes)."""
+    out = {}
+    with connection.cursor() as cur:
+        for name, (table, col) in ROLLUPS.items():
+            cur.execute(f"DELETE FROM {table} WHERE mes = %s", [mes])
+            cur.execute(f"""
+                INSERT INTO {table} ({col}, mes, qty, venta)
+                SELECT {col}, %s, COALESCE(SUM(qty), 0), COALESCE(SUM(total_usd), 0)
+                FROM ventas
+                WHERE fecha >= %s AND fecha < %s::date + INTERVAL '1 month' AND {col} IS NOT NULL
+                GROUP BY {col}
+            """, [mes, mes, mes])
+            out[name] = cur.rowcount
+    return out
+
+
+class Command(BaseCommand):
+    help = "Mantiene los rollups mensuales de ventas por artículo y por cliente (sólo los meses tocados)"
+
+    def add_arguments(self, p):
+        p.add_argument("--id-column", default="id",
+                       help="columna creciente de ventas (id o fecha de carga) que marca qué filas son nuevas")
+        p.add_argument("--months", type=int, default=0,
+                       help="además recalcula los últimos N meses (correcciones/borrados en ventas)")
+        p.add_argument("--full", action="store_true", help="recalcula todos los meses")
+
+    def handle(self, *a, **o):
+        id_col = o["id_column"]
+        state, _ = SyncState.objects.get_or_create(name=STATE, defaults={"value": None})
+        after = None if o["full"] else (state.value or {}).get("id")
+
+        with connection.cursor() as cur:
+            cur.execute(f"SELECT max({id_col}) FROM ventas")
+            upto = cur.fetchone()[0]
+        if upto is None:
+            self.stdout.write("ventas vacía: nada que hacer")
+            return
+
+        months = set(touched_months(id_col, after, upto)) if after != upto else set()
+        if o["months"]:
+            months.update(last_months(o["months"]))
+        elif not o["full"] and (state.value or {}).get("mes"):
+            # Una fila con id menor que la marca que aún no estaba confirmada al
+            # leer max() (los ids se asignan antes del commit) no entra en ningún
+            # rango: se recalcula el mes de la marca anterior, que es donde caen
+            # las ventas que se estaban cargando en ese momento.
+            months.add(date.fromisoformat(state.value["mes"]))
+        for mes in sorted(months):
+            # mes por mes en su transacción; la marca avanza recién al final,
+            # si se corta a mitad la próxima corrida recalcula los mismos meses
+            with transaction.atomic():
+                n = rebuild_month(mes)
+            self.stdout.write(f"  {mes:%Y-%m}: " + ", ".join(f"{k}: {v}" for k, v in n.items()))
+        mes = watermark_month(id_col, upto)
+        state.value = {"id": upto if isinstance(upto, int) else str(upto),   # int o timestamp
+                       "mes": mes.isoformat() if mes else None}
+        state.save(update_fields=["value", "updated_at"])
+        self.stdout.write(self.style.SUCCESS(f"{len(months)} meses recalculados; ventas hasta {id_col}={upto}"))
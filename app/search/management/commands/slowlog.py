@@ -0,0 +1,83 @@
+import json
+from urllib.parse import unquote
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from search.es import get_es
+
+
+def read_entries(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def searches(call):
+    """Bodies de _search que se pueden volver a correr: [(índice, body)].
+    Un _msearch se abre en sus pares header/body; los de PIT (sin índice en
+    la ruta) se saltean porque el PIT ya expiró."""
+    target, body = call["target"].split("?", 1)[0], call["body"]
+    parts = [unquote(p) for p in target.strip("/").split("/")]
+    index = parts[0] if len(parts) == 2 else None
+    if not body:
+        return []
+    if parts[-1] == "_search" and index and isinstance(body, dict):
+        return [(index, body)]
+    if parts[-1] == "_msearch" and isinstance(body, list):
+        return [(h.get("index", index), b) for h, b in zip(body[::2], body[1::2]) if h.get("index", index)]
+    return []
+
+def top_nodes(profile, n):
+    # nodos de query de todos los shards, ordenados por tiempo
+    nodes = []
+    def walk(q, shard, depth):
+        nodes.append((q["time_in_nanos"], shard, depth, q["type"], q["description"]))
+        for c in q.get("children", []):
+            walk(c, shard, depth + 1)
+    for shard in profile["shards"]:
+        for s in shard["searches"]:
+            for q in s["query"]:
+                walk(q, shard["id"], 0)
+    return sorted(nodes, reverse=True)[:n]
+
+
+class Command(BaseCommand):
+    help = "Lista los requests lentos (SLOW_LOG_PATH) y vuelve a correr sus búsquedas con el profile API de ES"
+
+    def add_arguments(self, p):
+        p.add_argument("--last", type=int, default=20, help="cuántas entradas listar")
+        p.add_argument("--profile", metavar="ID", help="re-ejecuta con profile: true las búsquedas de esa entrada")
+        p.add_argument("--top", type=int, default=10, help="nodos de query más lentos a mostrar")
+        p.add_argument("--out", help="guarda las respuestas de profile completas en este archivo JSON")
+
+    def handle(self, *a, **o):
+        entries = read_entries(settings.SLOW_LOG_PATH)
+        if not o["profile"]:
+            for e in entries[-o["last"]:]:
+                self.stdout.write(f"{e['id']}  {e['at'][:19]}  {e['status']}  {e['total_ms']:>8.1f}ms  "
+                                  f"{e['path']}?{e['query']}  {e['phases']}")
+            if not entries:
+                self.stdout.write(f"sin entradas en {settings.SLOW_LOG_PATH}")
+            return
+
+        entry = next((e for e in entries if e["id"] == o["profile"]), None)
+        if entry is None:
+            raise CommandError(f"no hay entrada {o['profile']} en {settings.SLOW_LOG_PATH}")
+        todo = [s for call in entry["es"] for s in searches(call)]
+        if not todo:
+            raise CommandError("la entrada no tiene búsquedas que se puedan re-ejecutar")
+
+        self.stdout.write(f"{entry['path']}?{entry['query']}  ({entry['total_ms']}ms originalmente)")
+        out = []
+        for index, body in todo:
+            r = get_es("batch").search(index=index, body={**body, "profile": True}).body
+            out.append({"index": index, "body": body, "response": r})
+            total = r["hits"]["total"]
+            self.stdout.write(self.style.SUCCESS(f"→ {index}: took {r['took']}ms, "
+                                                 f"hits {total['value'] if isinstance(total, dict) else total}"))
+            for nanos, shard, depth, type_, desc in top_nodes(r["profile"], o["top"]):
+                self.stdout.write(f"  {nanos / 1e6:9.2f}ms  {shard}  {'  ' * depth}{type_}: {desc[:120]}")
+        if o["out"]:
+            with open(o["out"], "w", encoding="utf-8") as f:
+                json.dump(out, f, indent=2, default=str)
+            self.stdout.write(f"profile completo en {o['out']}")
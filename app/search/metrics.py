@@ -0,0 +1,184 @@
+import os, json, time, uuid, logging, contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.decorators import sync_and_async_middleware
+from prometheus_client import (CollectorRegistry, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+log = logging.getLogger("search.slow")
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+REQUEST_SECONDS = Histogram("search_request_seconds", "Tiempo total de cada request",
+                            ["endpoint", "method", "status"], buckets=BUCKETS)
+# fases: build (armar el body ES), es (ida y vuelta HTTP a ES), es_took (lo
+# que ES dice que tardó), hits (post-proceso), serialize (JSON), sql
+PHASE_SECONDS = Histogram("search_phase_seconds", "Tiempo por fase dentro de un request",
+                          ["endpoint", "phase"], buckets=BUCKETS)
+
+# máximo de llamadas ES que se guardan por request para el log de lentos
+SLOW_MAX_ES_CALLS = 5
+
+
+# -------- tiempos del request en curso
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.es_calls = []
+
+_current = contextvars.ContextVar("search_request_timing", default=None)
+
+@contextmanager
+def phase(name):
+    """Suma el tiempo del bloque a la fase `name` del request en curso (fuera
+    de un request, p.ej. en reindex, no hace nada)."""
+    t = _current.get()
+    if t is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        t.phases[name] += time.perf_counter() - start
+
+def timed(name):
+    # decorador para funciones sync: todo el llamado cuenta como la fase `name`
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def record_es(target, body, seconds, took=None):
+    """Lo llama el transport de search/es.py en cada request HTTP a ES."""
+    t = _current.get()
+    if t is None:
+        return
+    t.phases["es"] += seconds
+    if took is not None:
+        t.phases["es_took"] += took / 1000
+    if len(t.es_calls) < SLOW_MAX_ES_CALLS:
+        t.es_calls.append({"target": target, "ms": round(seconds * 1000, 1), "took": took,
+                           "body": body if isinstance(body, (dict, list)) else None})
+
+def _sql_timer(execute, sql, params, many, context):
+    with phase("sql"):
+        return execute(sql, params, many, context)
+
+def _install_sql_timer(sender, connection, **kwargs):
+    if _sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_timer)
+
+connection_created.connect(_install_sql_timer)
+
+
+# -------- middleware
+@sync_and_async_middleware
+def timing_middleware(get_response):
+    """Histograma del total y de cada fase por endpoint (ruta de urls.py),
+    header Server-Timing y log de requests lentos (SLOW_REQUEST_MS)."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = _current.set(RequestTiming())
+            try:
+                response = await get_response(request)
+                _finish(request, response, _current.get())
+                return response
+            finally:
+                _current.reset(token)
+        markcoroutinefunction(middleware)
+        return middleware
+
+    def middleware(request):
+        token = _current.set(RequestTiming())
+        try:
+            response = get_response(request)
+            _finish(request, response, _current.get())
+            return response
+        finally:
+            _current.reset(token)
+    return middleware
+
+def _finish(request, response, t):
+    total = time.perf_counter() - t.started
+    m = getattr(request, "resolver_match", None)
+    endpoint = m.route if m else "unmatched"
+    REQUEST_SECONDS.labels(endpoint, request.method, str(response.status_code)).observe(total)
+    for name, secs in t.phases.items():
+        PHASE_SECONDS.labels(endpoint, name).observe(secs)
+    response["Server-Timing"] = ", ".join(
+        [f"{name};dur={secs * 1000:.1f}" for name, secs in t.phases.items()] + [f"total;dur={total * 1000:.1f}"])
+    if settings.SLOW_REQUEST_MS and total * 1000 >= settings.SLOW_REQUEST_MS:
+        _log_slow(request, response, endpoint, total, t)
+
+def _log_slow(request, response, endpoint, total, t):
+    entry = {
+        "id": uuid.uuid4().hex[:12], "at": timezone.now().isoformat(), "pid": os.getpid(),
+        "endpoint": endpoint, "path": request.path, "query": request.GET.urlencode(),
+        "status": response.status_code, "total_ms": round(total * 1000, 1),
+        "phases": {k: round(v * 1000, 1) for k, v in t.phases.items()}, "es": t.es_calls,
+    }
+    log.warning("lento %s %s %.0fms %s", entry["id"], request.get_full_path(), entry["total_ms"], entry["phases"])
+    try:
+        os.makedirs(os.path.dirname(settings.SLOW_LOG_PATH), exist_ok=True)
+        with open(settings.SLOW_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str, separators=(",", ":")) + "\n")
+    except OSError as e:
+        log.error("no se pudo escribir %s: %s", settings.SLOW_LOG_PATH, e)
+
+
+# -------- reindex: lo registra el comando, /metrics lo lee de SyncState
+def record_reindex(st, mode):
+    from search.models import SyncState
+    state, _ = SyncState.objects.get_or_create(name=f"reindex:{st['label']}", defaults={"value": {}})
+    v = state.value or {}
+    v["docs_total"] = v.get("docs_total", 0) + st["docs"]
+    v["failed_total"] = v.get("failed_total", 0) + st["failed"]
+    v["last"] = {"mode": mode, "docs": st["docs"], "failed": st["failed"], "elapsed": st["elapsed"],
+                 "docs_per_s": st["docs"] / st["elapsed"] if st["elapsed"] else 0.0, "finished_at": time.time()}
+    state.value = v
+    state.save(update_fields=["value", "updated_at"])
+
+class ReindexCollector:
+    def collect(self):
+        from search.models import SyncState
+        docs = CounterMetricFamily("reindex_docs", "Documentos indexados (acumulado)", labels=["target"])
+        failed = CounterMetricFamily("reindex_failed", "Documentos rechazados (acumulado)", labels=["target"])
+        dps = GaugeMetricFamily("reindex_last_docs_per_second", "docs/s de la última corrida", labels=["target", "mode"])
+        secs = GaugeMetricFamily("reindex_last_duration_seconds", "Duración de la última corrida", labels=["target", "mode"])
+        ts = GaugeMetricFamily("reindex_last_finished_timestamp_seconds", "Fin de la última corrida", labels=["target", "mode"])
+        for s in SyncState.objects.filter(name__startswith="reindex:"):
+            target, v = s.name.split(":", 1)[1], s.value or {}
+            docs.add_metric([target], v.get("docs_total", 0))
+            failed.add_metric([target], v.get("failed_total", 0))
+            last = v.get("last")
+            if last:
+                dps.add_metric([target, last["mode"]], last["docs_per_s"])
+                secs.add_metric([target, last["mode"]], last["elapsed"])
+                ts.add_metric([target, last["mode"]], last["finished_at"])
+        return [docs, failed, dps, secs, ts]
+
+_reindex_registry = CollectorRegistry(auto_describe=False)
+_reindex_registry.register(ReindexCollector())
+
+
+def metrics_view(request):
+    """Formato de texto Prometheus. Con PROMETHEUS_MULTIPROC_DIR (varios
+    workers de uvicorn) junta los histogramas de todos los procesos."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry) + generate_latest(_reindex_registry),
+                        content_type=CONTENT_TYPE_LATEST)
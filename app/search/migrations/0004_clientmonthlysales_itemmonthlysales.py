@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0003_syncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientMonthlySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cliente_id', models.CharField(max_length=50)),
+                ('mes', models.DateField()),
+                ('qty', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('venta', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mes'], name='clientmonthlysales_mes_idx')],
+                'constraints': [models.UniqueConstraint(fields=('cliente_id', 'mes'), name='clientmonthlysales_cliente_mes_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ItemMonthlySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo', models.CharField(max_length=50)),
+                ('mes', models.DateField()),
+                ('qty', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('venta', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mes'], name='itemmonthlysales_mes_idx')],
+                'constraints': [models.UniqueConstraint(fields=('codigo', 'mes'), name='itemmonthlysales_codigo_mes_uniq')],
+            },
+        ),
+    ]
@@ -1,3 +1,64 @@
 from django.db import models
 
-# Create your models here.
+
+class DocFingerprint(models.Model):
+    """Huella (md5 del JSON enviado) de cada documento indexado, por generación
+    de índice. `reindex --mode delta` la usa para mandar sólo lo que cambió."""
+    index_name = models.CharField(max_length=100)
+    doc_id = models.CharField(max_length=100)
+    fp = models.CharField(max_length=32)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["index_name", "doc_id"], name="docfingerprint_index_doc_uniq"),
+        ]
+
+
+class ReindexCheckpoint(models.Model):
+    """Avance de un rango keyset (lo, hi] de una generación en construcción.
+    `position` es la última clave cuyo bulk ya fue confirmado por ES; con
+    `reindex --resume` el rango sigue desde ahí. Se borra al publicar."""
+    target = models.CharField(max_length=20)
+    index_name = models.CharField(max_length=100)
+    lo = models.JSONField(null=True)
+    hi = models.JSONField(null=True)
+    position = models.JSONField(null=True)
+    done = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class SyncState(models.Model):
+    """Posición persistente de procesos incrementales (p.ej. último id leído
+    de la tabla de movimientos de stock)."""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.JSONField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ItemMonthlySales(models.Model):
+    """Ventas de `ventas` sumadas por artículo y mes (mes = primer día). La
+    mantiene `rollup_sales`; el detalle lee de acá en vez de agregar ventas."""
+    codigo = models.CharField(max_length=50)
+    mes = models.DateField()
+    qty = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    venta = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["codigo", "mes"], name="itemmonthlysales_codigo_mes_uniq"),
+        ]
+        indexes = [models.Index(fields=["mes"], name="itemmonthlysales_mes_idx")]
+
+
+class ClientMonthlySales(models.Model):
+    """Igual que ItemMonthlySales, por cliente."""
+    cliente_id = models.CharField(max_length=50)
+    mes = models.DateField()
+    qty = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    venta = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cliente_id", "mes"], name="clientmonthlysales_cliente_mes_uniq"),
+        ]
+        indexes = [models.Index(fields=["mes"], name="clientmonthlysales_mes_idx")]
@@ -0,0 +1,546 @@
+"""Elasticsearch de reemplazo, en memoria, para `manage.py bench`.
+
+Implementa sólo lo que usan reindex, build_suggest y las vistas de búsqueda
+(índices, alias, settings, bulk, scroll, _search, _msearch, _count) con una
+evaluación simple de las queries: bool / constant_score / multi_match / match /
+term / terms / range / nested, sort + search_after, track_total_hits,
+aggregations filter / terms / nested / reverse_nested y completion suggest.
+No hay scoring ni highlight. Sirve para medir el lado de la aplicación
+(armado del body, cache, serialización, Postgres) y reindex de punta a punta
+sin un cluster; el costo real de las queries se mide contra un ES de pruebas.
+
+    python -m search.standin_es --port 9299 [--latency-ms 5]
+"""
+import re, json, time, fnmatch, argparse, threading, unicodedata
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+from uuid import uuid4
+
+# campos de texto (como el analizador de ES: minúsculas, sin tildes, por palabra)
+TEXT_FIELDS = {"descripcion", "categoria_marca", "categoria_linea", "categoria_division",
+               "categoria_familia", "razon_social", "tipo_cliente"}
+SCROLL_KEEP = 300   # segundos que vive un scroll sin usarse
+
+_word = re.compile(r"\w+")
+
+def fold(s):
+    s = unicodedata.normalize("NFKD", str(s or "").strip().lower())
+    return "".join(c for c in s if not unicodedata.combining(c))
+
+def tokens(s):
+    return _word.findall(fold(s))
+
+
+class NotFound(Exception):
+    pass
+
+
+class Store:
+    def __init__(self):
+        self.indices = {}   # nombre -> {"docs": {id: src}, "tok": {id: set}, "settings": {}, "mappings": {}}
+        self.aliases = {}   # alias -> set(índices)
+        self.scrolls = {}   # id -> (hits restantes, expira)
+        self.lock = threading.Lock()
+
+    # -------- nombres
+    def resolve(self, expr, must_exist=True):
+        names = []
+        for part in unquote(expr).split(","):
+            if part in self.aliases:
+                names += sorted(self.aliases[part])
+            elif "*" in part:
+                names += sorted(n for n in self.indices if fnmatch.fnmatch(n, part))
+            elif part in self.indices:
+                names.append(part)
+            elif must_exist:
+                raise NotFound(part)
+        return list(dict.fromkeys(names))
+
+    def docs(self, expr, query=None):
+        """(índice, id, src, tokens) de los docs candidatos: con `query`, sólo
+        los que tienen los términos obligatorios (índice invertido)."""
+        for name in self.resolve(expr):
+            idx = self.indices[name]
+            ids = _candidates(query, idx["post"]) if query else None
+            for _id in (idx["docs"] if ids is None else ids):
+                if _id in idx["docs"]:
+                    yield name, _id, idx["docs"][_id], idx["tok"][_id]
+
+    # -------- índices y alias
+    def create(self, name, body):
+        if name in self.indices:
+            return 400, _error("resource_already_exists_exception", f"index [{name}] already exists", 400)
+        st = dict(body.get("settings") or {})
+        self.indices[name] = {"docs": {}, "tok": {}, "post": {}, "mappings": body.get("mappings") or {},
+                              "settings": {f"index.{k}" if not k.startswith("index.") else k: v
+                                           for k, v in _flat(st).items()}}
+        return 200, {"acknowledged": True, "shards_acknowledged": True, "index": name}
+
+    def delete(self, expr):
+        for name in self.resolve(expr, must_exist=False):
+            self.indices.pop(name, None)
+            for names in self.aliases.values():
+                names.discard(name)
+        return 200, {"acknowledged": True}
+
+    def update_aliases(self, actions):
+        for a in actions:
+            (op, spec), = a.items()
+            if op == "add":
+                self.aliases.setdefault(spec["alias"], set()).add(spec["index"])
+            elif op == "remove":
+                self.aliases.get(spec["alias"], set()).discard(spec["index"])
+            elif op == "remove_index":
+                self.delete(spec["index"])
+        self.aliases = {k: v for k, v in self.aliases.items() if v}
+        return 200, {"acknowledged": True}
+
+    def get_alias(self, name):
+        out = {i: {"aliases": {name: {}}} for i in sorted(self.aliases.get(name, ()))}
+        if not out:
+            return 404, {"error": f"alias [{name}] missing", "status": 404}
+        return 200, out
+
+    def get(self, expr):
+        out = {}
+        for name in self.resolve(expr, must_exist="*" not in expr):
+            idx = self.indices[name]
+            out[name] = {"aliases": {a: {} for a, n in self.aliases.items() if name in n},
+                         "mappings": idx["mappings"], "settings": idx["settings"]}
+        return 200, out
+
+    # -------- documentos
+    def bulk(self, default_index, raw):
+        lines = [json.loads(l) for l in raw.splitlines() if l.strip()]
+        items, i = [], 0
+        while i < len(lines):
+            (op, meta), = lines[i].items()
+            index = meta.get("_index", default_index)
+            idx = self.indices.get(index)
+            _id = str(meta.get("_id") or uuid4().hex)
+            if op == "delete":
+                i += 1
+                found = idx is not None and idx["docs"].pop(_id, None) is not None
+                if found:
+                    for t in idx["tok"].pop(_id):
+                        idx["post"][t].discard(_id)
+                items.append({op: {"_index": index, "_id": _id, "status": 200 if found else 404,
+                                   "result": "deleted" if found else "not_found"}})
+                continue
+            src, i = lines[i + 1], i + 2
+            if idx is None:
+                items.append({op: {"_index": index, "_id": _id, "status": 404,
+                                   "error": {"type": "index_not_found_exception", "reason": index}}})
+                continue
+            if op == "update":
+                # sólo "doc" parcial; los scripts (ingest_stock) no se emulan
+                if "doc" in src and _id in idx["docs"]:
+                    self._put(idx, _id, {**idx["docs"][_id], **src["doc"]})
+                items.append({op: {"_index": index, "_id": _id, "status": 200, "result": "noop"
+                                   if "doc" not in src else "updated"}})
+                continue
+            created = _id not in idx["docs"]
+            self._put(idx, _id, src)
+            items.append({op: {"_index": index, "_id": _id, "status": 201 if created else 200,
+                               "result": "created" if created else "updated"}})
+        return 200, {"took": 0, "errors": any("error" in next(iter(it.values())) for it in items),
+                     "items": items}
+
+    def _put(self, idx, _id, src):
+        # palabras de los campos de texto + "campo=valor" de los keyword (multi_match exacto)
+        for t in idx["tok"].get(_id, ()):
+            idx["post"][t].discard(_id)
+        idx["docs"][_id] = src
+        idx["tok"][_id] = tok = ({t for f in TEXT_FIELDS for t in tokens(src.get(f))}
+                                 | {f"{f}={fold(v)}" for f, v in src.items() if isinstance(v, str)})
+        for t in tok:
+            idx["post"].setdefault(t, set()).add(_id)
+
+    # -------- búsqueda
+    def search(self, expr, body, params):
+        started = time.perf_counter()
+        query = body.get("query") or {"match_all": {}}
+        post = body.get("post_filter")
+        pred = _compile(query)
+        matched = [(n, _id, src, tok) for n, _id, src, tok in self.docs(expr, query) if pred(src, tok)]
+        aggs = {name: _agg(spec, [src for _, _, src, _ in matched]) for name, spec in (body.get("aggs") or {}).items()}
+        if post:
+            pred = _compile(post)
+            matched = [m for m in matched if pred(m[2], m[3])]
+
+        sort = _sort_spec(body.get("sort"))
+        key = lambda m: [m[2].get(f) if f != "_id" else m[1] for f, _ in sort]
+        for i in reversed(range(len(sort))):
+            matched.sort(key=lambda m: _sort_key(key(m)[i]), reverse=sort[i][1] == "desc")
+        total = len(matched)
+        if "search_after" in body:
+            matched = [m for m in matched if _after(key(m), body["search_after"], sort)]
+        start = int(body.get("from") or 0)
+        size = int(body.get("size", params.get("size", 10)))
+
+        out = {"took": 0, "timed_out": False,
+               "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}
+        if "scroll" in params:
+            # sólo se guardan las referencias; el hit se arma al devolverlo
+            sid = uuid4().hex
+            self.scrolls[sid] = ([(m, sort, body.get("_source")) for m in matched[size:]],
+                                 time.monotonic() + SCROLL_KEEP)
+            out["_scroll_id"] = sid
+            page = matched[:size]
+        else:
+            page = matched[start:start + size]
+        hits = [_hit(m, sort, body.get("_source")) for m in page]
+        track = body.get("track_total_hits", 10000)
+        if track is False:
+            out["hits"] = {"max_score": None, "hits": hits}
+        elif track is True or total <= int(track):
+            out["hits"] = {"total": {"value": total, "relation": "eq"}, "max_score": None, "hits": hits}
+        else:
+            out["hits"] = {"total": {"value": int(track), "relation": "gte"}, "max_score": None, "hits": hits}
+        if aggs:
+            out["aggregations"] = aggs
+        if body.get("suggest"):
+            out["suggest"] = {name: [self._complete(expr, spec, body.get("_source"))]
+                              for name, spec in body["suggest"].items()}
+        out["took"] = int((time.perf_counter() - started) * 1000)
+        return 200, out
+
+    def _complete(self, expr, spec, source):
+        p, size = fold(spec.get("prefix")), spec["completion"].get("size", 5)
+        opts = []
+        for n, _id, src, _ in self.docs(expr):
+            for text in (src.get("suggest") or {}).get("input") or []:
+                if fold(text).startswith(p):
+                    opts.append({"text": text, "_index": n, "_id": _id, "_score": 1.0,
+                                 "_source": _project(src, source)})
+                    break
+            if len(opts) >= size:
+                break
+        return {"text": spec.get("prefix"), "offset": 0, "length": len(spec.get("prefix") or ""), "options": opts}
+
+    def scroll(self, sid, size=1000):
+        rest, _ = self.scrolls.pop(sid, ([], 0))
+        page, rest = rest[:size], rest[size:]
+        now = time.monotonic()
+        self.scrolls = {k: v for k, v in self.scrolls.items() if v[1] > now}
+        if rest:
+            self.scrolls[sid] = (rest, now + SCROLL_KEEP)
+        return 200, {"_scroll_id": sid, "took": 0, "timed_out": False,
+                     "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                     "hits": {"total": {"value": len(page), "relation": "eq"},
+                              "hits": [_hit(*r) for r in page]}}
+
+    def count(self, expr, body):
+        query = (body or {}).get("query") or {"match_all": {}}
+        pred = _compile(query)
+        return 200, {"count": sum(1 for _, _, src, tok in self.docs(expr, query) if pred(src, tok)),
+                     "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}
+
+
+# -------- evaluación de queries
+def _field(src, field):
+    v = src
+    for part in field.split("."):
+        v = v.get(part) if isinstance(v, dict) else None
+    return v
+
+def _compile(q):
+    """Query -> predicado (src, tokens) -> bool. El texto de la query se
+    analiza una vez por búsqueda, no por documento."""
+    (kind, spec), = q.items()
+    if kind == "bool":
+        must = [_compile(c) for c in _as_list(spec.get("must")) + _as_list(spec.get("filter"))]
+        must_not = [_compile(c) for c in _as_list(spec.get("must_not"))]
+        should = [_compile(c) for c in _as_list(spec.get("should"))]
+        need = int(spec.get("minimum_should_match", 0 if must else 1))
+        return lambda src, tok: (all(m(src, tok) for m in must) and not any(m(src, tok) for m in must_not)
+                                 and (not should or sum(m(src, tok) for m in should) >= need))
+    if kind == "constant_score":
+        return _compile(spec["filter"])
+    if kind == "multi_match":
+        words = tokens(spec["query"])
+        # codigo/ruc son keyword: el texto completo tiene que coincidir
+        exact = {f"{f.split('^')[0]}={fold(spec['query'])}" for f in spec.get("fields", ())}
+        return lambda src, tok: bool(exact & tok) or bool(words) and all(w in tok for w in words)
+    if kind == "match":
+        (field, v), = spec.items()
+        v = fold(v["query"] if isinstance(v, dict) else v)
+        if field.endswith(".prefix"):
+            field = field[:-7]
+            return lambda src, tok: fold(_field(src, field)).startswith(v)
+        words = tokens(v)
+        return lambda src, tok: bool(words) and all(w in tokens(_field(src, field)) for w in words)
+    if kind in ("term", "prefix"):
+        (field, v), = spec.items()
+        v = str(v["value"] if isinstance(v, dict) else v)
+        if kind == "prefix":
+            return lambda src, tok: str(_field(src, field) or "").startswith(v)
+        return lambda src, tok: str(_field(src, field)) == v
+    if kind == "terms":
+        (field, vs), = spec.items()
+        vs = {str(v) for v in vs}
+        return lambda src, tok: str(_field(src, field)) in vs
+    if kind == "range":
+        (field, r), = spec.items()
+        ops = {"gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+               "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b}
+        checks = [(ops[op], _num(b)) for op, b in r.items() if op in ops]
+        def check(src, tok):
+            v = _field(src, field)
+            return v is not None and all(op(_num(v), b) for op, b in checks)
+        return check
+    if kind == "nested":
+        path, inner = spec["path"], _compile(spec["query"])
+        return lambda src, tok: any(inner(_nest(path, sub), set()) for sub in src.get(path) or [])
+    return lambda src, tok: True   # match_all y lo que no se emula no filtra
+
+def _candidates(q, post):
+    """ids que pueden cumplir q según el índice invertido (None = todos).
+    Es un superconjunto: después se evalúa la query completa."""
+    (kind, spec), = q.items()
+    if kind == "bool":
+        for c in _as_list(spec.get("must")) + _as_list(spec.get("filter")):
+            ids = _candidates(c, post)
+            if ids is not None:
+                return ids
+        should = [_candidates(c, post) for c in _as_list(spec.get("should"))]
+        if should and all(ids is not None for ids in should):
+            return set().union(*should)
+    elif kind == "constant_score":
+        return _candidates(spec["filter"], post)
+    elif kind == "multi_match":
+        words = tokens(spec["query"])
+        ids = set.intersection(*(post.get(w, set()) for w in words)) if words else set()
+        for f in spec.get("fields", ()):
+            ids = ids | post.get(f"{f.split('^')[0]}={fold(spec['query'])}", set())
+        return ids
+    elif kind == "match":
+        (field, v), = spec.items()
+        if field.endswith(".prefix") and "." not in field[:-7]:
+            key = f"{field[:-7]}={fold(v['query'] if isinstance(v, dict) else v)}"
+            return set().union(*(ids for k, ids in post.items() if k.startswith(key)))
+    elif kind in ("term", "terms"):
+        (field, vs), = spec.items()
+        vs = vs if kind == "terms" else [vs["value"] if isinstance(vs, dict) else vs]
+        if all(isinstance(v, str) for v in vs) and "." not in field:
+            return set().union(*(post.get(f"{field}={fold(v)}", set()) for v in vs))
+    return None
+
+def _nest(path, sub):
+    return {path: sub}
+
+def _num(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return str(v)
+
+def _as_list(v):
+    return v if isinstance(v, list) else [v] if v else []
+
+def _agg(spec, docs, parents=None):
+    sub = spec.get("aggs") or {}
+    if "filter" in spec:
+        pred = _compile(spec["filter"])
+        keep = [i for i, d in enumerate(docs) if pred(d, set())]   # filtros de faceta: sin texto
+        docs, parents = [docs[i] for i in keep], [parents[i] for i in keep] if parents else None
+        return {"doc_count": len(docs), **{k: _agg(s, docs, parents) for k, s in sub.items()}}
+    if "nested" in spec:
+        path = spec["nested"]["path"]
+        rows, owners = [], []
+        for i, d in enumerate(docs):
+            for s in d.get(path) or []:
+                rows.append(_nest(path, s))
+                owners.append(i)
+        return {"doc_count": len(rows), **{k: _agg(s, rows, owners) for k, s in sub.items()}}
+    if "reverse_nested" in spec:
+        return {"doc_count": len(set(parents or ()))}
+    if "terms" in spec:
+        field, size = spec["terms"]["field"], spec["terms"].get("size", 10)
+        groups = {}
+        for i, d in enumerate(docs):
+            v = _field(d, field)
+            if v is not None:
+                groups.setdefault(v, []).append(i)
+        top = Counter({k: len(v) for k, v in groups.items()}).most_common(size)
+        return {"buckets": [{"key": k, "doc_count": n,
+                             **{name: _agg(s, [docs[i] for i in groups[k]],
+                                          [parents[i] for i in groups[k]] if parents else None)
+                                for name, s in sub.items()}} for k, n in top]}
+    return {}
+
+def _sort_spec(sort):
+    out = []
+    for s in sort or []:
+        if isinstance(s, str):
+            field, _, order = s.partition(":")
+            out.append((field, order or ("desc" if field == "_score" else "asc")))
+        else:
+            (field, o), = s.items()
+            out.append((field, o["order"] if isinstance(o, dict) else o))
+    return [(f, o) for f, o in out if f not in ("_score", "_doc")] or []
+
+def _sort_key(v):
+    # None al final en asc; números y textos no se mezclan en un mismo campo
+    return (v is None, v if isinstance(v, (int, float)) else str(v) if v is not None else "")
+
+def _after(values, after, sort):
+    for v, a, (_, order) in zip(values, after, sort):
+        kv, ka = _sort_key(v), _sort_key(a)
+        if kv != ka:
+            return kv > ka if order == "asc" else kv < ka
+    return False
+
+def _project(src, source):
+    if source is None or source is True:
+        return src
+    if source is False:
+        return {}
+    inc = source if isinstance(source, list) else source.get("includes", [])
+    return {k: v for k, v in src.items() if k in inc} if inc else src
+
+def _hit(m, sort, source):
+    index, _id, src, _ = m
+    h = {"_index": index, "_id": _id, "_score": None, "_source": _project(src, source)}
+    if sort:
+        h["sort"] = [src.get(f) if f != "_id" else _id for f, _ in sort]
+    return h
+
+def _flat(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(_flat(v, f"{prefix}{k}."))
+        else:
+            out[f"{prefix}{k}"] = v if v is None else str(v).lower() if isinstance(v, bool) else str(v)
+    return out
+
+def _error(type_, reason, status):
+    return {"error": {"type": type_, "reason": reason, "root_cause": [{"type": type_, "reason": reason}]},
+            "status": status}
+
+
+# -------- HTTP
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+    latency = 0.0
+
+    def log_message(self, *a):
+        pass
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        n = int(self.headers.get("content-length") or 0)
+        raw = self.rfile.read(n) if n else b""
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split("/") if p]
+        try:
+            status, out = self.route(method, parts, params, raw)
+        except NotFound as e:
+            status, out = 404, _error("index_not_found_exception", f"no such index [{e}]", 404)
+        self._send(status, out, method == "HEAD")
+
+    def route(self, method, parts, params, raw):
+        s = self.store
+        body = lambda: json.loads(raw) if raw.strip() else {}
+        if parts and parts[-1] in ("_search", "_msearch", "_count") and self.latency:
+            time.sleep(self.latency)
+        with s.lock:
+            if not parts:
+                return 200, {"name": "standin", "cluster_name": "bench", "version": {"number": "9.1.2"},
+                             "tagline": "You Know, for Search"}
+            if parts[0] == "_alias":
+                return s.get_alias(unquote(parts[1]))
+            if parts[0] == "_aliases":
+                return s.update_aliases(body()["actions"])
+            if parts[0] == "_bulk":
+                return s.bulk(None, raw)
+            if parts[:2] == ["_search", "scroll"]:
+                if method == "DELETE":
+                    for sid in _as_list(body().get("scroll_id")):
+                        s.scrolls.pop(sid, None)
+                    return 200, {"succeeded": True, "num_freed": 1}
+                return s.scroll(body()["scroll_id"])
+            if parts[-1] == "_msearch":
+                lines = [json.loads(l) for l in raw.splitlines() if l.strip()]
+                default = parts[0] if len(parts) == 2 else None
+                responses = []
+                for h, b in zip(lines[::2], lines[1::2]):
+                    try:
+                        responses.append({**s.search(h.get("index", default), b, {})[1], "status": 200})
+                    except NotFound as e:
+                        responses.append(_error("index_not_found_exception", f"no such index [{e}]", 404))
+                return 200, {"took": 0, "responses": responses}
+            if parts[-1] == "_search":
+                return s.search(parts[0] if len(parts) == 2 else "*", body(), params)
+            if parts[-1] == "_count":
+                return s.count(parts[0], body())
+            index = unquote(parts[0])
+            if len(parts) == 1:
+                if method == "PUT":
+                    return s.create(index, body())
+                if method == "DELETE":
+                    return s.delete(index)
+                if method == "HEAD":
+                    return (200 if s.resolve(index, must_exist=False) else 404), {}
+                return s.get(index)
+            if parts[1] == "_bulk":
+                return s.bulk(index, raw)
+            if parts[1] == "_refresh":
+                return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+            if parts[1] == "_settings":
+                names = s.resolve(index)
+                if method == "PUT":
+                    for name in names:
+                        for k, v in _flat(body()).items():
+                            k = k if k.startswith("index.") else f"index.{k}"
+                            if v is None:   # null = volver al valor por defecto
+                                s.indices[name]["settings"].pop(k, None)
+                            else:
+                                s.indices[name]["settings"][k] = v
+                    return 200, {"acknowledged": True}
+                want = unquote(parts[2]).split(",") if len(parts) > 2 else None
+                return 200, {name: {"settings": {k: v for k, v in s.indices[name]["settings"].items()
+                                                 if want is None or k in want}} for name in names}
+        return 400, _error("illegal_argument_exception", f"no emulado: {method} /{'/'.join(parts)}", 400)
+
+    def _send(self, status, obj, head=False):
+        b = json.dumps(obj, separators=(",", ":"), default=str).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("x-elastic-product", "Elasticsearch")
+        self.send_header("content-length", str(len(b)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(b)
+
+
+def serve(port, latency_ms=0.0):
+    handler = type("StandinHandler", (Handler,), {"store": Store(), "latency": latency_ms / 1000})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--port", type=int, default=9299)
+    p.add_argument("--latency-ms", type=float, default=0.0, help="espera agregada a cada búsqueda")
+    a = p.parse_args()
+    serve(a.port, a.latency_ms).serve_forever()
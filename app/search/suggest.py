@@ -0,0 +1,161 @@
+import os, json, gzip, heapq, threading, time, unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
+from django.conf import settings
+from elasticsearch.helpers import scan
+
+# alias -> campos: id del doc, textos que se completan (mismos inputs que el
+# campo completion "suggest"), _source que se devuelve y peso para ordenar
+SUGGEST_FIELDS = {
+    "items": {"id": "codigo", "inputs": ("codigo", "descripcion"),
+              "source": ("codigo", "descripcion"), "weight": "venta_usd_6m"},
+    "clients": {"id": "cliente_id", "inputs": ("ruc", "razon_social"),
+                "source": ("cliente_id", "ruc", "razon_social"), "weight": "venta_usd_6m"},
+}
+
+# prefijos hasta este largo llevan su top-k precalculado, y los más largos
+# también si abarcan más de SCAN_MAX claves: una consulta nunca ordena más de
+# SCAN_MAX entradas
+TOP_PREFIX_LEN = 3
+SCAN_MAX = 256
+TOP_K = 10
+# cada cuánto un worker mira si reindex dejó un archivo nuevo
+RELOAD_CHECK_SECONDS = 2
+
+
+def fold(s):
+    """minúsculas y sin tildes, como el analizador de ES"""
+    s = unicodedata.normalize("NFKD", str(s or "").strip().lower())
+    return "".join(c for c in s if not unicodedata.combining(c))
+
+def suggest_path(alias):
+    return os.path.join(settings.SUGGEST_DIR, f"{alias}.json.gz")
+
+
+# -------- construcción (al final de reindex)
+def build_suggest(es, alias, index=None):
+    """Lee la generación publicada (sólo los campos necesarios) y deja un
+    archivo con arrays ordenados de prefijos. Se escribe a un temporal y se
+    renombra: los workers nunca leen un archivo a medias."""
+    f = SUGGEST_FIELDS[alias]
+    index = index or alias
+    docs, entries = [], []
+    n_inputs = len(f["inputs"])
+    for h in scan(es, index=index, size=5000, _source=list({*f["source"], *f["inputs"], f["weight"]})):
+        src = h["_source"]
+        d = len(docs)
+        docs.append([h["_id"], float(src.get(f["weight"]) or 0), {k: src.get(k) for k in f["source"]}])
+        for pos, field in enumerate(f["inputs"]):
+            key = fold(src.get(field))
+            if key:
+                entries.append((key, d * n_inputs + pos))
+    entries.sort()
+    keys = [k for k, _ in entries]
+    refs = [r for _, r in entries]
+
+    weight = lambda ref: docs[ref // n_inputs][1]
+    top = {}
+    groups, plen = [(0, len(keys))], 1   # rangos de claves que comparten el prefijo anterior
+    while groups:
+        deeper = []
+        for lo, hi in groups:
+            i = lo
+            while i < hi:
+                p = keys[i][:plen]
+                if len(p) < plen:
+                    i += 1
+                    continue
+                j = bisect_left(keys, p + "\uffff", i, hi)
+                if plen <= TOP_PREFIX_LEN or j - i > SCAN_MAX:
+                    top[p] = _best(refs[i:j], weight, n_inputs, TOP_K)
+                if plen < TOP_PREFIX_LEN or j - i > SCAN_MAX:
+                    deeper.append((i, j))
+                i = j
+        groups, plen = deeper, plen + 1
+
+    data = {"alias": alias, "index": index, "built_at": time.time(), "n_inputs": n_inputs,
+            "docs": docs, "keys": keys, "refs": refs, "top": top}
+    path = suggest_path(alias)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as fh:
+        json.dump(data, fh, separators=(",", ":"))
+    os.replace(tmp, path)
+    return len(docs)
+
+def _best(refs, weight, n_inputs, k):
+    # top-k por peso, un solo resultado por documento
+    seen, out = set(), []
+    for ref in heapq.nlargest(k * n_inputs, refs, key=weight):
+        if ref // n_inputs not in seen:
+            seen.add(ref // n_inputs)
+            out.append(ref)
+            if len(out) == k:
+                break
+    return out
+
+
+# -------- consulta (en cada worker)
+class SuggestIndex:
+    def __init__(self, data):
+        self.index = data["index"]
+        self.n_inputs = data["n_inputs"]
+        self.docs, self.keys, self.refs, self.top = data["docs"], data["keys"], data["refs"], data["top"]
+        self.fields = SUGGEST_FIELDS[data["alias"]]
+
+    def suggest(self, q, size=TOP_K):
+        p = fold(q)
+        if not p:
+            return []
+        if p in self.top and size <= TOP_K:
+            refs = self.top[p][:size]
+        else:
+            # prefijo sin top-k: abarca a lo más SCAN_MAX claves (o ninguna)
+            i = bisect_left(self.keys, p)
+            j = bisect_left(self.keys, p + "\uffff", i)
+            refs = _best(self.refs[i:j], lambda ref: self.docs[ref // self.n_inputs][1], self.n_inputs, size)
+        out = []
+        for ref in refs:
+            _id, w, src = self.docs[ref // self.n_inputs]
+            out.append({"text": src.get(self.fields["inputs"][ref % self.n_inputs]),
+                        "_index": self.index, "_id": _id, "_score": w, "_source": src})
+        return out
+
+
+_loaded = {}      # alias -> (mtime, SuggestIndex)
+_checked = {}     # alias -> último os.stat
+_loading = {}     # alias -> mtime que se está cargando
+_lock = threading.Lock()
+_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="suggest-load")
+
+def get_suggest_index(alias):
+    """SuggestIndex del alias. Cuando reindex publica un archivo nuevo se
+    carga en un thread aparte (descomprimir y parsear todo el catálogo no
+    puede correr en el event loop) y se reemplaza de una vez al terminar;
+    mientras tanto se sigue respondiendo con el anterior. None si todavía no
+    hay ninguno cargado (el llamador cae a ES)."""
+    now = time.monotonic()
+    cur = _loaded.get(alias)
+    if now - _checked.get(alias, 0) < RELOAD_CHECK_SECONDS:
+        return cur[1] if cur else None
+    _checked[alias] = now
+    try:
+        mtime = os.stat(suggest_path(alias)).st_mtime
+    except FileNotFoundError:
+        return cur[1] if cur else None
+    with _lock:
+        if (not cur or cur[0] != mtime) and _loading.get(alias) != mtime:
+            _loading[alias] = mtime
+            _loader.submit(_load, alias, mtime)
+    return cur[1] if cur else None
+
+def _load(alias, mtime):
+    try:
+        with gzip.open(suggest_path(alias), "rt", encoding="utf-8") as fh:
+            _loaded[alias] = (mtime, SuggestIndex(json.load(fh)))
+    except (OSError, ValueError):
+        _checked.pop(alias, None)   # archivo reemplazado o roto a mitad de lectura: se reintenta
+    finally:
+        with _lock:
+            if _loading.get(alias) == mtime:
+                del _loading[alias]
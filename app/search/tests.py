@@ -1,3 +1,909 @@
-from django.test import TestCase
+import asyncio, fnmatch, gzip, hashlib, json, tempfile, threading
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.http import JsonResponse
+from django.test.client import RequestFactory
+from elasticsearch import ApiError, ConnectionError, NotFoundError
+from elastic_transport import ApiResponseMeta, HttpHeaders
+from search import es as es_module, suggest
+from search.api import (_clients_body, _decode_cursor, _encode_cursor, _facets, _items_body,
+                        _items_plan, _normalized, _totals, items_detail)
+from search.bulk import BulkIndexer
+from search.cache import _set_generation, cached_search
+from search.es import CircuitBreaker, CircuitOpen, fail_fast
+from search.management.commands import ingest_stock, reindex, rollup_sales
+from search.models import (ClientMonthlySales, DocFingerprint, ItemMonthlySales, ReindexCheckpoint,
+                           SyncState)
 
-# Create your tests here.
+
+def _meta(status):
+    return ApiResponseMeta(status=status, http_version="1.1", headers=HttpHeaders(), duration=0, node=None)
+
+
+class FakeIndices:
+    """Lo que reindex usa de es().indices, en memoria: índices, alias y conteos."""
+
+    def __init__(self):
+        self.names, self.aliases, self.counts, self.settings = set(), {}, {}, {}
+
+    def create(self, index, body=None):
+        self.names.add(index)
+
+    def exists(self, index):
+        return index in self.names
+
+    def get(self, index, expand_wildcards=None):
+        return {n: {} for n in self.names if fnmatch.fnmatch(n, index)}
+
+    def get_alias(self, name):
+        if name not in self.aliases:
+            raise NotFoundError("alias", _meta(404), {})
+        return {self.aliases[name]: {"aliases": {name: {}}}}
+
+    def update_aliases(self, actions):
+        for a in actions:
+            (op, arg), = a.items()
+            if op == "remove":
+                self.aliases.pop(arg["alias"], None)
+            elif op == "remove_index":
+                self.names.discard(arg["index"])
+            else:
+                self.aliases[arg["alias"]] = arg["index"]
+
+    def delete(self, index, ignore_unavailable=False):
+        self.names.discard(index)
+
+    def refresh(self, index):
+        pass
+
+    def get_settings(self, index, **kw):
+        return {index: {"settings": self.settings.get(index, {})}}
+
+    def put_settings(self, index, settings):
+        self.settings[index] = settings
+
+
+class FakeES:
+    def __init__(self):
+        self.indices = FakeIndices()
+
+    def count(self, index):
+        return {"count": self.indices.counts.get(index, 0)}
+
+
+class ReindexTestCase(TestCase):
+    def setUp(self):
+        self.es = FakeES()
+        patcher = mock.patch.object(reindex, "es", lambda: self.es)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def gens(self, alias, *names):
+        for n in names:
+            self.es.indices.create(f"{alias}_v{n}")
+
+
+class NormalizedKeyTests(SimpleTestCase):
+    def key(self, qs, *a, **kw):
+        return _normalized(RequestFactory().get("/?" + qs), *a, **kw)
+
+    def test_defaults_por_endpoint(self):
+        # items/clients: size 20 es el default; search_all: 5
+        self.assertEqual(self.key("q=x&size=20"), {"q": "x"})
+        self.assertEqual(self.key("q=x&size=5"), {"q": "x", "size": 5})
+        self.assertEqual(self.key("q=x&size=5", size=5), {"q": "x"})
+        self.assertEqual(self.key("q=x&size=20", size=5), {"q": "x", "size": 20})
+
+    def test_size_invalido_como_la_vista(self):
+        # la vista usa size=1 con un valor no numérico: la llave también
+        self.assertEqual(self.key("q=x&size=abc"), {"q": "x", "size": 1})
+        self.assertEqual(self.key("q=x&size=500"), {"q": "x", "size": 100})
+
+    def test_listas_page_sort(self):
+        a = self.key("marca=B,A&page=1&sort=Relevance&q=+x+", ("marca",))
+        b = self.key("q=x&marca=A&marca=B", ("marca",))
+        self.assertEqual(a, b)
+        self.assertEqual(self.key("q=x&page=0&sort=STOCK"), {"q": "x", "sort": "stock"})
+
+    def test_llave_y_consulta_leen_lo_mismo(self):
+        # mismo valor para la llave y para la consulta: si no, dos requests
+        # distintos compartirían respuesta
+        a, b = "division=%20X%20&sort=STOCK%20&tipo=%20A&stock_min=05", "division=X&sort=stock&tipo=A&stock_min=5"
+        self.assertEqual(self.key(a), self.key(b))
+        rf = RequestFactory()
+        self.assertEqual(_items_body(rf.get("/?" + a)), _items_body(rf.get("/?" + b)))
+        self.assertEqual(_clients_body(rf.get("/?" + a)), _clients_body(rf.get("/?" + b)))
+        self.assertEqual(self.key("marca=A,%20B,", ("marca",)), self.key("marca=B&marca=A&marca=", ("marca",)))
+
+    def test_cursor_vacio_cuenta(self):
+        self.assertEqual(self.key("q=x&cursor="), {"q": "x", "cursor": ""})
+
+
+def _hits(n=0):
+    return {"took": 1, "hits": {"total": {"value": n, "relation": "eq"}, "hits": []}}
+
+
+class FakeAsyncES:
+    def __init__(self):
+        self.sizes = []
+
+    async def msearch(self, searches):
+        self.sizes.append(searches[1]["size"])
+        return {"responses": [_hits(), _hits()]}
+
+
+class SearchAllCacheTests(TestCase):
+    def setUp(self):
+        caches["search"].clear()
+        _set_generation("items,clients", "items_v1,clients_v1")
+        self.es = FakeAsyncES()
+        patcher = mock.patch("search.api.get_async_es", lambda profile="search": self.es)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_size_no_comparte_entrada_con_el_default(self):
+        r1 = await self.async_client.get("/api/search", {"q": "x"})
+        r2 = await self.async_client.get("/api/search", {"q": "x", "size": 20})
+        r3 = await self.async_client.get("/api/search", {"q": "x", "size": 5})
+        self.assertEqual((r1["X-Cache"], r2["X-Cache"], r3["X-Cache"]), ("MISS", "MISS", "HIT"))
+        self.assertEqual(json.loads(r2.content)["size"], 20)
+        self.assertEqual(self.es.sizes, [5, 20])
+
+
+class GenerationTests(ReindexTestCase):
+    def test_swap_mueve_el_alias(self):
+        self.gens("items", "1", "2")
+        reindex.swap_alias("items", "items_v1")
+        self.assertEqual(reindex.live_generation("items"), "items_v1")
+        reindex.swap_alias("items", "items_v2")
+        self.assertEqual(self.es.indices.aliases, {"items": "items_v2"})
+
+    def test_swap_reemplaza_indice_concreto(self):
+        # esquema anterior: "items" era un índice, no un alias
+        self.es.indices.create("items")
+        self.gens("items", "1")
+        reindex.swap_alias("items", "items_v1")
+        self.assertNotIn("items", self.es.indices.names)
+        self.assertEqual(reindex.live_generation("items"), "items_v1")
+
+    def test_prune_conserva_las_mas_recientes(self):
+        self.gens("items", "1", "2", "3", "4", "5")
+        reindex.swap_alias("items", "items_v4")
+        self.assertEqual(reindex.prune_generations("items", 2), ["items_v2", "items_v3"])
+        # la publicada y las más nuevas (en construcción) no se tocan
+        self.assertEqual(sorted(self.es.indices.names), ["items_v2", "items_v3", "items_v4", "items_v5"])
+
+    def test_rollback(self):
+        self.gens("items", "1", "2")
+        reindex.swap_alias("items", "items_v2")
+        reindex.Command(stdout=mock.Mock()).rollback("items")
+        self.assertEqual(reindex.live_generation("items"), "items_v1")
+        with self.assertRaises(CommandError):
+            reindex.Command(stdout=mock.Mock()).rollback("items")
+
+    def test_conteo_con_tolerancia(self):
+        self.es.indices.counts["items_v1"] = 1000
+        with mock.patch.object(reindex, "view_count", return_value=1010):
+            # la vista creció durante la extracción: el conteo de ES cae en el rango
+            self.assertEqual(reindex.verify_count("items_v1", "vw_items_search", 990), 1000)
+            with mock.patch.object(reindex, "COUNT_TOLERANCE", 0):
+                self.assertRaises(CommandError, reindex.verify_count, "items_v1", "vw_items_search", 1001)
+            self.assertEqual(reindex.verify_count("items_v1", "vw_items_search", 1001), 1000)   # 1 por mil
+
+    def test_no_publica_ninguno_si_uno_no_cuadra(self):
+        self.gens("items", "1")
+        self.gens("clients", "1")
+        reindex.swap_alias("items", "items_v1")
+        reindex.swap_alias("clients", "clients_v1")
+
+        def load_all(cmd, gens, plan, o):
+            for alias, gen in gens.items():
+                self.es.indices.counts[gen] = 100 if alias == "items" else 50
+            return {a: {"label": a, "docs": 1, "failed": 0, "retried": 0, "elapsed": 1.0, "errors": []}
+                    for a in gens}
+        views = {"vw_items_search": 100, "vw_clients_search": 80}
+        with mock.patch.object(reindex, "view_count", lambda v: views[v]), \
+                mock.patch.object(reindex, "keyset_ranges", lambda alias, n: [(None, None)]), \
+                mock.patch.object(reindex.Command, "load_all", load_all), \
+                mock.patch.object(reindex.Command, "refresh_suggest"):
+            with self.assertRaisesMessage(CommandError, "clients"):
+                reindex.Command(stdout=mock.Mock(), stderr=mock.Mock()).rebuild(
+                    ["items", "clients"], {"resume": False, "workers": 1, "keep": 2})
+        self.assertEqual(self.es.indices.aliases, {"items": "items_v1", "clients": "clients_v1"})
+
+
+class CursorTests(SimpleTestCase):
+    def test_ida_y_vuelta(self):
+        c = {"sa": [12.5, "A-100"], "plan": "text", "pit": "abc=="}
+        token = _encode_cursor(c)
+        self.assertNotIn("=", token)
+        self.assertEqual(_decode_cursor(token), c)
+
+    def test_invalidos(self):
+        self.assertEqual(_decode_cursor(""), {})
+        for bad in ("no-es-base64!", _encode_cursor(["x"]), _encode_cursor({"sa": "x"}), _encode_cursor({})):
+            self.assertIsNone(_decode_cursor(bad), bad)
+
+
+class FakePageES:
+    """search() que devuelve `size` hits con sort values; `exc` la hace fallar."""
+
+    def __init__(self):
+        self.calls, self.exc = [], None
+
+    async def search(self, **kw):
+        self.calls.append(kw)
+        if self.exc:
+            raise self.exc
+        hits = [{"_source": {"codigo": f"A{i}"}, "sort": [1.0, f"A{i}"]} for i in range(kw["size"])]
+        return {"took": 1, "hits": {"total": {"value": 100, "relation": "eq"}, "hits": hits}}
+
+    async def open_point_in_time(self, index, keep_alive):
+        return {"id": "pit-1"}
+
+    async def close_point_in_time(self, id):
+        pass
+
+
+class CursorViewTests(TestCase):
+    def setUp(self):
+        caches["search"].clear()
+        _set_generation("items", "items_v1")
+        self.es = FakePageES()
+        patcher = mock.patch("search.api.get_async_es", lambda profile="search": self.es)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def get(self, **params):
+        r = await self.async_client.get("/api/search/items", {"size": 2, **params})
+        return r.status_code, json.loads(r.content)
+
+    async def test_cursor_invalido_400(self):
+        self.assertEqual(await self.get(q="filtro", cursor="basura"), (400, {"error": "cursor inválido"}))
+
+    async def test_cursor_atado_a_la_busqueda(self):
+        _, first = await self.get(q="filtro", cursor="")
+        status, _ = await self.get(q="filtro", cursor=first["next"])
+        self.assertEqual(status, 200)
+        self.assertEqual(self.es.calls[-1]["search_after"], [1.0, "A1"])
+        calls = len(self.es.calls)
+        for other in ({"q": "otra"}, {"q": "filtro", "sort": "stock"}, {"q": "filtro", "marca": "X"}):
+            status, _ = await self.get(cursor=first["next"], **other)
+            self.assertEqual(status, 400, other)
+        self.assertEqual(len(self.es.calls), calls)   # ni llegó a ES
+
+    async def test_largo_de_sort_values(self):
+        _, first = await self.get(q="filtro", cursor="")
+        c = _decode_cursor(first["next"])
+        status, _ = await self.get(q="filtro", cursor=_encode_cursor({**c, "sa": [1.0]}))
+        self.assertEqual(status, 400)
+
+    async def test_errores_de_es_con_cursor(self):
+        _, first = await self.get(q="filtro", cursor="", pit="1")
+        self.assertEqual(_decode_cursor(first["next"])["pit"], "pit-1")
+        self.es.exc = ApiError("search_context_missing_exception", _meta(404), {})
+        status, _ = await self.get(q="filtro", cursor=first["next"])
+        self.assertEqual(status, 410)
+        self.es.exc = ApiError("parse_exception", _meta(400), {})
+        status, _ = await self.get(q="filtro", cursor=first["next"])
+        self.assertEqual(status, 400)
+
+
+class FakeBulkES:
+    """bulk() que responde por _id: `status` fija el estado de cada intento
+    (lista que se consume) y `gates` retiene el lote que contiene ese _id."""
+
+    def __init__(self, status=None, gates=None):
+        self.status, self.gates, self.calls = status or {}, gates or {}, []
+
+    def bulk(self, index, operations, refresh):
+        ids = [json.loads(a)["index"]["_id"] for a in operations.split(b"\n")[:-1:2]]
+        self.calls.append(ids)
+        for _id in ids:
+            if _id in self.gates:
+                self.gates[_id].wait(5)
+        items = []
+        for _id in ids:
+            st = self.status.get(_id)
+            code = st.pop(0) if isinstance(st, list) else (st or 201)
+            r = {"_id": _id, "status": code}
+            if code >= 400 and code not in (429, 503):
+                r["error"] = {"type": "mapper_parsing_exception"}
+            items.append({"index": r})
+        return {"items": items}
+
+
+def _op_size():
+    return len(b'{"index":{"_id":"A"}}\n{}\n')
+
+
+class BulkIndexerTests(SimpleTestCase):
+    def test_committed_espera_a_los_lotes_anteriores(self):
+        gate = threading.Event()
+        es = FakeBulkES(gates={"A": gate})
+        bi = BulkIndexer(es, "t", workers=2, max_bytes=_op_size(), backoff=0)   # un doc por lote
+        bi.index("A", b"{}")
+        bi.index("B", b"{}")
+        for _ in range(100):   # B termina primero
+            if len(es.calls) == 2 and bi.docs == 1:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(bi.docs, 1)
+        self.assertIsNone(bi.committed)
+        gate.set()
+        bi.close()
+        self.assertEqual(bi.committed, "B")
+        self.assertEqual(bi.docs, 2)
+
+    def test_reintentos_y_fallas(self):
+        es = FakeBulkES(status={"A": [429, 201], "B": 400, "C": [429, 429, 429]})
+        bi = BulkIndexer(es, "t", workers=1, max_retries=2, backoff=0)
+        for _id in "ABCD":
+            bi.index(_id, b"{}")
+        bi.close()
+        self.assertEqual((bi.docs, bi.failed), (2, 2))
+        self.assertEqual(bi.retried, 3)   # A una vez, C dos
+        self.assertEqual(bi.failed_types, {"B": "mapper_parsing_exception", "C": "rejected"})
+        self.assertEqual(sorted(bi.failed_ids), ["B", "C"])
+        self.assertEqual(bi.committed, "D")
+
+
+class FingerprintTests(ReindexTestCase):
+    def fps(self, index="items_v1"):
+        return dict(DocFingerprint.objects.filter(index_name=index).values_list("doc_id", "fp"))
+
+    def test_save_committed(self):
+        unsaved = [("A", "1"), ("B", "2"), ("C", "3"), ("D", "4")]
+        rest = reindex.save_committed("items_v1", unsaved, "C", ["B"])
+        self.assertEqual(rest, [("D", "4")])
+        self.assertEqual(self.fps(), {"A": "1", "C": "3"})
+        self.assertEqual(reindex.save_committed("items_v1", rest, "X", []), rest)   # clave ajena: nada
+        self.assertEqual(reindex.save_committed("items_v1", rest, None, []), [])
+        self.assertEqual(self.fps(), {"A": "1", "C": "3", "D": "4"})
+
+    def test_lote_cortado_no_deja_huellas(self):
+        # el 3er bulk falla sin reintento: sólo quedan las huellas de los 2 primeros
+        calls = []
+
+        def bulk(index, operations, refresh):
+            calls.append(1)
+            if len(calls) == 3:
+                raise ApiError("bad request", _meta(400), {})
+            ids = [json.loads(a)["index"]["_id"] for a in operations.split(b"\n")[:-1:2]]
+            return {"items": [{"index": {"_id": i, "status": 201}} for i in ids]}
+        self.es.bulk = bulk
+        docs = [(f"K{i}", b"{}", None) for i in range(10)]
+        with mock.patch.object(reindex, "extract", lambda *a: iter(docs)):
+            with self.assertRaises(ApiError):
+                reindex.load("items", "items_v1", workers=1, max_bytes=2 * _op_size())
+        self.assertEqual(sorted(self.fps()), ["K0", "K1", "K2", "K3"])
+
+
+class CheckpointTests(ReindexTestCase):
+    def test_pending_ranges_sigue_desde_la_posicion(self):
+        reindex.plan_checkpoints("items", "items_v2", [(None, "M"), ("M", None)])
+        first, second = ReindexCheckpoint.objects.order_by("pk")
+        reindex.save_checkpoint(first.pk, "F")
+        self.assertEqual(reindex.pending_ranges("items_v2"), [
+            {"lo": "F", "hi": "M", "checkpoint": first.pk}, {"lo": "M", "hi": None, "checkpoint": second.pk}])
+        reindex.save_checkpoint(second.pk, "Z", done=True)
+        self.assertEqual([r["checkpoint"] for r in reindex.pending_ranges("items_v2")], [first.pk])
+        self.assertEqual(reindex.unfinished_generation("items"), "items_v2")
+
+    def test_nunca_borra_la_generacion_publicada(self):
+        self.gens("items", "1")
+        reindex.swap_alias("items", "items_v1")
+        self.assertRaises(CommandError, reindex.drop_generation, "items_v1")
+        self.assertIn("items_v1", self.es.indices.names)
+
+    def test_corrida_que_murio_tras_el_swap(self):
+        # quedaron checkpoints de la generación ya publicada: no se borra
+        self.gens("items", "1")
+        reindex.swap_alias("items", "items_v1")
+        reindex.plan_checkpoints("items", "items_v1", [(None, None)])
+        with mock.patch.object(reindex, "view_count", return_value=0), \
+                mock.patch.object(reindex, "keyset_ranges", lambda alias, n: [(None, None)]), \
+                mock.patch.object(reindex, "create_generation", lambda alias, m: self.es.indices.create("items_v2") or "items_v2"), \
+                mock.patch.object(reindex.Command, "load_all", side_effect=RuntimeError("corte")):
+            with self.assertRaises(RuntimeError):
+                reindex.Command(stdout=mock.Mock()).rebuild(["items"], {"resume": False, "workers": 1})
+        self.assertIn("items_v1", self.es.indices.names)
+        self.assertEqual(reindex.unfinished_generation("items"), "items_v2")
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("search.es.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.b = CircuitBreaker(failures=2, reset=30)
+
+    def open(self):
+        self.b.failure()
+        self.b.failure()
+
+    def test_abre_tras_n_fallas_seguidas(self):
+        self.b.failure()
+        self.b.success()
+        self.b.failure()
+        self.assertFalse(self.b.before())
+        self.b.failure()
+        self.assertTrue(self.b.is_open)
+        self.assertRaises(CircuitOpen, self.b.before)
+        self.assertEqual(self.b.retry_after(), 30)
+
+    def test_half_open_una_sola_prueba(self):
+        self.open()
+        self.now += 31
+        self.b.check()                   # no gasta la prueba
+        self.assertTrue(self.b.before())
+        self.assertRaises(CircuitOpen, self.b.before)
+        self.assertRaises(CircuitOpen, self.b.check)
+        self.b.success()
+        self.assertFalse(self.b.is_open)
+        self.assertFalse(self.b.before())
+
+    def test_prueba_fallida_reabre(self):
+        self.open()
+        self.now += 31
+        self.assertTrue(self.b.before())
+        self.b.failure()
+        self.assertRaises(CircuitOpen, self.b.before)
+        self.now += 31
+        self.assertTrue(self.b.before())
+
+    def test_prueba_sin_veredicto_se_libera(self):
+        # p.ej. CancelledError: la próxima request puede volver a probar
+        self.open()
+        self.now += 31
+        self.assertTrue(self.b.before())
+        self.b.release()
+        self.assertTrue(self.b.before())
+
+
+class AsyncClientLifecycleTests(SimpleTestCase):
+    def test_se_cierran_con_su_loop(self):
+        # runserver/tests: un loop por request; sin esto quedaban sesiones aiohttp abiertas
+        closed = []
+
+        class FakeAsyncClient:
+            def __init__(self, *a, **kw):
+                pass
+
+            def options(self, **kw):
+                return self
+
+            async def close(self):
+                closed.append(self)
+
+        async def view():
+            es_module.get_async_es()
+            es_module.get_async_es("export")
+            await asyncio.sleep(0)
+            return asyncio.get_running_loop()
+        with mock.patch.object(es_module, "AsyncElasticsearch", FakeAsyncClient):
+            loop = asyncio.run(view())
+        self.assertNotIn(loop, es_module._async_clients)
+        self.assertEqual(len(closed), 1)   # la base; los perfiles comparten su transporte
+
+
+class EsDownTests(TestCase):
+    """429/502/503/504 llegan como ApiError cuando se agotan los reintentos:
+    son ES saturado igual que un ConnectionError, no un 500."""
+
+    def setUp(self):
+        caches["search"].clear()
+        self.rf = RequestFactory()
+
+    def test_fail_fast_503(self):
+        for exc in (ApiError("saturado", _meta(429), {}), ConnectionError("caído")):
+            resp = fail_fast(mock.Mock(side_effect=exc))(self.rf.get("/"))
+            self.assertEqual(resp.status_code, 503)
+            self.assertIn("Retry-After", resp)
+        with self.assertRaises(ApiError):
+            fail_fast(mock.Mock(side_effect=ApiError("bad request", _meta(400), {})))(self.rf.get("/"))
+
+    @override_settings(SEARCH_CACHE_TTL=0)
+    def test_stale_con_es_saturado(self):
+        calls = []
+
+        def items(request):
+            calls.append(1)
+            if len(calls) > 1:
+                raise ApiError("timeout", _meta(504), {})
+            return JsonResponse({"total": 1})
+        es = SimpleNamespace(indices=SimpleNamespace(get_alias=lambda name: {"items_v1": {}}))
+        view = cached_search(es, "items", lambda r: {"q": "x"})(items)
+        self.assertEqual(view(self.rf.get("/")).status_code, 200)
+        resp = view(self.rf.get("/"))
+        self.assertEqual((resp.status_code, resp["X-Cache"]), (200, "STALE"))
+
+    @override_settings(SEARCH_CACHE_TTL=0)
+    def test_stale_async(self):
+        calls = []
+
+        async def items(request):
+            calls.append(1)
+            if len(calls) > 1:
+                raise ApiError("saturado", _meta(429), {})
+            return JsonResponse({"total": 1})
+        es = SimpleNamespace(indices=SimpleNamespace(get_alias=mock.AsyncMock(return_value={"items_v1": {}})))
+        view = cached_search(es, "items", lambda r: {"q": "x"})(items)
+        self.assertEqual(async_to_sync(view)(self.rf.get("/")).status_code, 200)
+        resp = async_to_sync(view)(self.rf.get("/"))
+        self.assertEqual((resp.status_code, resp["X-Cache"]), (200, "STALE"))
+
+
+class SuggestIndexTests(SimpleTestCase):
+    DOCS = [("A1", "FILTRO DE ACEITE", 10), ("A2", "FILTRO DE AIRE", 50), ("A3", "Fílter cup", 30),
+            ("A4", "BUJIA", 99), ("F9", "FILTRO ACEITE PRO", 5)]
+
+    def write(self):
+        hits = [{"_id": c, "_source": {"codigo": c, "descripcion": d, "venta_usd_6m": w}} for c, d, w in self.DOCS]
+        with mock.patch.object(suggest, "scan", lambda es, **kw: iter(hits)):
+            suggest.build_suggest(None, "items")
+
+    def build(self):
+        with override_settings(SUGGEST_DIR=tempfile.mkdtemp()):
+            self.write()
+            with gzip.open(suggest.suggest_path("items"), "rt", encoding="utf-8") as fh:
+                return suggest.SuggestIndex(json.load(fh))
+
+    def ids(self, idx, q, size=10):
+        return [o["_id"] for o in idx.suggest(q, size)]
+
+    def test_orden_por_peso_y_sin_tildes(self):
+        idx = self.build()
+        self.assertEqual(self.ids(idx, "fil"), ["A2", "A3", "A1", "F9"])
+        self.assertEqual(self.ids(idx, "FIL", 2), ["A2", "A3"])
+        self.assertEqual(self.ids(idx, "filter"), ["A3"])
+        self.assertEqual(self.ids(idx, "xyz"), [])
+        self.assertEqual(idx.suggest("bu")[0]["text"], "BUJIA")
+
+    def test_un_resultado_por_documento(self):
+        # F9 coincide por codigo y por descripcion
+        self.assertEqual(self.ids(self.build(), "f"), ["A2", "A3", "A1", "F9"])
+
+    def test_prefijos_largos_precalculados(self):
+        with mock.patch.object(suggest, "SCAN_MAX", 1):
+            idx = self.build()
+        self.assertIn("filtro de a", idx.top)
+        self.assertEqual(self.ids(idx, "filtro de a"), ["A2", "A1"])
+        self.assertEqual(self.ids(idx, "filtro a"), ["F9"])
+
+    def test_carga_en_segundo_plano(self):
+        self.addCleanup(lambda: (suggest._loaded.pop("items", None), suggest._checked.pop("items", None)))
+        with override_settings(SUGGEST_DIR=tempfile.mkdtemp()), mock.patch.object(suggest, "RELOAD_CHECK_SECONDS", 0):
+            self.write()
+            suggest._loaded.pop("items", None)
+            # la primera llamada no espera la carga: responde ES mientras tanto
+            self.assertIsNone(suggest.get_suggest_index("items"))
+            suggest._loader.submit(lambda: None).result()   # un solo thread: en orden
+            self.assertEqual(self.ids(suggest.get_suggest_index("items"), "bu"), ["A4"])
+
+
+class FakeStockES:
+    """Aplica el script de stock como lo haría painless (incluida la guarda
+    por id de fila). `docs` = {índice: {codigo: doc}}; `fail` = códigos que
+    responden con un error transitorio."""
+
+    def __init__(self, docs):
+        self.docs, self.fail = docs, set()
+
+    def bulk(self, index, operations, refresh):
+        lines = operations.split(b"\n")
+        items = []
+        for action, body in zip(lines[::2], lines[1::2]):
+            _id = json.loads(action)["update"]["_id"]
+            params = json.loads(body)["script"]["params"]
+            doc = self.docs.get(index, {}).get(_id)
+            if _id in self.fail:
+                r = {"status": 500, "error": {"type": "es_rejected_execution_exception"}}
+            elif doc is None:
+                r = {"status": 404, "error": {"type": "document_missing_exception"}}
+            else:
+                r = {"status": 200}
+                if params["changes"] is None:
+                    doc["stock_total"] += sum(params["deltas"].values())
+                else:
+                    rows = [c for c in params["changes"] if c[0] > doc.get("stock_seq", -1)]
+                    if rows:
+                        doc["stock_seq"] = max(c[0] for c in rows)
+                        doc["stock_total"] += sum(c[2] for c in rows)
+            items.append({"update": {"_id": _id, **r}})
+        return {"items": items}
+
+
+class IngestStockTests(ReindexTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stock = FakeStockES({"items": {"A": {"stock_total": 0}, "B": {"stock_total": 0}}})
+        patcher = mock.patch.object(ingest_stock, "get_es", lambda profile: self.stock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with connection.cursor() as cur:
+            cur.execute("CREATE TABLE mov_test (id integer PRIMARY KEY, codigo varchar(20), "
+                        "almacen varchar(20), delta integer)")
+        self.addCleanup(self.drop)
+
+    def drop(self):
+        with connection.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS mov_test")
+
+    def insert(self, *rows):
+        with connection.cursor() as cur:
+            cur.executemany("INSERT INTO mov_test VALUES (%s, %s, %s, %s)", rows)
+
+    def run_table(self):
+        ingest_stock.Command(stdout=mock.Mock(), stderr=mock.Mock()).handle(
+            table="mov_test", file=None, batch=100, follow=0, replay_from=None, pending_out=None)
+
+    def state(self):
+        return dict(SyncState.objects.filter(name__startswith="stock:mov_test").values_list("name", "value"))
+
+    def test_coalesce(self):
+        out = ingest_stock.coalesce([("A", "X", 2), ("A", "X", "-1"), ("A", "Y", 3), (7, "X", 1)])
+        self.assertEqual({k: dict(v) for k, v in out.items()}, {"A": {"X": 1, "Y": 3}, "7": {"X": 1}})
+
+    def test_reintento_no_suma_dos_veces(self):
+        self.insert((1, "A", "X", 5), (2, "B", "X", 3), (3, "Z", "X", 1))
+        self.stock.fail = {"B"}
+        with self.assertRaises(CommandError):
+            self.run_table()
+        self.assertEqual(self.state(), {"stock:mov_test": 0, "stock:mov_test:en_curso": 3})
+        # llegan filas nuevas antes del reintento: no entran en el lote pendiente
+        self.insert((4, "A", "X", 100))
+        self.stock.fail = set()
+        self.run_table()
+        docs = self.stock.docs["items"]
+        self.assertEqual(docs["A"], {"stock_total": 5, "stock_seq": 1})
+        self.assertEqual(docs["B"], {"stock_total": 3, "stock_seq": 2})
+        self.assertEqual(self.state(), {"stock:mov_test": 3, "stock:mov_test:en_curso": None})
+        self.run_table()
+        self.assertEqual(docs["A"], {"stock_total": 105, "stock_seq": 4})
+
+    def test_replay_salta_lo_que_el_doc_ya_refleja(self):
+        self.insert((1, "A", "X", 5), (2, "B", "X", 3), (3, "A", "Y", 2), (4, "B", "X", 1))
+        docs = self.stock.docs["items"]
+        docs["A"] = {"stock_total": 5, "stock_seq": 1}   # extraído después de la fila 1
+        docs["B"] = {"stock_total": 3, "stock_seq": 3}   # después de la 3
+        for _ in range(2):
+            self.assertEqual(ingest_stock.replay("mov_test", 0, "items", batch=2), (4, []))
+            self.assertEqual(docs, {"A": {"stock_total": 7, "stock_seq": 3},
+                                    "B": {"stock_total": 4, "stock_seq": 4}})
+
+    def test_replay_se_corta_en_la_falla(self):
+        self.insert((1, "A", "X", 5), (2, "B", "X", 3), (3, "B", "X", 1))
+        self.stock.fail = {"B"}
+        self.assertEqual(ingest_stock.replay("mov_test", 0, "items", batch=1), (1, ["B"]))
+        self.stock.fail = set()
+        self.assertEqual(ingest_stock.replay("mov_test", 1, "items", batch=1), (3, []))
+        self.assertEqual(self.stock.docs["items"]["B"], {"stock_total": 4, "stock_seq": 3})
+
+    def test_load_estampa_sin_cambiar_la_huella(self):
+        sent = []
+
+        def bulk(index, operations, refresh):
+            lines = operations.split(b"\n")
+            sent.extend(lines[1:-1:2])
+            return {"items": [{"index": {"_id": json.loads(a)["index"]["_id"], "status": 201}}
+                              for a in lines[:-1:2]]}
+        self.es.bulk = bulk
+        with mock.patch.object(reindex, "extract", lambda *a: iter([("A", b'{"codigo":"A"}', 7)])):
+            reindex.load("items", "items_v1", workers=1)
+        self.assertEqual(json.loads(sent[0]), {"codigo": "A", "stock_seq": 7})
+        fp = DocFingerprint.objects.get(index_name="items_v1", doc_id="A").fp
+        self.assertEqual(fp, hashlib.md5(b'{"codigo":"A"}').hexdigest())
+
+    @override_settings(STOCK_CHANGES_TABLE="mov_test")
+    def test_rebuild_reaplica_lo_que_entro_durante_la_carga(self):
+        self.gens("items", "1")
+        reindex.swap_alias("items", "items_v1")
+        self.insert((1, "A", "X", 5))
+
+        def load_all(cmd, gens, plan, o):
+            gen = gens["items"]
+            # A se extrae con la fila 1 reflejada; después entran la 2 (A) y
+            # la 3 (B), B se extrae con ambas e ingest_stock las manda a items_v1
+            self.stock.docs[gen] = {"A": {"stock_total": 5, "stock_seq": 1}}
+            self.insert((2, "A", "X", 3), (3, "B", "X", 4))
+            self.stock.docs[gen]["B"] = {"stock_total": 4, "stock_seq": 3}
+            self.run_table()
+            self.es.indices.counts[gen] = 2
+            return {"items": {"label": "items", "docs": 2, "failed": 0, "retried": 0, "elapsed": 1.0, "errors": []}}
+        with mock.patch.object(reindex, "view_count", return_value=2), \
+                mock.patch.object(reindex, "keyset_ranges", lambda alias, n: [(None, None)]), \
+                mock.patch.object(reindex.Command, "load_all", load_all), \
+                mock.patch.object(reindex.Command, "refresh_suggest"):
+            reindex.Command(stdout=mock.Mock(), stderr=mock.Mock()).rebuild(
+                ["items"], {"resume": False, "workers": 1, "keep": 2})
+        gen = reindex.live_generation("items")
+        self.assertNotEqual(gen, "items_v1")
+        self.assertEqual(self.stock.docs[gen], {"A": {"stock_total": 8, "stock_seq": 2},
+                                                "B": {"stock_total": 4, "stock_seq": 3}})
+        self.assertFalse(SyncState.objects.filter(name=f"stock_seq:{gen}").exists())
+
+
+class BrowseBodyTests(SimpleTestCase):
+    def body(self, qs, fn=_items_body):
+        return fn(RequestFactory().get("/?" + qs))
+
+    @override_settings(SEARCH_TRACK_TOTAL_HITS=10000)
+    def test_sin_texto_solo_filtros(self):
+        b = self.body("marca=A&stock_min=1")
+        self.assertIn("constant_score", b["query"])
+        self.assertEqual(b["sort"], [{"venta_usd_6m": "desc"}])
+        self.assertEqual(b["track_total_hits"], 10000)
+        self.assertNotIn("highlight", b)
+        self.assertEqual(self.body("", _clients_body)["track_total_hits"], 10000)
+
+    def test_con_texto_cuenta_normal(self):
+        b = self.body("q=filtro")
+        self.assertNotIn("track_total_hits", b)
+        self.assertNotIn("constant_score", b["query"])
+
+    @override_settings(SEARCH_TRACK_TOTAL_HITS=0)
+    def test_cero_es_total_exacto(self):
+        # sin la clave ES corta en 10.000
+        self.assertIs(self.body("")["track_total_hits"], True)
+        self.assertIs(self.body("", _clients_body)["track_total_hits"], True)
+
+    def test_total_cortado(self):
+        r = {"hits": {"total": {"value": 10000, "relation": "gte"}}}
+        self.assertEqual(_totals(r), {"total": 10000, "total_gte": True, "total_label": "10,000+"})
+        self.assertEqual(_totals({"hits": {"total": {"value": 7, "relation": "eq"}}}), {"total": 7})
+
+
+class FacetTests(SimpleTestCase):
+    def body(self, qs, facets=()):
+        return _items_body(RequestFactory().get("/?" + qs), facets)
+
+    def test_sin_facetas_filtra_en_la_query(self):
+        b = self.body("q=filtro&marca=A&division=D")
+        self.assertNotIn("post_filter", b)
+        self.assertNotIn("aggs", b)
+        self.assertIn({"term": {"categoria_division": "D"}}, b["query"]["bool"]["filter"])
+
+    def test_cada_faceta_cuenta_sin_su_filtro(self):
+        b = self.body("q=filtro&marca=A,B&division=D&stock_min=1", ["marca", "division", "nada"])
+        marca, division = {"terms": {"categoria_marca": ["A", "B"]}}, {"term": {"categoria_division": "D"}}
+        # lo que no es faceta sigue en la query; las facetas, en post_filter
+        self.assertEqual(b["query"]["bool"]["filter"], [{"range": {"stock_total": {"gte": 1}}}])
+        self.assertEqual(b["post_filter"], {"bool": {"filter": [division, marca]}})
+        self.assertEqual(list(b["aggs"]), ["marca", "division"])
+        self.assertEqual(b["aggs"]["marca"]["filter"], {"bool": {"filter": [division]}})
+        self.assertEqual(b["aggs"]["division"]["filter"], {"bool": {"filter": [marca]}})
+        self.assertEqual(b["aggs"]["marca"]["aggs"]["f"]["terms"]["field"], "categoria_marca")
+
+    def test_almacen_cuenta_articulos(self):
+        b = self.body("almacen=X", ["almacen"])
+        self.assertIn("stock_por_almacen", json.dumps(b["post_filter"]))
+        self.assertEqual(b["aggs"]["almacen"]["filter"], {"bool": {"filter": []}})
+        r = {"aggregations": {
+            "almacen": {"f": {"con_stock": {"v": {"buckets": [{"key": "X", "doc_count": 9, "items": {"doc_count": 4}}]}}}},
+            "marca": {"f": {"buckets": [{"key": "A", "doc_count": 3}]}}}}
+        self.assertEqual(_facets(r), {"almacen": [{"value": "X", "count": 4}], "marca": [{"value": "A", "count": 3}]})
+
+
+class ItemsPlanTests(TestCase):
+    def setUp(self):
+        caches["search"].clear()
+        _set_generation("items", "items_v1")
+        self.es = FakePageES()
+        patcher = mock.patch("search.api.get_async_es", lambda profile="search": self.es)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_forma_de_codigo(self):
+        for q in ("AB-1234", "12345", "filtro-2/x", "x.9"):
+            self.assertEqual(_items_plan(q), "code", q)
+        for q in ("", "filtro", "filtro 123", "A", "ab-cd", "x" * 31 + "1"):
+            self.assertEqual(_items_plan(q), "text", q)
+
+    def test_cuerpo_por_plan(self):
+        b = _items_body(RequestFactory().get("/?q=AB-1234"), plan="code")
+        self.assertNotIn("highlight", b)
+        self.assertEqual(b["query"]["bool"]["must"][0]["bool"]["should"][0], {"term": {"codigo": {"value": "AB-1234", "boost": 10}}})
+        self.assertIn("multi_match", _items_body(RequestFactory().get("/?q=AB-1234"))["query"]["bool"]["must"][0])
+
+    async def test_codigo_sin_resultados_cae_a_texto(self):
+        search = self.es.search
+
+        async def by_plan(**kw):
+            if "multi_match" not in json.dumps(kw["query"]):
+                return _hits(0)   # ningún código coincide
+            return await search(**kw)
+        self.es.search = by_plan
+        r = json.loads((await self.async_client.get("/api/search/items", {"q": "AB-1234", "size": 2, "cursor": ""})).content)
+        self.assertEqual((r["plan"], len(r["items"])), ("text", 2))
+        self.assertEqual(_decode_cursor(r["next"])["plan"], "text")
+        # la página siguiente sigue en texto sin volver a probar el código
+        self.es.calls.clear()
+        r = json.loads((await self.async_client.get("/api/search/items", {"q": "AB-1234", "size": 2, "cursor": r["next"]})).content)
+        self.assertEqual(r["plan"], "text")
+        self.assertEqual(len(self.es.calls), 1)
+        self.assertIn("multi_match", json.dumps(self.es.calls[0]["query"]))
+
+
+@skipUnless(connection.vendor == "postgresql", "SQL de Postgres (date_trunc, intervalos)")
+class RollupSalesTests(TestCase):
+    def setUp(self):
+        # DDL transaccional: se deshace con el test
+        with connection.cursor() as cur:
+            cur.execute("CREATE TABLE ventas (id integer PRIMARY KEY, fecha date, codigo varchar(50), "
+                        "cliente_id varchar(50), qty numeric, total_usd numeric)")
+
+    def insert(self, *rows):
+        with connection.cursor() as cur:
+            cur.executemany("INSERT INTO ventas VALUES (%s, %s, %s, %s, %s, %s)", rows)
+
+    def rollup(self, model, key):
+        return {(k, m.isoformat()): (int(q), int(v)) for k, m, q, v in model.objects.values_list(key, "mes", "qty", "venta")}
+
+    def run_cmd(self):
+        rollup_sales.Command(stdout=mock.Mock()).handle(id_column="id", months=0, full=False)
+
+    def test_rebuild_month(self):
+        self.insert((1, date(2026, 9, 3), "A", "C1", 2, 10), (2, date(2026, 9, 20), "A", "C2", 1, 5),
+                    (3, date(2026, 10, 1), "A", "C1", 4, 40), (4, date(2026, 9, 5), None, "C1", 1, 1))
+        self.assertEqual(rollup_sales.rebuild_month(date(2026, 9, 1)), {"items": 1, "clients": 2})
+        self.assertEqual(self.rollup(ItemMonthlySales, "codigo"), {("A", "2026-09-01"): (3, 15)})
+        self.assertEqual(self.rollup(ClientMonthlySales, "cliente_id"),
+                         {("C1", "2026-09-01"): (3, 11), ("C2", "2026-09-01"): (1, 5)})
+        # lo que ya no tiene ventas en el mes desaparece
+        with connection.cursor() as cur:
+            cur.execute("DELETE FROM ventas WHERE codigo = 'A' AND fecha < '2026-10-01'")
+        rollup_sales.rebuild_month(date(2026, 9, 1))
+        self.assertEqual(self.rollup(ItemMonthlySales, "codigo"), {})
+
+    def test_fila_confirmada_despues_de_la_marca(self):
+        self.insert((1, date(2026, 10, 2), "A", "C1", 1, 10), (3, date(2026, 10, 5), "A", "C1", 1, 20))
+        self.run_cmd()
+        self.assertEqual(SyncState.objects.get(name=rollup_sales.STATE).value, {"id": 3, "mes": "2026-10-01"})
+        # id 2 se asignó antes que el 3 pero su transacción confirmó después
+        self.insert((2, date(2026, 10, 3), "A", "C1", 1, 7))
+        self.run_cmd()
+        self.assertEqual(self.rollup(ItemMonthlySales, "codigo"), {("A", "2026-10-01"): (3, 37)})
+
+
+class BatchDetailTests(SimpleTestCase):
+    def setUp(self):
+        self.mget = mock.Mock(side_effect=lambda index, ids, _source: {"docs": [
+            {"_id": i, "found": True, "_source": {"codigo": i}} if i.startswith("A") else {"_id": i, "found": False}
+            for i in ids]})
+        self.hist = mock.Mock(side_effect=lambda model, col, ids: {i: [{"mes": "2026-09"}] for i in ids if i != "A2"})
+        for target, new in (("get_es", lambda profile="search": SimpleNamespace(mget=self.mget)),
+                            ("_histories", self.hist)):
+            patcher = mock.patch(f"search.api.{target}", new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, qs):
+        r = items_detail(RequestFactory().get("/?" + qs))
+        return r.status_code, json.loads(r.content)
+
+    def test_una_ida_a_es_y_otra_a_postgres(self):
+        status, body = self.get("ids=A1,X9,A2,A1&fields=codigo")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, {"items": [{"item": {"codigo": "A1"}, "historico_6m": [{"mes": "2026-09"}]},
+                                          {"item": {"codigo": "A2"}, "historico_6m": []}],
+                                "not_found": ["X9"]})
+        self.mget.assert_called_once_with(index="items", ids=["A1", "X9", "A2"], _source=["codigo"])
+        self.hist.assert_called_once_with(ItemMonthlySales, "codigo", ["A1", "A2"])
+
+    def test_limites(self):
+        self.assertEqual(self.get("ids=")[0], 400)
+        self.assertEqual(self.get("ids=" + ",".join(f"A{i}" for i in range(201)))[0], 400)
+        self.assertEqual(self.get("ids=" + ",".join(f"A{i}" for i in range(200)))[0], 200)
+        self.assertEqual(self.mget.call_count, 1)
+
+    def test_es_caido_503(self):
+        self.mget.side_effect = ConnectionError("caído")
+        self.assertEqual(self.get("ids=A1")[0], 503)